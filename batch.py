@@ -0,0 +1,309 @@
+""" Vectorised evaluation and move counting over batches of positions (needs NumPy)
+
+    A batch is an ``(N, 12)`` ``uint64`` array of bitboards, columns in piece code order (white pawn ... white king,
+    black pawn ... black king, see ``Piece.code``), bits as in ``bitboard`` (a1 = bit 0). Side to move, castling
+    rights (``game`` bit flags) and en passant target (0..63, -1 for none) are optional ``(N,)`` arrays next to it,
+    ``pack_games`` builds all four from ``Game`` objects.
+
+    Every function works column-wise on whole arrays, nothing loops over positions or squares in Python. Sliding
+    attacks are Kogge-Stone fills, one per direction. Rays of the same side in the same direction never overlap (a
+    ray stops at the first piece in its way), so summing the popcounts of the per-direction fills counts moves, not
+    just attacked squares. Legality (checks, pins, en passant discoveries, castling through attacked squares) is
+    worked out with the same masks. Positions with black to move are mirrored vertically and have their colours
+    swapped first, so the move counting only deals with white to move.
+"""
+
+from __future__ import annotations
+
+from typing import Optional, Sequence
+
+import numpy as np
+
+from board_layout import BOARD_SQUARES
+from evaluation import EG_TABLES, MAX_PHASE, MG_TABLES, MOBILITY_WEIGHTS, PHASE_WEIGHTS
+from pieces import BISHOP_KIND, KING_KIND, KNIGHT_KIND, PAWN_KIND, QUEEN_KIND, ROOK_KIND, WHITE
+
+U64 = np.uint64
+FULL = U64(0xFFFF_FFFF_FFFF_FFFF)
+EMPTY = U64(0)
+NOT_A_FILE = U64(0xFEFE_FEFE_FEFE_FEFE)
+NOT_H_FILE = U64(0x7F7F_7F7F_7F7F_7F7F)
+RANK_3, RANK_8 = U64(0xFF << 16), U64(0xFF << 56)
+
+# direction -> (shift, mask of the squares a shifted bit may land on), shifts are positive to the left
+NORTH, SOUTH, EAST, WEST = (8, FULL), (-8, FULL), (1, NOT_A_FILE), (-1, NOT_H_FILE)
+NORTH_EAST, NORTH_WEST, SOUTH_EAST, SOUTH_WEST = (9, NOT_A_FILE), (7, NOT_H_FILE), (-7, NOT_A_FILE), (-9, NOT_H_FILE)
+STRAIGHT = (NORTH, SOUTH, EAST, WEST)
+DIAGONAL = (NORTH_EAST, NORTH_WEST, SOUTH_EAST, SOUTH_WEST)
+# line through the king each direction runs along: pieces pinned on a line may only move along it
+LINES = {NORTH: 0, SOUTH: 0, EAST: 1, WEST: 1, NORTH_EAST: 2, SOUTH_WEST: 2, NORTH_WEST: 3, SOUTH_EAST: 3}
+KNIGHT_JUMPS = ((17, NOT_A_FILE), (15, NOT_H_FILE), (10, U64(0xFCFC_FCFC_FCFC_FCFC)), (6, U64(0x3F3F_3F3F_3F3F_3F3F)),
+                (-6, U64(0xFCFC_FCFC_FCFC_FCFC)), (-10, U64(0x3F3F_3F3F_3F3F_3F3F)), (-15, NOT_A_FILE),
+                (-17, NOT_H_FILE))
+
+# castling: (rights bit for white, squares that must be empty, squares that must not be attacked)
+CASTLES = ((1, U64(0x60), U64(0x70)), (2, U64(0x0E), U64(0x1C)))
+
+# piece code -> a1..h8 table, from the 0x88 tables the board keeps its incremental sums with
+MG_SQUARE_TABLES = np.array([[table[index] for index in BOARD_SQUARES] for table in MG_TABLES], dtype=np.int32)
+EG_SQUARE_TABLES = np.array([[table[index] for index in BOARD_SQUARES] for table in EG_TABLES], dtype=np.int32)
+PHASE_COLUMN_WEIGHTS = np.array(PHASE_WEIGHTS, dtype=np.int32)
+
+_SHIFTS = [U64(amount) for amount in range(64)]
+
+
+def _shift(bitboards: np.ndarray, direction: tuple[int, np.uint64]) -> np.ndarray:
+    amount, mask = direction
+    if amount > 0:
+        return (bitboards << _SHIFTS[amount]) & mask
+    return (bitboards >> _SHIFTS[-amount]) & mask
+
+
+def _ray(origins: np.ndarray, empty: np.ndarray, direction: tuple[int, np.uint64]) -> np.ndarray:
+    """ Squares reached sliding from ``origins`` in ``direction``, up to and including the first occupied square"""
+    amount, mask = direction
+    left = amount > 0
+    step = [_SHIFTS[abs(amount) * factor] for factor in (1, 2, 4)]
+
+    propagators = empty & mask
+    for shift in step:
+        if left:
+            origins = origins | propagators & (origins << shift)
+            propagators = propagators & (propagators << shift)
+        else:
+            origins = origins | propagators & (origins >> shift)
+            propagators = propagators & (propagators >> shift)
+    return _shift(origins, direction)
+
+
+if hasattr(np, "bitwise_count"):  # NumPy 2.0+
+    def popcount(bitboards: np.ndarray) -> np.ndarray:
+        return np.bitwise_count(bitboards).astype(np.int32)
+else:
+    def popcount(bitboards: np.ndarray) -> np.ndarray:
+        bitboards = bitboards - ((bitboards >> _SHIFTS[1]) & U64(0x5555_5555_5555_5555))
+        bitboards = (bitboards & U64(0x3333_3333_3333_3333)) + ((bitboards >> _SHIFTS[2]) & U64(0x3333_3333_3333_3333))
+        bitboards = (bitboards + (bitboards >> _SHIFTS[4])) & U64(0x0F0F_0F0F_0F0F_0F0F)
+        return ((bitboards * U64(0x0101_0101_0101_0101)) >> _SHIFTS[56]).astype(np.int32)
+
+
+def _byteswap(bitboards: np.ndarray) -> np.ndarray:
+    """ Mirror vertically (rank 1 <-> rank 8)"""
+    return bitboards.byteswap()
+
+
+def pack_games(games: Sequence) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """ (bitboards, white to move, castling rights, en passant target) arrays of ``games``"""
+    bitboards = np.array([game.board.bitboards for game in games], dtype=U64).reshape(len(games), 12)
+    white_to_move = np.array([game.turn == WHITE for game in games], dtype=bool)
+    castling_rights = np.array([game.castling_rights for game in games], dtype=np.uint8)
+    en_passant = np.array([-1 if game.en_passant_target is None
+                           else (game.en_passant_target >> 4) * 8 + (game.en_passant_target & 7) for game in games],
+                          dtype=np.int8)
+    return bitboards, white_to_move, castling_rights, en_passant
+
+
+def material(bitboards: np.ndarray, values: Sequence[int] = (100, 320, 330, 500, 900, 0)) -> np.ndarray:
+    """ White minus black material"""
+    counts = popcount(bitboards)
+    weights = np.array(list(values) + [-value for value in values], dtype=np.int32)
+    return counts @ weights
+
+
+def piece_square_scores(bitboards: np.ndarray, chunk_size: int = 1 << 16) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ (midgame, endgame, phase): what ``Board.mg_score`` / ``eg_score`` / ``phase`` hold, white positive"""
+    mg_scores = np.empty(len(bitboards), dtype=np.int32)
+    eg_scores = np.empty(len(bitboards), dtype=np.int32)
+
+    # one byte per square for a chunk at a time: (chunk, 12, 64)
+    for start in range(0, len(bitboards), chunk_size):
+        chunk = np.ascontiguousarray(bitboards[start:start + chunk_size], dtype="<u8")
+        squares = np.unpackbits(chunk.view(np.uint8).reshape(len(chunk), 12, 8), axis=2, bitorder="little")
+        mg_scores[start:start + chunk_size] = np.einsum("nps,ps->n", squares, MG_SQUARE_TABLES, dtype=np.int32)
+        eg_scores[start:start + chunk_size] = np.einsum("nps,ps->n", squares, EG_SQUARE_TABLES, dtype=np.int32)
+
+    phase = popcount(bitboards) @ PHASE_COLUMN_WEIGHTS
+    return mg_scores, eg_scores, phase
+
+
+def _attacks(pieces: list[np.ndarray], occupied: np.ndarray, white: bool) -> np.ndarray:
+    """ Every square attacked by one side's pieces (kind order list)"""
+    empty = ~occupied
+    pawns = pieces[PAWN_KIND]
+    if white:
+        attacks = _shift(pawns, NORTH_EAST) | _shift(pawns, NORTH_WEST)
+    else:
+        attacks = _shift(pawns, SOUTH_EAST) | _shift(pawns, SOUTH_WEST)
+
+    for jump in KNIGHT_JUMPS:
+        attacks |= _shift(pieces[KNIGHT_KIND], jump)
+    for direction in STRAIGHT + DIAGONAL:
+        attacks |= _shift(pieces[KING_KIND], direction)
+
+    diagonal = pieces[BISHOP_KIND] | pieces[QUEEN_KIND]
+    straight = pieces[ROOK_KIND] | pieces[QUEEN_KIND]
+    for direction in DIAGONAL:
+        attacks |= _ray(diagonal, empty, direction)
+    for direction in STRAIGHT:
+        attacks |= _ray(straight, empty, direction)
+    return attacks
+
+
+def attack_masks(bitboards: np.ndarray) -> np.ndarray:
+    """ ``(N, 2)``: squares attacked by white, by black"""
+    occupied = np.bitwise_or.reduce(bitboards, axis=1)
+    white = _attacks([bitboards[:, code] for code in range(6)], occupied, True)
+    black = _attacks([bitboards[:, code] for code in range(6, 12)], occupied, False)
+    return np.stack([white, black], axis=1)
+
+
+def mobility(bitboards: np.ndarray) -> np.ndarray:
+    """ White minus black ``evaluation.mobility``"""
+    occupied = np.bitwise_or.reduce(bitboards, axis=1)
+    empty = ~occupied
+    scores = np.zeros(len(bitboards), dtype=np.int32)
+
+    for base, sign in ((0, 1), (6, -1)):
+        not_own = ~np.bitwise_or.reduce(bitboards[:, base:base + 6], axis=1)
+        for jump in KNIGHT_JUMPS:
+            scores += sign * MOBILITY_WEIGHTS[KNIGHT_KIND] * popcount(_shift(bitboards[:, base + KNIGHT_KIND], jump)
+                                                                      & not_own)
+        for kind, directions in ((BISHOP_KIND, DIAGONAL), (ROOK_KIND, STRAIGHT), (QUEEN_KIND, STRAIGHT + DIAGONAL)):
+            for direction in directions:
+                rays = _ray(bitboards[:, base + kind], empty, direction)
+                scores += sign * MOBILITY_WEIGHTS[kind] * popcount(rays & not_own)
+    return scores
+
+
+def evaluate(bitboards: np.ndarray, white_to_move: Optional[np.ndarray] = None) -> np.ndarray:
+    """ ``evaluation.evaluate`` of every position: tapered piece-square score + mobility, side to move positive"""
+    mg_scores, eg_scores, phase = piece_square_scores(bitboards)
+    phase = np.minimum(phase, MAX_PHASE)
+    scores = (mg_scores * phase + eg_scores * (MAX_PHASE - phase)) // MAX_PHASE + mobility(bitboards)
+    if white_to_move is None:
+        return scores
+    return np.where(white_to_move, scores, -scores)
+
+
+def _white_to_move_view(bitboards: np.ndarray, white_to_move: np.ndarray, castling_rights: np.ndarray,
+                        en_passant: np.ndarray) -> tuple[list[np.ndarray], list[np.ndarray], np.ndarray, np.ndarray]:
+    """ (own pieces, enemy pieces, own castling rights (white bits), en passant bit) with the mover playing up"""
+    own, enemy = [], []
+    for kind in range(6):
+        white, black = bitboards[:, kind], bitboards[:, kind + 6]
+        own.append(np.where(white_to_move, white, _byteswap(black)))
+        enemy.append(np.where(white_to_move, black, _byteswap(white)))
+
+    castling_rights = castling_rights.astype(np.uint8)
+    rights = np.where(white_to_move, castling_rights & 3, (castling_rights >> 2) & 3)
+
+    squares = np.where(white_to_move, en_passant, en_passant ^ 56).astype(np.int64)
+    en_passant_bits = np.where(en_passant >= 0, U64(1) << np.maximum(squares, 0).astype(U64), EMPTY)
+    return own, enemy, rights, en_passant_bits
+
+
+def legal_move_counts(bitboards: np.ndarray, white_to_move: Optional[np.ndarray] = None,
+                      castling_rights: Optional[np.ndarray] = None,
+                      en_passant: Optional[np.ndarray] = None) -> np.ndarray:
+    """ Number of legal moves (``len(Game.legal_moves())``) of every position, promotions counting 4
+
+        Without ``white_to_move`` / ``castling_rights`` / ``en_passant`` it is white to move, no castling rights and
+        no en passant target in every position.
+    """
+    count = len(bitboards)
+    bitboards = np.asarray(bitboards, dtype=U64)
+    if white_to_move is None:
+        white_to_move = np.ones(count, dtype=bool)
+    if castling_rights is None:
+        castling_rights = np.zeros(count, dtype=np.uint8)
+    if en_passant is None:
+        en_passant = np.full(count, -1, dtype=np.int8)
+
+    own, enemy, rights, en_passant_bits = _white_to_move_view(bitboards, white_to_move, castling_rights,
+                                                              en_passant.astype(np.int64))
+    king = own[KING_KIND]
+    own_occupied = np.bitwise_or.reduce(own)
+    enemy_occupied = np.bitwise_or.reduce(enemy)
+    occupied = own_occupied | enemy_occupied
+    empty = ~occupied
+    not_own = ~own_occupied
+    enemy_diagonal = enemy[BISHOP_KIND] | enemy[QUEEN_KIND]
+    enemy_straight = enemy[ROOK_KIND] | enemy[QUEEN_KIND]
+
+    # King: may not step onto an attacked square, attacks are worked out with the king lifted off the board
+    enemy_attacks = _attacks(enemy, occupied ^ king, False)
+    king_targets = EMPTY
+    for direction in STRAIGHT + DIAGONAL:
+        king_targets = king_targets | _shift(king, direction)
+    moves = popcount(king_targets & not_own & ~enemy_attacks)
+
+    # Checks and pins, walking out from the king in every direction
+    checkers = (_shift(king, NORTH_EAST) | _shift(king, NORTH_WEST)) & enemy[PAWN_KIND]
+    knight_checkers = EMPTY
+    for jump in KNIGHT_JUMPS:
+        knight_checkers = knight_checkers | _shift(king, jump)
+    checkers = checkers | knight_checkers & enemy[KNIGHT_KIND]
+    check_mask = checkers
+
+    pinned_on = [EMPTY] * 4
+    for direction in STRAIGHT + DIAGONAL:
+        sliders = enemy_straight if direction in STRAIGHT else enemy_diagonal
+        ray = _ray(king, empty, direction)
+        slider_checkers = ray & sliders
+        checkers = checkers | slider_checkers
+        check_mask = check_mask | np.where(slider_checkers != EMPTY, ray, EMPTY)
+
+        blocker = ray & own_occupied
+        x_ray = _ray(king, empty | blocker, direction)
+        line = LINES[direction]
+        pinned_on[line] = pinned_on[line] | np.where(x_ray & sliders != EMPTY, blocker, EMPTY)
+
+    checker_count = popcount(checkers)
+    check_mask = np.where(checker_count == 0, FULL, check_mask)
+    pinned = pinned_on[0] | pinned_on[1] | pinned_on[2] | pinned_on[3]
+
+    def movable(pieces: np.ndarray, direction: tuple[int, np.uint64]) -> np.ndarray:
+        """ ``pieces`` not pinned, or pinned on the line ``direction`` runs along"""
+        return pieces & ~(pinned & ~pinned_on[LINES[direction]])
+
+    targets = not_own & check_mask
+    others = np.zeros(count, dtype=np.int32)
+
+    # Sliders
+    for kind, directions in ((BISHOP_KIND, DIAGONAL), (ROOK_KIND, STRAIGHT), (QUEEN_KIND, STRAIGHT + DIAGONAL)):
+        for direction in directions:
+            others += popcount(_ray(movable(own[kind], direction), empty, direction) & targets)
+
+    # Knights (a pinned knight can never move)
+    knights = own[KNIGHT_KIND] & ~pinned
+    for jump in KNIGHT_JUMPS:
+        others += popcount(_shift(knights, jump) & targets)
+
+    # Pawns, every move to the last rank counting as 4 promotions
+    pawns = own[PAWN_KIND]
+    single_pushes = _shift(movable(pawns, NORTH), NORTH) & empty
+    double_pushes = _shift(single_pushes & RANK_3, NORTH) & empty & check_mask
+    pawn_targets = [single_pushes & check_mask, double_pushes,
+                    _shift(movable(pawns, NORTH_EAST), NORTH_EAST) & enemy_occupied & check_mask,
+                    _shift(movable(pawns, NORTH_WEST), NORTH_WEST) & enemy_occupied & check_mask]
+    for pawn_moves in pawn_targets:
+        others += popcount(pawn_moves) + 3 * popcount(pawn_moves & RANK_8)
+
+    # En passant: replay the capture on the occupancy and look for any attack left on the king
+    captured = _shift(en_passant_bits, SOUTH)
+    for direction, back in ((NORTH_EAST, SOUTH_WEST), (NORTH_WEST, SOUTH_EAST)):
+        capturer = _shift(_shift(en_passant_bits, back) & pawns, direction) & en_passant_bits
+        source = _shift(capturer, back)
+        after = (occupied ^ source ^ captured) | capturer
+        exposed = (checkers & ~captured & ~(enemy_straight | enemy_diagonal)) != EMPTY  # leaper check not resolved
+        for ray_direction in STRAIGHT + DIAGONAL:
+            sliders = enemy_straight if ray_direction in STRAIGHT else enemy_diagonal
+            exposed |= _ray(king, ~after, ray_direction) & sliders & ~captured != EMPTY
+        others += ((capturer != EMPTY) & ~exposed).astype(np.int32)
+
+    # Castling: not out of, through or into check
+    for right, between, safe in CASTLES:
+        allowed = ((rights & right) != 0) & (occupied & between == EMPTY) & (enemy_attacks & safe == EMPTY)
+        others += allowed.astype(np.int32)
+
+    return moves + np.where(checker_count < 2, others, 0)
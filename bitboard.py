@@ -0,0 +1,358 @@
+""" Bitboard move generation backend
+
+    Squares are bits of a 64-bit int, a1 = bit 0, h1 = bit 7 ... h8 = bit 63. The board keeps one bitboard per
+    piece code (see ``Piece.code``) plus the occupancy of each colour, updated by ``Board._put`` / ``Board._remove``.
+
+    Knight, king and pawn attacks are per-square lookups. Slider attacks use PEXT-style tables: for every square and
+    every line through it (rank, file, diagonal, anti-diagonal) the attack set is stored keyed by the occupancy of
+    that line masked to its inner squares, so a rook is two dict lookups and a bishop two.
+
+    ``BitboardMoveGenerator`` generates the legal moves of a position straight from the bitboards: checkers and pins
+    are worked out as bit sets (x-rays from the king through one own piece), every target set is masked by them and
+    turned into encoded moves without going through the mailbox. Pawns move set-wise, en passant is checked by
+    redoing the slider attacks on the king with both pawns gone. Its per-piece methods keep the contract of Game's
+    mailbox generators (0x88 targets). Select it with ``Game(..., movegen="bitboard")``.
+"""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Optional
+
+from board_layout import (ALL_DIRECTIONS, BOARD_SQUARES, EAST, KNIGHT_OFFSETS, NORTH, NORTH_EAST, NORTH_WEST,
+                          OFF_BOARD, SOUTH, SOUTH_EAST, SOUTH_WEST, WEST)
+from pieces import (BISHOP_KIND, COLOUR_INDEX, KING_KIND, KNIGHT_KIND, PAWN_KIND, QUEEN_KIND, ROOK_KIND, Colour,
+                    Pawn, Piece)
+
+if TYPE_CHECKING:
+    from game import Board
+
+
+FULL = 0xFFFF_FFFF_FFFF_FFFF
+RANK_2, RANK_7 = 0xFF << 8, 0xFF << 48
+RANK_3, RANK_6 = 0xFF << 16, 0xFF << 40
+BACK_RANKS = 0xFF | 0xFF << 56
+NOT_A_FILE, NOT_H_FILE = 0xFEFE_FEFE_FEFE_FEFE, 0x7F7F_7F7F_7F7F_7F7F
+PROMOTIONS = (QUEEN_KIND << 14, ROOK_KIND << 14, BISHOP_KIND << 14, KNIGHT_KIND << 14)
+
+# castling: (rights bit, king from / to (0x88), rook square, squares that must be empty, squares not attacked)
+CASTLING = (((1, 0x04, 0x06, 7, 0x60, (5, 6)), (2, 0x04, 0x02, 0, 0x0E, (3, 2))),
+            ((4, 0x74, 0x76, 63, 0x60 << 56, (61, 62)), (8, 0x74, 0x72, 56, 0x0E << 56, (59, 58))))
+
+# 64 <-> 0x88 conversion
+TO_88 = BOARD_SQUARES
+TO_64: list[Optional[int]] = [None] * 128
+SQUARE_BITS = [0] * 128  # 0x88 index -> bit
+for _sq64, _sq88 in enumerate(BOARD_SQUARES):
+    TO_64[_sq88] = _sq64
+    SQUARE_BITS[_sq88] = 1 << _sq64
+
+
+def bits_to_squares(bitboard: int) -> list[int]:
+    """ Set bits -> 0x88 indexes, lowest bit first"""
+    squares = []
+    while bitboard:
+        lowest_bit = bitboard & -bitboard
+        squares.append(TO_88[lowest_bit.bit_length() - 1])
+        bitboard ^= lowest_bit
+    return squares
+
+
+def _leaper_table(offsets: tuple[int, ...]) -> list[int]:
+    table = []
+    for sq88 in BOARD_SQUARES:
+        attacks = 0
+        for offset in offsets:
+            if not (sq88 + offset) & OFF_BOARD:
+                attacks |= SQUARE_BITS[sq88 + offset]
+        table.append(attacks)
+    return table
+
+
+KNIGHT_ATTACKS = _leaper_table(KNIGHT_OFFSETS)
+KING_ATTACKS = _leaper_table(ALL_DIRECTIONS)
+PAWN_ATTACKS = (_leaper_table((NORTH_WEST, NORTH_EAST)), _leaper_table((SOUTH_WEST, SOUTH_EAST)))
+
+
+def _ray_attacks(sq88: int, directions: tuple[int, ...], occupied: int) -> int:
+    attacks = 0
+    for direction in directions:
+        target = sq88 + direction
+        while not target & OFF_BOARD:
+            attacks |= SQUARE_BITS[target]
+            if occupied & SQUARE_BITS[target]:
+                break
+            target += direction
+    return attacks
+
+
+def _line_table(sq88: int, directions: tuple[int, int]) -> tuple[int, dict[int, int]]:
+    """ (inner occupancy mask, masked occupancy -> attacks) for one line through ``sq88``"""
+    mask = 0
+    for direction in directions:
+        target = sq88 + direction
+        while not (target + direction) & OFF_BOARD:  # edge square never blocks anything behind it
+            mask |= SQUARE_BITS[target]
+            target += direction
+
+    table = {}
+    subset = 0
+    while True:  # carry-rippler over every subset of the mask
+        table[subset] = _ray_attacks(sq88, directions, subset)
+        subset = (subset - mask) & mask
+        if subset == 0:
+            break
+
+    return mask, table
+
+
+def _between(sq64_1: int, sq64_2: int) -> int:
+    """ Squares strictly between two squares on a line, 0 if they aren't on one"""
+    sq88_1, sq88_2 = TO_88[sq64_1], TO_88[sq64_2]
+    for direction in ALL_DIRECTIONS:
+        between, target = 0, sq88_1 + direction
+        while not target & OFF_BOARD:
+            if target == sq88_2:
+                return between
+            between |= SQUARE_BITS[target]
+            target += direction
+    return 0
+
+
+BETWEEN = [[_between(sq64_1, sq64_2) for sq64_2 in range(64)] for sq64_1 in range(64)]
+# encoded move parts of a 64 square: from square, to square (see game.encode_move)
+MOVE_FROM = list(TO_88)
+MOVE_TO = [sq88 << 7 for sq88 in TO_88]
+
+ROOK_LINES = [(_line_table(sq88, (EAST, WEST)), _line_table(sq88, (NORTH, SOUTH))) for sq88 in BOARD_SQUARES]
+BISHOP_LINES = [(_line_table(sq88, (NORTH_EAST, SOUTH_WEST)), _line_table(sq88, (NORTH_WEST, SOUTH_EAST)))
+                for sq88 in BOARD_SQUARES]
+
+
+def rook_attacks(sq64: int, occupied: int) -> int:
+    (mask_1, table_1), (mask_2, table_2) = ROOK_LINES[sq64]
+    return table_1[occupied & mask_1] | table_2[occupied & mask_2]
+
+
+def bishop_attacks(sq64: int, occupied: int) -> int:
+    (mask_1, table_1), (mask_2, table_2) = BISHOP_LINES[sq64]
+    return table_1[occupied & mask_1] | table_2[occupied & mask_2]
+
+
+def queen_attacks(sq64: int, occupied: int) -> int:
+    return rook_attacks(sq64, occupied) | bishop_attacks(sq64, occupied)
+
+
+def piece_attacks(kind: int, side: int, sq64: int, occupied: int) -> int:
+    if kind == PAWN_KIND:
+        return PAWN_ATTACKS[side][sq64]
+    elif kind == KNIGHT_KIND:
+        return KNIGHT_ATTACKS[sq64]
+    elif kind == BISHOP_KIND:
+        return bishop_attacks(sq64, occupied)
+    elif kind == ROOK_KIND:
+        return rook_attacks(sq64, occupied)
+    elif kind == QUEEN_KIND:
+        return queen_attacks(sq64, occupied)
+    return KING_ATTACKS[sq64]
+
+
+def is_square_attacked(board: Board, sq64: int, side: int) -> bool:
+    """ Reverse lookup: put every piece type on ``sq64`` and intersect its attacks with ``side``'s pieces"""
+    bitboards = board.bitboards
+    base = 6 * side
+
+    if PAWN_ATTACKS[side ^ 1][sq64] & bitboards[base + PAWN_KIND]:
+        return True
+    if KNIGHT_ATTACKS[sq64] & bitboards[base + KNIGHT_KIND]:
+        return True
+    if KING_ATTACKS[sq64] & bitboards[base + KING_KIND]:
+        return True
+
+    occupied = board.occupancy[0] | board.occupancy[1]
+    queens = bitboards[base + QUEEN_KIND]
+    if rook_attacks(sq64, occupied) & (bitboards[base + ROOK_KIND] | queens):
+        return True
+    return bool(bishop_attacks(sq64, occupied) & (bitboards[base + BISHOP_KIND] | queens))
+
+
+def pawn_targets(board: Board, sq64: int, side: int, en_passant_target: Optional[int] = None) -> int:
+    """ Pushes and captures (en passant included) of the pawn on ``sq64``"""
+    occupied = board.occupancy[0] | board.occupancy[1]
+    bit = 1 << sq64
+
+    if side == 0:
+        targets = (bit << 8) & ~occupied
+        if bit & RANK_2 and targets:
+            targets |= (bit << 16) & ~occupied
+    else:
+        targets = (bit >> 8) & ~occupied
+        if bit & RANK_7 and targets:
+            targets |= (bit >> 16) & ~occupied
+
+    capturable = board.occupancy[side ^ 1]
+    if en_passant_target is not None:
+        capturable |= SQUARE_BITS[en_passant_target]
+
+    return targets | PAWN_ATTACKS[side][sq64] & capturable
+
+
+def _add_moves(moves: list[int], from_part: int, targets: int) -> None:
+    while targets:
+        bit = targets & -targets
+        moves.append(from_part | MOVE_TO[bit.bit_length() - 1])
+        targets ^= bit
+
+
+def _add_pawn_moves(moves: list[int], targets: int, shift: int) -> None:
+    """ Moves of the pawns that reach ``targets`` from ``shift`` squares back (negative for black), promotions x4"""
+    while targets:
+        bit = targets & -targets
+        to64 = bit.bit_length() - 1
+        move = MOVE_FROM[to64 - shift] | MOVE_TO[to64]
+        if bit & BACK_RANKS:
+            moves.extend(move | promotion for promotion in PROMOTIONS)
+        else:
+            moves.append(move)
+        targets ^= bit
+
+
+class BitboardMoveGenerator:
+    """ Game move generation backed by the board's bitboards; ``legal_moves`` returns encoded moves, the per-piece
+        methods 0x88 indexes
+    """
+
+    def __init__(self, game):
+        self.game = game
+
+    def legal_moves(self) -> list[int]:
+        """ Every legal move of the side to move (encoded, see game.encode_move)"""
+        game = self.game
+        board = game.board
+        bitboards = board.bitboards
+        side = COLOUR_INDEX[game.turn]
+        base, enemy_base = 6 * side, 6 * (side ^ 1)
+        own, enemy = board.occupancy[side], board.occupancy[side ^ 1]
+        occupied = own | enemy
+        not_own = ~own & FULL
+
+        king_bit = bitboards[base + KING_KIND]
+        king = king_bit.bit_length() - 1
+        enemy_pawns, enemy_knights = bitboards[enemy_base + PAWN_KIND], bitboards[enemy_base + KNIGHT_KIND]
+        enemy_king = bitboards[enemy_base + KING_KIND]
+        enemy_queens = bitboards[enemy_base + QUEEN_KIND]
+        enemy_straight = bitboards[enemy_base + ROOK_KIND] | enemy_queens
+        enemy_diagonal = bitboards[enemy_base + BISHOP_KIND] | enemy_queens
+
+        def attacked(sq64: int, occupied: int) -> bool:
+            return bool(PAWN_ATTACKS[side][sq64] & enemy_pawns or KNIGHT_ATTACKS[sq64] & enemy_knights
+                        or KING_ATTACKS[sq64] & enemy_king or rook_attacks(sq64, occupied) & enemy_straight
+                        or bishop_attacks(sq64, occupied) & enemy_diagonal)
+
+        moves = []
+
+        # King, checked with itself lifted off the board so it can't hide behind itself
+        from_part = MOVE_FROM[king]
+        targets = KING_ATTACKS[king] & not_own
+        without_king = occupied ^ king_bit
+        while targets:
+            bit = targets & -targets
+            to64 = bit.bit_length() - 1
+            if not attacked(to64, without_king):
+                moves.append(from_part | MOVE_TO[to64])
+            targets ^= bit
+
+        checkers = (PAWN_ATTACKS[side][king] & enemy_pawns | KNIGHT_ATTACKS[king] & enemy_knights
+                    | rook_attacks(king, occupied) & enemy_straight | bishop_attacks(king, occupied) & enemy_diagonal)
+        if checkers & (checkers - 1):  # double check, only the king moves
+            return moves
+
+        if checkers:
+            checker = checkers.bit_length() - 1
+            check_mask = BETWEEN[king][checker] | checkers
+        else:
+            check_mask = FULL
+            rights = game.castling_rights
+            own_rooks = bitboards[base + ROOK_KIND]
+            for right, king_from, king_to, rook, empty, crossed in CASTLING[side]:
+                if rights & right and MOVE_FROM[king] == king_from and own_rooks >> rook & 1 and \
+                        not occupied & empty and not any(attacked(sq64, occupied) for sq64 in crossed):
+                    moves.append(king_from | king_to << 7)
+
+        # pins: enemy sliders seeing the king through exactly one own piece, which may only move along that line
+        pinned, pin_masks = 0, {}
+        snipers = rook_attacks(king, enemy) & enemy_straight | bishop_attacks(king, enemy) & enemy_diagonal
+        while snipers:
+            sniper_bit = snipers & -snipers
+            between = BETWEEN[king][sniper_bit.bit_length() - 1]
+            blockers = between & occupied
+            if blockers and not blockers & (blockers - 1) and blockers & own:
+                pinned |= blockers
+                pin_masks[blockers] = between | sniper_bit
+            snipers ^= sniper_bit
+
+        target_mask = not_own & check_mask
+        for kind, attacks in ((KNIGHT_KIND, None), (BISHOP_KIND, bishop_attacks), (ROOK_KIND, rook_attacks),
+                              (QUEEN_KIND, queen_attacks)):
+            pieces = bitboards[base + kind]
+            if kind == KNIGHT_KIND:
+                pieces &= ~pinned  # a pinned knight can never move
+            while pieces:
+                bit = pieces & -pieces
+                sq64 = bit.bit_length() - 1
+                targets = (KNIGHT_ATTACKS[sq64] if attacks is None else attacks(sq64, occupied)) & target_mask
+                if bit & pinned:
+                    targets &= pin_masks[bit]
+                _add_moves(moves, MOVE_FROM[sq64], targets)
+                pieces ^= bit
+
+        # Pawns: unpinned ones set-wise, pinned ones one at a time along their pin line
+        pawns = bitboards[base + PAWN_KIND]
+        empty = ~occupied & FULL
+        groups = [(pawns & ~pinned, check_mask)]
+        pinned_pawns = pawns & pinned
+        while pinned_pawns:
+            bit = pinned_pawns & -pinned_pawns
+            groups.append((bit, check_mask & pin_masks[bit]))
+            pinned_pawns ^= bit
+
+        for group, mask in groups:
+            if side == 0:
+                single = group << 8 & empty
+                _add_pawn_moves(moves, single & mask, 8)
+                _add_pawn_moves(moves, (single & RANK_3) << 8 & empty & mask, 16)
+                _add_pawn_moves(moves, (group & NOT_H_FILE) << 9 & enemy & mask, 9)
+                _add_pawn_moves(moves, (group & NOT_A_FILE) << 7 & enemy & mask, 7)
+            else:
+                single = group >> 8 & empty
+                _add_pawn_moves(moves, single & mask, -8)
+                _add_pawn_moves(moves, (single & RANK_6) >> 8 & empty & mask, -16)
+                _add_pawn_moves(moves, (group & NOT_H_FILE) >> 7 & enemy & mask, -7)
+                _add_pawn_moves(moves, (group & NOT_A_FILE) >> 9 & enemy & mask, -9)
+
+        # en passant: made on the bitboards and the king's attackers looked up again, both pawns leave their squares
+        if game.en_passant_target is not None:
+            target = TO_64[game.en_passant_target]
+            captured_bit = 1 << (target - 8 if side == 0 else target + 8)
+            capturers = PAWN_ATTACKS[side ^ 1][target] & pawns
+            while capturers:
+                bit = capturers & -capturers
+                after = occupied ^ bit ^ captured_bit | 1 << target
+                if not (PAWN_ATTACKS[side][king] & enemy_pawns & ~captured_bit or KNIGHT_ATTACKS[king] & enemy_knights
+                        or rook_attacks(king, after) & enemy_straight or bishop_attacks(king, after) & enemy_diagonal):
+                    moves.append(MOVE_FROM[bit.bit_length() - 1] | MOVE_TO[target])
+                capturers ^= bit
+
+        return moves
+
+    def pawn_moves(self, pawn: Pawn, board: Board) -> list[int]:
+        return bits_to_squares(pawn_targets(board, TO_64[pawn.square], COLOUR_INDEX[pawn.colour],
+                                            self.game.en_passant_target))
+
+    def piece_moves(self, piece: Piece, board: Board) -> list[int]:
+        side = COLOUR_INDEX[piece.colour]
+        occupied = board.occupancy[0] | board.occupancy[1]
+        attacks = piece_attacks(piece.kind, side, TO_64[piece.square], occupied)
+        return bits_to_squares(attacks & ~board.occupancy[side])
+
+    def is_attacked(self, board: Board, index: int, by_colour: Colour) -> bool:
+        return is_square_attacked(board, TO_64[index], COLOUR_INDEX[by_colour])
@@ -0,0 +1,139 @@
+""" 0x88 mailbox layout
+
+    Squares are small integers laid out as ``rank * 16 + file`` (both 0 indexed), which leaves a phantom board
+    to the right of the real one:
+
+              a    b    c    d    e    f    g    h
+        8   112  113  114  115  116  117  118  119   | 120 - 127 (off board)
+        7    96   97   98   99  100  101  102  103   | 104 - 111
+        ...
+        2    16   17   18   19   20   21   22   23   |  24 -  31
+        1     0    1    2    3    4    5    6    7   |   8 -  15
+
+    Any index that has left the board (including negative ones) has one of the bits in ``OFF_BOARD`` set, so bounds
+    checks are a single ``index & OFF_BOARD`` instead of a raised ``InvalidPosition``.
+"""
+
+from __future__ import annotations
+
+from typing import Optional
+
+
+OFF_BOARD = 0x88
+FILES = "abcdefgh"
+
+# Directions
+NORTH, SOUTH, EAST, WEST = 16, -16, 1, -1
+NORTH_EAST, NORTH_WEST, SOUTH_EAST, SOUTH_WEST = 17, 15, -15, -17
+
+STRAIGHT_DIRECTIONS = (NORTH, SOUTH, EAST, WEST)
+DIAGONAL_DIRECTIONS = (NORTH_EAST, NORTH_WEST, SOUTH_EAST, SOUTH_WEST)
+ALL_DIRECTIONS = STRAIGHT_DIRECTIONS + DIAGONAL_DIRECTIONS
+KNIGHT_OFFSETS = (33, 31, 18, 14, -14, -18, -31, -33)
+
+# Every real square, a1 - h1, a2 - h2 ... a8 - h8
+BOARD_SQUARES = tuple(rank * 16 + file for rank in range(8) for file in range(8))
+
+# index -> "e4" (None for off-board indexes) and "e4" -> index
+SQUARE_NAMES: list[Optional[str]] = [None] * 128
+for _index in BOARD_SQUARES:
+    SQUARE_NAMES[_index] = FILES[_index & 7] + str((_index >> 4) + 1)
+SQUARE_INDEXES = {name: index for index, name in enumerate(SQUARE_NAMES) if name is not None}
+
+
+def square_index(notation: str) -> Optional[int]:
+    """ "e4" -> 52, returns None for anything that isn't a square"""
+    return SQUARE_INDEXES.get(notation)
+
+
+def xy_to_index(x: int, y: int) -> int:
+    """ 1 indexed (x, y) board coordinates -> 0x88 index"""
+    return (y - 1) * 16 + (x - 1)
+
+
+# Ray groups (index into Square.rays), ALL_RAYS follows ALL_DIRECTIONS
+STRAIGHT_RAYS, DIAGONAL_RAYS, ALL_RAYS = 0, 1, 2
+OPPOSITE_RAYS = (1, 0, 3, 2, 7, 6, 5, 4)  # ray index -> ray index pointing the other way
+
+
+def _walk(index: int, direction: int) -> tuple[int, ...]:
+    """ Every square from ``index`` (excluded) to the edge of the board along ``direction``"""
+    ray = []
+    index += direction
+    while not index & OFF_BOARD:
+        ray.append(index)
+        index += direction
+    return tuple(ray)
+
+
+def _leaps(index: int, offsets: tuple[int, ...]) -> tuple[int, ...]:
+    return tuple(index + offset for offset in offsets if not (index + offset) & OFF_BOARD)
+
+
+class Square:
+    """ Interned, immutable board square
+
+        One instance per square (see ``SQUARES``), carrying everything move generation needs as tuples of 0x88
+        indexes so generators never allocate coordinates or bounds check:
+
+            knight_targets, king_targets
+            pawn_pushes[side], pawn_captures[side]      (side: 0 = white, 1 = black, double push included)
+            rays[STRAIGHT_RAYS | DIAGONAL_RAYS | ALL_RAYS]  (one tuple per direction, nearest square first)
+
+        Compares equal to its 0x88 index, which is also its hash, and to BoardCoordinates (unhashable, so sets and
+        dicts never see the two mixed), so it can be used wherever a BoardCoordinates was returned before.
+    """
+
+    __slots__ = ("index", "x", "y", "notation", "knight_targets", "king_targets", "pawn_pushes", "pawn_captures",
+                 "rays")
+
+    def __init__(self, index: int):
+        rank = index >> 4
+        straight = tuple(_walk(index, direction) for direction in STRAIGHT_DIRECTIONS)
+        diagonal = tuple(_walk(index, direction) for direction in DIAGONAL_DIRECTIONS)
+
+        for name, value in (
+                ("index", index),
+                ("x", (index & 7) + 1),
+                ("y", rank + 1),
+                ("notation", SQUARE_NAMES[index]),
+                ("knight_targets", _leaps(index, KNIGHT_OFFSETS)),
+                ("king_targets", _leaps(index, ALL_DIRECTIONS)),
+                ("pawn_pushes", (_leaps(index, (NORTH, 2 * NORTH) if rank == 1 else (NORTH,)),
+                                 _leaps(index, (SOUTH, 2 * SOUTH) if rank == 6 else (SOUTH,)))),
+                ("pawn_captures", (_leaps(index, (NORTH_WEST, NORTH_EAST)), _leaps(index, (SOUTH_WEST, SOUTH_EAST)))),
+                ("rays", (straight, diagonal, straight + diagonal))):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Square is immutable")
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, Square):
+            return self is other
+        elif isinstance(other, int):
+            return self.index == other
+        elif hasattr(other, "x") and hasattr(other, "y"):  # BoardCoordinates
+            return self.x == other.x and self.y == other.y
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return self.index
+
+    def __str__(self) -> str:
+        return self.notation
+
+    def __repr__(self) -> str:
+        return f"Square({self.notation})"
+
+    def get_notation(self) -> str:
+        return self.notation
+
+    def get_xy(self) -> tuple[int, int]:
+        return self.x, self.y
+
+
+# 0x88 index -> Square (None off the board)
+SQUARES: list[Optional[Square]] = [None] * 128
+for _index in BOARD_SQUARES:
+    SQUARES[_index] = Square(_index)
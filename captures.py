@@ -0,0 +1,128 @@
+""" Capture generation and static exchange evaluation for quiescence search
+
+    ``generate_captures`` is a generator working off the board's bitboards: victims are visited from the most
+    valuable down and for each one the attackers from the least valuable up, so the first moves a search sees are
+    the MVV-LVA best without the full legal move list being built. It yields pseudo-legal moves, the caller checks
+    the king is not left in check after pushing them (quiescence nodes rarely get past the first few moves anyway).
+
+    ``static_exchange`` plays out every capture on the target square, least valuable attacker first, and returns the
+    material the side making the move wins (negative: the capture loses material).
+"""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Iterator
+
+from bitboard import KING_ATTACKS, KNIGHT_ATTACKS, PAWN_ATTACKS, TO_64, TO_88, bishop_attacks, rook_attacks
+from pieces import BISHOP_KIND, COLOUR_INDEX, KING_KIND, KNIGHT_KIND, PAWN_KIND, QUEEN_KIND, ROOK_KIND
+
+if TYPE_CHECKING:
+    from game import Board, Game
+
+
+SEE_VALUES = (100, 320, 330, 500, 900, 20000)  # by kind
+
+VICTIMS = (QUEEN_KIND, ROOK_KIND, BISHOP_KIND, KNIGHT_KIND, PAWN_KIND)
+ATTACKERS = (PAWN_KIND, KNIGHT_KIND, BISHOP_KIND, ROOK_KIND, QUEEN_KIND, KING_KIND)
+
+LAST_RANKS = (0xFF << 56, 0xFF)  # promotion rank by side
+FULL = 0xFFFF_FFFF_FFFF_FFFF
+
+
+def attackers_of(board: Board, side: int, sq64: int, occupied: int) -> list[int]:
+    """ Per kind bitboards of ``side``'s pieces attacking ``sq64`` given ``occupied`` (which may have pieces lifted)"""
+    bitboards = board.bitboards
+    base = 6 * side
+    diagonal = bishop_attacks(sq64, occupied)
+    straight = rook_attacks(sq64, occupied)
+    return [PAWN_ATTACKS[side ^ 1][sq64] & bitboards[base + PAWN_KIND] & occupied,
+            KNIGHT_ATTACKS[sq64] & bitboards[base + KNIGHT_KIND] & occupied,
+            diagonal & bitboards[base + BISHOP_KIND] & occupied,
+            straight & bitboards[base + ROOK_KIND] & occupied,
+            (diagonal | straight) & bitboards[base + QUEEN_KIND] & occupied,
+            KING_ATTACKS[sq64] & bitboards[base + KING_KIND] & occupied]
+
+
+def generate_captures(game: Game) -> Iterator[int]:
+    """ Captures (most valuable victim first, then least valuable attacker), en passant and queen promotions"""
+    board = game.board
+    bitboards = board.bitboards
+    side = COLOUR_INDEX[game.turn]
+    occupied = board.occupancy[0] | board.occupancy[1]
+    last_rank = LAST_RANKS[side]
+
+    for victim_kind in VICTIMS:
+        victims = bitboards[6 * (side ^ 1) + victim_kind]
+        while victims:
+            lowest_bit = victims & -victims
+            victims ^= lowest_bit
+            target = lowest_bit.bit_length() - 1
+            move_pos = TO_88[target]
+            promotion = QUEEN_KIND << 14 if lowest_bit & last_rank else 0
+
+            for kind, attackers in enumerate(attackers_of(board, side, target, occupied)):
+                while attackers:
+                    attacker = attackers & -attackers
+                    attackers ^= attacker
+                    move = TO_88[attacker.bit_length() - 1] | move_pos << 7
+                    yield move | promotion if kind == PAWN_KIND else move
+
+    if game.en_passant_target is not None:
+        target = TO_64[game.en_passant_target]
+        pawns = PAWN_ATTACKS[side ^ 1][target] & bitboards[6 * side + PAWN_KIND]
+        while pawns:
+            pawn = pawns & -pawns
+            pawns ^= pawn
+            yield TO_88[pawn.bit_length() - 1] | game.en_passant_target << 7
+
+    # quiet queen promotions
+    pawns = bitboards[6 * side + PAWN_KIND]
+    pushed = ((pawns << 8) & FULL if side == 0 else pawns >> 8) & ~occupied & last_rank
+    while pushed:
+        target = pushed & -pushed
+        pushed ^= target
+        sq64 = target.bit_length() - 1
+        yield TO_88[sq64 - 8 if side == 0 else sq64 + 8] | TO_88[sq64] << 7 | QUEEN_KIND << 14
+
+
+def static_exchange(board: Board, move: int) -> int:
+    """ Material won by ``move`` (a capture or promotion) once every recapture on its square has been played out"""
+    current_pos, move_pos, promotion = move & 0x7F, move >> 7 & 0x7F, move >> 14
+    squares = board.squares
+    piece = squares[current_pos]
+    victim = squares[move_pos]
+    source, target = TO_64[current_pos], TO_64[move_pos]
+
+    occupied = (board.occupancy[0] | board.occupancy[1]) ^ (1 << source)
+    if victim is not None:
+        gains = [SEE_VALUES[victim.kind]]
+    elif piece.kind == PAWN_KIND and (move_pos - current_pos) & 7:  # en passant
+        gains = [SEE_VALUES[PAWN_KIND]]
+        occupied ^= 1 << TO_64[move_pos - piece.push_offset]
+    else:
+        gains = [0]
+
+    on_square = SEE_VALUES[piece.kind]  # value of the piece that would be captured next
+    if promotion:
+        gains[0] += SEE_VALUES[promotion] - SEE_VALUES[PAWN_KIND]
+        on_square = SEE_VALUES[promotion]
+
+    side = COLOUR_INDEX[piece.colour] ^ 1
+    while True:
+        attackers = attackers_of(board, side, target, occupied)
+        kind = next((kind for kind in ATTACKERS if attackers[kind]), None)
+        if kind is None:
+            break
+        if kind == KING_KIND and any(attackers_of(board, side ^ 1, target, occupied ^ attackers[kind])):
+            break  # the king can't recapture into a defended square
+
+        gains.append(on_square - gains[-1])
+        attacker = attackers[kind]
+        occupied ^= attacker & -attacker
+        on_square = SEE_VALUES[kind]
+        side ^= 1
+
+    # either side can stop capturing when it would lose material
+    for index in range(len(gains) - 1, 0, -1):
+        gains[index - 1] = -max(-gains[index - 1], gains[index])
+    return gains[0]
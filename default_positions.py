@@ -34,9 +34,10 @@ starting_board = {
     "a2": "p", "b2": "p", "c2": "p", "d2": "p", "e2": "p", "f2": "p", "g2": "p", "h2": "p",
     "a1": "p", "b1": "p", "c1": "p", "d1": "p", "e1": "p", "f1": "p", "g1": "p", "h1": "p"}
 
-starting_fen = None
+starting_fen = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
 
-starting_png = None
+starting_png = ('[Event "?"]\n[Site "?"]\n[Date "????.??.??"]\n[Round "?"]\n[White "?"]\n[Black "?"]\n'
+                '[Result "*"]\n\n*\n')
 
 
 
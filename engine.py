@@ -0,0 +1,348 @@
+""" Alpha-beta search
+
+    Negamax with alpha-beta pruning and iterative deepening, searching in place on a ``Game`` with push / pop (no
+    board copies). Every finished iteration reports its depth, score, nodes and nodes per second, the best move of the
+    deepest finished iteration is returned together with the piece / target square to hand to ``Game.make_move``.
+
+    Scores are in centipawns from the side to move's point of view, mates are ``MATE_SCORE - plies to mate``.
+
+    python engine.py --depth 5
+    python engine.py --fen "<fen>" --time 10
+    python engine.py --book book.bin         play a Polyglot book move if the position is in the book
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from board_layout import SQUARES, Square
+from captures import generate_captures, static_exchange
+from evaluation import evaluate
+from game import Game, move_from, move_notation, move_to
+from ordering import MoveOrderer
+from pieces import Piece
+from transposition import EXACT, LOWER_BOUND, UPPER_BOUND, TranspositionTable
+
+INFINITY = 1_000_000
+MATE_SCORE = 100_000
+MAX_PLY = 128
+
+CHECK_EVERY = 1024  # nodes between time / node limit checks
+
+
+@dataclass
+class SearchInfo:
+    """ Result of one finished iteration"""
+    depth: int
+    score: int
+    nodes: int
+    time: float
+    pv: list[int]
+
+    @property
+    def nps(self) -> int:
+        return int(self.nodes / self.time) if self.time > 0 else 0
+
+    def __str__(self):
+        return (f"depth {self.depth} score {self.score} nodes {self.nodes} nps {self.nps} time {self.time:.2f}s "
+                f"pv {' '.join(move_notation(move) for move in self.pv)}")
+
+
+@dataclass
+class SearchResult:
+    move: Optional[int]  # encoded, None if there are no legal moves
+    piece: Optional[Piece]  # Game.make_move(result.piece, result.position) plays the move
+    position: Optional[Square]
+    score: int
+    depth: int
+    nodes: int
+    iterations: list[SearchInfo] = field(default_factory=list)
+
+    @property
+    def pv(self) -> list[int]:
+        return self.iterations[-1].pv if self.iterations else []
+
+
+class SearchAborted(Exception):
+    """raised inside the tree when the time or node limit is hit"""
+
+
+class Engine:
+    def __init__(self, game: Game, hash_mb: float = 16, tt: Optional[TranspositionTable] = None):
+        self.game = game
+        self.tt = tt if tt is not None else TranspositionTable(hash_mb)
+        self.ordering = MoveOrderer()
+        self.nodes = 0
+        self._deadline: Optional[float] = None
+        self._node_limit: Optional[int] = None
+        self._next_check = CHECK_EVERY
+        self._pv_table: list[list[int]] = [[] for _ in range(MAX_PLY + 1)]
+        self._previous_pv: list[int] = []
+        self._following_pv = False
+        self._path_keys: list[int] = []
+
+    def search(self, max_depth: int = MAX_PLY, time_limit: Optional[float] = None, node_limit: Optional[int] = None,
+               on_iteration: Optional[Callable[[SearchInfo], None]] = None) -> SearchResult:
+        """ Iterative deepening up to ``max_depth``, ``time_limit`` seconds or ``node_limit`` nodes
+
+            An iteration cut off by a limit is thrown away, except for depth 1 which always finishes so there is a
+            move to return (``max_depth`` below 1 searches depth 1).
+        """
+        game = self.game
+        start = time.perf_counter()
+        self.nodes = 0
+        self._node_limit = node_limit
+        self._deadline = start + time_limit if time_limit is not None else None
+        self._next_check = min(CHECK_EVERY, node_limit) if node_limit is not None else CHECK_EVERY
+        self._previous_pv = []
+        self._path_keys = [game.zobrist_key]
+        self.tt.new_search()
+        self.ordering.new_search()
+        stack_size = len(game._undo_stack)
+
+        result = SearchResult(None, None, None, 0, 0, 0)
+        if not game.legal_moves():
+            result.score = -MATE_SCORE if game.check_if_in_check() else 0
+            return result
+
+        for depth in range(1, max(1, min(max_depth, MAX_PLY)) + 1):
+            self._following_pv = True
+            try:
+                score = self._negamax(depth, 0, -INFINITY, INFINITY, limits=depth > 1)
+            except SearchAborted:
+                while len(game._undo_stack) > stack_size:
+                    game.pop()
+                del self._path_keys[1:]
+                break
+
+            info = SearchInfo(depth, score, self.nodes, time.perf_counter() - start, list(self._pv_table[0]))
+            self._previous_pv = info.pv
+            result.iterations.append(info)
+            result.move, result.score, result.depth = info.pv[0], score, depth
+            if on_iteration is not None:
+                on_iteration(info)
+
+            if abs(score) >= MATE_SCORE - MAX_PLY:  # forced mate found, deeper won't change it
+                break
+            if self._deadline is not None and time.perf_counter() >= self._deadline:
+                break
+
+        result.nodes = self.nodes
+        result.piece = game.board.squares[move_from(result.move)]
+        result.position = SQUARES[move_to(result.move)]
+        return result
+
+    def _check_limits(self) -> None:
+        self._next_check = self.nodes + CHECK_EVERY
+        if self._node_limit is not None:
+            self._next_check = min(self._next_check, self._node_limit)
+        if self._node_limit is not None and self.nodes >= self._node_limit:
+            raise SearchAborted
+        if self._deadline is not None and time.perf_counter() >= self._deadline:
+            raise SearchAborted
+
+    def _is_repetition(self) -> bool:
+        """ Position already seen on the search path since the last capture / pawn move"""
+        keys = self._path_keys
+        key = keys[-1]
+        for index in range(len(keys) - 3, max(-1, len(keys) - 2 - self.game.halfmove_clock), -2):
+            if keys[index] == key:
+                return True
+        return False
+
+    def _negamax(self, depth: int, ply: int, alpha: int, beta: int, limits: bool = True) -> int:
+        if depth <= 0 or ply >= MAX_PLY:
+            return self._quiescence(ply, alpha, beta, limits)
+
+        game = self.game
+        self.nodes += 1
+        if limits and self.nodes >= self._next_check:
+            self._check_limits()
+
+        pv = self._pv_table[ply]
+        pv.clear()
+
+        if ply and (game.halfmove_clock >= 100 or self._is_repetition()):
+            return 0
+
+        key = self._path_keys[-1]
+        entry = self.tt.probe(key)
+        hash_move = None
+        if entry is not None:
+            hash_move, entry_depth, score, bound = entry
+            if ply and entry_depth >= depth:
+                score = _score_from_tt(score, ply)
+                if bound == EXACT or bound == LOWER_BOUND and score >= beta or bound == UPPER_BOUND and score <= alpha:
+                    return score
+
+        moves = game.legal_moves()
+        if not moves:
+            return -MATE_SCORE + ply if game.check_if_in_check() else 0
+
+        # while still on the previous iteration's principal variation, search its move first
+        if self._following_pv:
+            if ply < len(self._previous_pv) and self._previous_pv[ply] in moves:
+                hash_move = self._previous_pv[ply]
+            else:
+                self._following_pv = False
+        moves = self.ordering.order(game, moves, ply, hash_move)
+
+        original_alpha = alpha
+        best_score = -INFINITY
+        best_move = None
+        child_pv = self._pv_table[ply + 1]
+        path_keys = self._path_keys
+        for move in moves:
+            game.push(move)
+            path_keys.append(game.zobrist_key)
+            score = -self._negamax(depth - 1, ply + 1, -beta, -alpha, limits)
+            path_keys.pop()
+            game.pop()
+            self._following_pv = False
+
+            if score > best_score:
+                best_score, best_move = score, move
+                if score > alpha:
+                    alpha = score
+                    pv[:] = [move] + child_pv
+                    if alpha >= beta:
+                        self.ordering.record_cutoff(game, move, depth, ply)
+                        break
+
+        if best_score >= beta:
+            bound = LOWER_BOUND
+        elif best_score > original_alpha:
+            bound = EXACT
+        else:
+            bound = UPPER_BOUND
+        self.tt.store(key, best_move, depth, _score_to_tt(best_score, ply), bound)
+
+        return best_score
+
+    def _quiescence(self, ply: int, alpha: int, beta: int, limits: bool = True) -> int:
+        """ Captures / queen promotions only until the position is quiet, so leaves aren't evaluated mid-exchange
+
+            The side to move may stand pat on the static evaluation. Captures losing material by static exchange
+            evaluation are skipped. In check every evasion is searched instead (no standing pat).
+        """
+        game = self.game
+        self.nodes += 1
+        if limits and self.nodes >= self._next_check:
+            self._check_limits()
+
+        self._pv_table[ply].clear()
+
+        if ply and (game.halfmove_clock >= 100 or self._is_repetition()):
+            return 0
+
+        colour = game.turn
+        in_check = game.check_if_in_check()
+        if in_check:
+            moves = game.legal_moves()
+            if not moves:
+                return -MATE_SCORE + ply
+            moves = self.ordering.order(game, moves, ply)
+            best_score = -INFINITY
+        else:
+            best_score = evaluate(game)
+            if best_score >= beta or ply >= MAX_PLY:
+                return best_score
+            alpha = max(alpha, best_score)
+            moves = generate_captures(game)
+
+        board = game.board
+        path_keys = self._path_keys
+        for move in moves:
+            if not in_check:
+                if static_exchange(board, move) < 0:
+                    continue
+                game.push(move)
+                if game.check_if_in_check(colour=colour):  # pseudo-legal capture
+                    game.pop()
+                    continue
+            else:
+                game.push(move)
+
+            path_keys.append(game.zobrist_key)
+            score = -self._quiescence(ply + 1, -beta, -alpha, limits)
+            path_keys.pop()
+            game.pop()
+
+            if score > best_score:
+                best_score = score
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+
+        return best_score
+
+
+def _score_to_tt(score: int, ply: int) -> int:
+    """ Mate scores are stored relative to the node (mate in n from here), not to the root"""
+    if score >= MATE_SCORE - MAX_PLY:
+        return score + ply
+    if score <= -MATE_SCORE + MAX_PLY:
+        return score - ply
+    return score
+
+
+def _score_from_tt(score: int, ply: int) -> int:
+    if score >= MATE_SCORE - MAX_PLY:
+        return score - ply
+    if score <= -MATE_SCORE + MAX_PLY:
+        return score + ply
+    return score
+
+
+def main(argv: list[str] = None) -> int:
+    from perft import START_FEN
+
+    parser = argparse.ArgumentParser(description="Search a position")
+    parser.add_argument("--fen", default=START_FEN)
+    parser.add_argument("--depth", type=int, default=MAX_PLY)
+    parser.add_argument("--time", type=float, default=None, help="seconds")
+    parser.add_argument("--nodes", type=int, default=None)
+    parser.add_argument("--hash", type=float, default=16, help="transposition table size in MB")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="search the root moves in this many processes to --depth (see parallel)")
+    parser.add_argument("--smp", action="store_true",
+                        help="with --workers, run lazy SMP searches sharing one hash table instead of splitting "
+                             "the root")
+    parser.add_argument("--book", default=None, help="Polyglot opening book to play from before searching")
+    args = parser.parse_args(argv)
+
+    if args.depth == MAX_PLY and args.time is None and args.nodes is None:
+        args.time = 5.0
+
+    game = Game.from_fen(args.fen)
+    if args.book is not None:
+        from book import OpeningBook
+
+        with OpeningBook(args.book) as book:
+            book_move = book.choose(game)
+        if book_move is not None:
+            print(f"bestmove {move_notation(book_move.move)} (book)")
+            return 0
+
+    if args.workers is not None:
+        from parallel import lazy_smp_search, parallel_search
+
+        search = lazy_smp_search if args.smp else parallel_search
+        result = search(game, args.depth, args.workers, args.time, hash_mb=args.hash)
+        print(result.iterations[-1])
+        print(f"bestmove {move_notation(result.move) if result.move is not None else '(none)'}")
+        return 0
+
+    engine = Engine(game, args.hash)
+    result = engine.search(args.depth, args.time, args.nodes, on_iteration=print)
+    print(", ".join(f"{name} {count}" for name, count in engine.tt.stats().items()))
+    print(f"bestmove {move_notation(result.move) if result.move is not None else '(none)'}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,177 @@
+""" Static evaluation
+
+    Material + piece-square tables, each with a midgame and an endgame value, tapered by game phase (the non-pawn
+    material left on the board), plus a basic mobility term.
+
+    The material / piece-square sums are not computed here: ``Board._put`` / ``Board._remove`` add and subtract the
+    table entry of the piece they move (``MG_TABLES`` / ``EG_TABLES`` / ``PHASE_WEIGHTS``), so every move (captures and
+    promotions included) keeps ``Board.mg_score``, ``Board.eg_score`` and ``Board.phase`` up to date in O(1).
+    ``compute_scores`` is the from-scratch version they must always equal.
+
+    Scores are in centipawns, white positive in the tables / board sums, side to move positive from ``evaluate``.
+"""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from bitboard import bishop_attacks, KNIGHT_ATTACKS, queen_attacks, rook_attacks
+from board_layout import BOARD_SQUARES
+from pieces import BISHOP_KIND, KNIGHT_KIND, QUEEN_KIND, ROOK_KIND, WHITE
+
+if TYPE_CHECKING:
+    from game import Board, Game
+
+
+# pawn, knight, bishop, rook, queen, king
+MG_VALUES = (100, 320, 330, 500, 900, 0)
+EG_VALUES = (120, 300, 330, 520, 900, 0)
+
+PHASE_VALUES = (0, 1, 1, 2, 4, 0)
+MAX_PHASE = 24  # all pieces on the board
+
+MOBILITY_WEIGHTS = {KNIGHT_KIND: 4, BISHOP_KIND: 3, ROOK_KIND: 2, QUEEN_KIND: 1}  # per attacked square
+
+# Piece-square tables from white's point of view, laid out as the board is seen (a8 first, h1 last)
+_PAWN_MG = (
+    0,   0,   0,   0,   0,   0,   0,   0,
+    50,  50,  50,  50,  50,  50,  50,  50,
+    10,  10,  20,  30,  30,  20,  10,  10,
+    5,   5,  10,  25,  25,  10,   5,   5,
+    0,   0,   0,  20,  20,   0,   0,   0,
+    5,  -5, -10,   0,   0, -10,  -5,   5,
+    5,  10,  10, -20, -20,  10,  10,   5,
+    0,   0,   0,   0,   0,   0,   0,   0,
+)
+_PAWN_EG = (
+    0,   0,   0,   0,   0,   0,   0,   0,
+    80,  80,  80,  80,  80,  80,  80,  80,
+    50,  50,  50,  50,  50,  50,  50,  50,
+    30,  30,  30,  30,  30,  30,  30,  30,
+    20,  20,  20,  20,  20,  20,  20,  20,
+    10,  10,  10,  10,  10,  10,  10,  10,
+    0,   0,   0,   0,   0,   0,   0,   0,
+    0,   0,   0,   0,   0,   0,   0,   0,
+)
+_KNIGHT = (
+    -50, -40, -30, -30, -30, -30, -40, -50,
+    -40, -20,   0,   0,   0,   0, -20, -40,
+    -30,   0,  10,  15,  15,  10,   0, -30,
+    -30,   5,  15,  20,  20,  15,   5, -30,
+    -30,   0,  15,  20,  20,  15,   0, -30,
+    -30,   5,  10,  15,  15,  10,   5, -30,
+    -40, -20,   0,   5,   5,   0, -20, -40,
+    -50, -40, -30, -30, -30, -30, -40, -50,
+)
+_BISHOP = (
+    -20, -10, -10, -10, -10, -10, -10, -20,
+    -10,   0,   0,   0,   0,   0,   0, -10,
+    -10,   0,   5,  10,  10,   5,   0, -10,
+    -10,   5,   5,  10,  10,   5,   5, -10,
+    -10,   0,  10,  10,  10,  10,   0, -10,
+    -10,  10,  10,  10,  10,  10,  10, -10,
+    -10,   5,   0,   0,   0,   0,   5, -10,
+    -20, -10, -10, -10, -10, -10, -10, -20,
+)
+_ROOK = (
+    0,   0,   0,   0,   0,   0,   0,   0,
+    5,  10,  10,  10,  10,  10,  10,   5,
+    -5,   0,   0,   0,   0,   0,   0,  -5,
+    -5,   0,   0,   0,   0,   0,   0,  -5,
+    -5,   0,   0,   0,   0,   0,   0,  -5,
+    -5,   0,   0,   0,   0,   0,   0,  -5,
+    -5,   0,   0,   0,   0,   0,   0,  -5,
+    0,   0,   0,   5,   5,   0,   0,   0,
+)
+_QUEEN = (
+    -20, -10, -10,  -5,  -5, -10, -10, -20,
+    -10,   0,   0,   0,   0,   0,   0, -10,
+    -10,   0,   5,   5,   5,   5,   0, -10,
+    -5,   0,   5,   5,   5,   5,   0,  -5,
+    0,   0,   5,   5,   5,   5,   0,  -5,
+    -10,   5,   5,   5,   5,   5,   0, -10,
+    -10,   0,   5,   0,   0,   0,   0, -10,
+    -20, -10, -10,  -5,  -5, -10, -10, -20,
+)
+_KING_MG = (
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -20, -30, -30, -40, -40, -30, -30, -20,
+    -10, -20, -20, -20, -20, -20, -20, -10,
+    20,  20,   0,   0,   0,   0,  20,  20,
+    20,  30,  10,   0,   0,  10,  30,  20,
+)
+_KING_EG = (
+    -50, -40, -30, -20, -20, -30, -40, -50,
+    -30, -20, -10,   0,   0, -10, -20, -30,
+    -30, -10,  20,  30,  30,  20, -10, -30,
+    -30, -10,  30,  40,  40,  30, -10, -30,
+    -30, -10,  30,  40,  40,  30, -10, -30,
+    -30, -10,  20,  30,  30,  20, -10, -30,
+    -30, -30,   0,   0,   0,   0, -30, -30,
+    -50, -30, -30, -30, -30, -30, -30, -50,
+)
+
+_MG_PST = (_PAWN_MG, _KNIGHT, _BISHOP, _ROOK, _QUEEN, _KING_MG)
+_EG_PST = (_PAWN_EG, _KNIGHT, _BISHOP, _ROOK, _QUEEN, _KING_EG)
+
+
+def _signed_tables(values: tuple[int, ...], pst: tuple[tuple[int, ...], ...]) -> list[list[int]]:
+    """ piece code -> 0x88 index -> material + table value, negative for black (rank mirrored)"""
+    tables = [[0] * 128 for _ in range(12)]
+    for kind in range(6):
+        for index in BOARD_SQUARES:
+            rank, file = index >> 4, index & 7
+            tables[kind][index] = values[kind] + pst[kind][(7 - rank) * 8 + file]
+            tables[kind + 6][index] = -(values[kind] + pst[kind][rank * 8 + file])
+    return tables
+
+
+MG_TABLES = _signed_tables(MG_VALUES, _MG_PST)
+EG_TABLES = _signed_tables(EG_VALUES, _EG_PST)
+PHASE_WEIGHTS = PHASE_VALUES * 2  # by piece code
+
+
+def compute_scores(board: Board) -> tuple[int, int, int]:
+    """ (midgame score, endgame score, phase) of ``board`` from scratch (what the incremental sums must equal)"""
+    mg_score = eg_score = phase = 0
+    for index in BOARD_SQUARES:
+        piece = board.squares[index]
+        if piece is not None:
+            mg_score += MG_TABLES[piece.code][index]
+            eg_score += EG_TABLES[piece.code][index]
+            phase += PHASE_WEIGHTS[piece.code]
+    return mg_score, eg_score, phase
+
+
+def mobility(board: Board, side: int) -> int:
+    """ Weighted count of the squares ``side``'s minor and major pieces attack, own pieces excluded"""
+    bitboards = board.bitboards
+    occupied = board.occupancy[0] | board.occupancy[1]
+    not_own = ~board.occupancy[side]
+    base = 6 * side
+    score = 0
+
+    for kind, attacks in ((KNIGHT_KIND, None), (BISHOP_KIND, bishop_attacks), (ROOK_KIND, rook_attacks),
+                          (QUEEN_KIND, queen_attacks)):
+        pieces = bitboards[base + kind]
+        weight = MOBILITY_WEIGHTS[kind]
+        while pieces:
+            lowest_bit = pieces & -pieces
+            sq64 = lowest_bit.bit_length() - 1
+            targets = KNIGHT_ATTACKS[sq64] if attacks is None else attacks(sq64, occupied)
+            score += weight * (targets & not_own).bit_count()
+            pieces ^= lowest_bit
+
+    return score
+
+
+def evaluate(game: Game) -> int:
+    """ Tapered material + piece-square score plus mobility, from the side to move's point of view"""
+    board = game.board
+    phase = min(board.phase, MAX_PHASE)
+    score = (board.mg_score * phase + board.eg_score * (MAX_PHASE - phase)) // MAX_PHASE
+    score += mobility(board, 0) - mobility(board, 1)
+    return score if game.turn == WHITE else -score
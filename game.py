@@ -1,10 +1,17 @@
 from __future__ import annotations
 
-from contextlib import suppress
-from copy import deepcopy
 from enum import Enum, auto
+from typing import TYPE_CHECKING, Iterable, Iterator
 
+from bitboard import SQUARE_BITS, BitboardMoveGenerator, bits_to_squares
+from board_layout import (ALL_RAYS, BOARD_SQUARES, DIAGONAL_RAYS, OFF_BOARD, OPPOSITE_RAYS, SQUARE_NAMES, SQUARES,
+                          STRAIGHT_RAYS, Square, square_index, xy_to_index)
+from evaluation import EG_TABLES, MG_TABLES, PHASE_WEIGHTS
 from pieces import *
+from zobrist import CASTLING_KEYS, EN_PASSANT_KEYS, PIECE_KEYS, SIDE_KEY, state_key
+
+if TYPE_CHECKING:
+    from movecache import MoveCache
 
 # Typing and aliases
 WHITE, BLACK = "WHITE", "BLACK"
@@ -23,18 +30,68 @@ p, r, n, b, q, k = Pawn, Rook, Knight, Bishop, Queen, King
 
 
 # TODO notify user when king in check
-# TODO implement halfmove clock
-# TODO implement move count
 # TODO implement repetition rules (should be 'fairly' straightforward as moves need to be logged anyways
 #      (might have difficulty with pattern rec)
 
-# TODO import / export PGN
 # TODO test positions/scenarios
-# TODO integrate stockfish (/alpha zero?)
-# TODO import/export FEN
 
-# TODO optimize _get_opponent_moves:
-#   Cache pieces (with piece id), run before move + after to make sure move doesn't put king in check
+MOVEGEN_BACKENDS = ("mailbox", "bitboard")
+
+# Castling rights (bit flags)
+WHITE_KING_SIDE, WHITE_QUEEN_SIDE, BLACK_KING_SIDE, BLACK_QUEEN_SIDE = 1, 2, 4, 8
+ALL_CASTLING_RIGHTS = 15
+
+# rights kept when a move starts or ends on a square (king / rook home squares drop theirs)
+CASTLING_MASKS = [ALL_CASTLING_RIGHTS] * 128
+CASTLING_MASKS[0x00] = ALL_CASTLING_RIGHTS ^ WHITE_QUEEN_SIDE
+CASTLING_MASKS[0x04] = ALL_CASTLING_RIGHTS ^ (WHITE_KING_SIDE | WHITE_QUEEN_SIDE)
+CASTLING_MASKS[0x07] = ALL_CASTLING_RIGHTS ^ WHITE_KING_SIDE
+CASTLING_MASKS[0x70] = ALL_CASTLING_RIGHTS ^ BLACK_QUEEN_SIDE
+CASTLING_MASKS[0x74] = ALL_CASTLING_RIGHTS ^ (BLACK_KING_SIDE | BLACK_QUEEN_SIDE)
+CASTLING_MASKS[0x77] = ALL_CASTLING_RIGHTS ^ BLACK_KING_SIDE
+
+# piece kinds sliding along straight / diagonal rays
+SLIDERS_STRAIGHT = (ROOK_KIND, QUEEN_KIND)
+SLIDERS_DIAGONAL = (BISHOP_KIND, QUEEN_KIND)
+
+FEN_PIECES = {"P": (Pawn, WHITE), "N": (Knight, WHITE), "B": (Bishop, WHITE), "R": (Rook, WHITE),
+              "Q": (Queen, WHITE), "K": (King, WHITE),
+              "p": (Pawn, BLACK), "n": (Knight, BLACK), "b": (Bishop, BLACK), "r": (Rook, BLACK),
+              "q": (Queen, BLACK), "k": (King, BLACK)}
+
+FEN_CODES = {char: piece_type.kind + 6 * COLOUR_INDEX[colour] for char, (piece_type, colour) in FEN_PIECES.items()}
+EMPTY_RUNS = {str(run): run for run in range(1, 9)}
+CASTLING_CHARS = {"K": WHITE_KING_SIDE, "Q": WHITE_QUEEN_SIDE, "k": BLACK_KING_SIDE, "q": BLACK_QUEEN_SIDE}
+# castling right -> (king home square, king code, rook home square, rook code), both must be in place for the right
+CASTLING_PIECES = {WHITE_KING_SIDE: (0x04, KING_KIND, 0x07, ROOK_KIND),
+                   WHITE_QUEEN_SIDE: (0x04, KING_KIND, 0x00, ROOK_KIND),
+                   BLACK_KING_SIDE: (0x74, KING_KIND + 6, 0x77, ROOK_KIND + 6),
+                   BLACK_QUEEN_SIDE: (0x74, KING_KIND + 6, 0x70, ROOK_KIND + 6)}
+
+PROMOTION_PIECES = {KNIGHT_KIND: Knight, BISHOP_KIND: Bishop, ROOK_KIND: Rook, QUEEN_KIND: Queen}
+
+
+# Moves are ints: from square | to square << 7 | promotion kind << 14 (0x88 squares, 0 = no promotion)
+def encode_move(current_pos: int, move_pos: int, promotion: int = 0) -> int:
+    return current_pos | move_pos << 7 | promotion << 14
+
+
+def move_from(move: int) -> int:
+    return move & 0x7F
+
+
+def move_to(move: int) -> int:
+    return move >> 7 & 0x7F
+
+
+def move_promotion(move: int) -> int:
+    return move >> 14
+
+
+def move_notation(move: int) -> str:
+    """ Long algebraic notation, ei: e2e4, e7e8q"""
+    promotion = move >> 14
+    return SQUARE_NAMES[move & 0x7F] + SQUARE_NAMES[move >> 7 & 0x7F] + ("nbrq"[promotion - 1] if promotion else "")
 
 
 class MoveStatus(Enum):
@@ -48,102 +105,334 @@ class MoveStatus(Enum):
     DRAW = auto()
 
 
-class Board(dict):
-    def __init__(self, _board_dict: dict[str, [Optional[Piece]]]):
-        super().__init__(_board_dict)
+class InvalidFEN(Exception):
+    def __init__(self, fen: str):
+        super().__init__(f"Invalid FEN received: {fen}")
+
+
+class Board:
+    """ 0x88 mailbox board
+
+        Pieces live in a flat list of 128 entries indexed by 0x88 square (see board_layout), so move generation works
+        on small integers, walking the precomputed target and ray tuples of ``SQUARES``. The old string keyed dict API
+        (get/set/items/[]) is kept as a thin compatibility layer on top of it.
+
+        One bitboard per piece code and the occupancy of each colour are kept alongside the mailbox for the
+        bitboard move generation backend, and the material / piece-square sums for the evaluation.
+
+        With ``attack_maps`` on, ``attacks[side][index]`` counts the pieces of ``side`` (0 = white, 1 = black)
+        attacking ``index``. It is updated incrementally by _put / _remove (the piece's own attacks plus the slider
+        rays passing through the square) so check and castling tests are a lookup. Keeping it up to date costs
+        more per make / unmake than a perft-style workload saves on lookups, so it is opt-in.
+    """
+
+    def __init__(self, _board_dict: Optional[dict[str, Optional[Piece]]] = None, attack_maps: bool = False):
+        self.squares: list[Optional[Piece]] = [None] * 128
+        self.bitboards: list[int] = [0] * 12
+        self.occupancy: list[int] = [0, 0]  # white, black
+        self.attacks: Optional[list[list[int]]] = [[0] * 128, [0] * 128] if attack_maps else None
+        self.king_squares: list[Optional[int]] = [None, None]
+        self.zobrist_key = 0  # pieces only, see Game.zobrist_key
+        # material + piece-square sums (white positive) and game phase, see evaluation
+        self.mg_score = self.eg_score = self.phase = 0
+
+        if _board_dict is not None:
+            for notation, piece in _board_dict.items():
+                if piece is not None:
+                    self._put(square_index(notation), piece)
+
+    # Integer API (used by move generation)
+
+    def _put(self, index: int, piece: Piece) -> None:
+        """ Place ``piece`` on an empty square"""
+        bit = SQUARE_BITS[index]
+        if self.attacks is not None:
+            self._update_rays_through(index, -1)  # the new piece blocks whatever slid through the square
+        self.squares[index] = piece
+        self.bitboards[piece.code] |= bit
+        self.occupancy[piece.code >= 6] |= bit
+        self.zobrist_key ^= PIECE_KEYS[piece.code][index]
+        self.mg_score += MG_TABLES[piece.code][index]
+        self.eg_score += EG_TABLES[piece.code][index]
+        self.phase += PHASE_WEIGHTS[piece.code]
+        piece.square = index
+        if self.attacks is not None:
+            self._update_piece_attacks(index, piece, 1)
+
+        if piece.kind == KING_KIND:
+            self.king_squares[piece.code >= 6] = index
+
+    def _remove(self, index: int) -> Optional[Piece]:
+        piece = self.squares[index]
+        if piece is not None:
+            bit = SQUARE_BITS[index]
+            self.squares[index] = None
+            self.bitboards[piece.code] ^= bit
+            self.occupancy[piece.code >= 6] ^= bit
+            self.zobrist_key ^= PIECE_KEYS[piece.code][index]
+            self.mg_score -= MG_TABLES[piece.code][index]
+            self.eg_score -= EG_TABLES[piece.code][index]
+            self.phase -= PHASE_WEIGHTS[piece.code]
+            if self.attacks is not None:
+                self._update_piece_attacks(index, piece, -1)
+                self._update_rays_through(index, 1)
+        return piece
+
+    def _update_piece_attacks(self, index: int, piece: Piece, sign: int) -> None:
+        """ Adds (1) or removes (-1) the attacks of ``piece`` standing on ``index``"""
+        squares = self.squares
+        attacks = self.attacks[piece.code >= 6]
+        square = SQUARES[index]
+
+        if piece.can_make_long_move:
+            for ray in square.rays[piece.ray_group]:
+                for target in ray:
+                    attacks[target] += sign
+                    if squares[target] is not None:
+                        break
+            return
 
-    @property
-    def _fen(self):
-        return {"rank_1": "",
-                "rank_2": "",
-                "rank_3": "",
-                "rank_4": "",
-                "rank_5": "",
-                "rank_6": "",
-                "rank_7": "",
-                "rank_8": "",
-                "last_to_move": "",
-                "castling_rights": "-",
-                "en_passant_target": "-",
-                "halfmove_clock": "0",
-                "fullmove_counter": "0"
-                }
-
-    def to_fen(self, game: Game):
-        # TODO half/fullmove counter
-        fen = self._fen
-
-        # Piece placement
-        rank_counter = {"1": 0, "2": 0, "3": 0, "4": 0, "5": 0, "6": 0, "7": 0, "8": 0}
-        for pos, piece in self.items():
-            if piece is not None:
-                rank = f"rank_{pos[1]}"
-                if rank_counter[pos[1]] != 0:
-                    fen[rank] += str(rank_counter[pos[1]])
-                fen[rank] += str(piece)
-                rank_counter[pos[1]] = 0
+        if piece.kind == PAWN_KIND:
+            targets = square.pawn_captures[piece.code >= 6]
+        elif piece.kind == KNIGHT_KIND:
+            targets = square.knight_targets
+        else:
+            targets = square.king_targets
+
+        for target in targets:
+            attacks[target] += sign
+
+    def _update_rays_through(self, index: int, sign: int) -> None:
+        """ Sliders attacking ``index`` start (1) or stop (-1) attacking the squares behind it"""
+        squares = self.squares
+        attacks = self.attacks
+        rays = SQUARES[index].rays[ALL_RAYS]
+
+        for direction, ray in enumerate(rays):
+            for source in ray:
+                piece = squares[source]
+                if piece is not None:
+                    break
             else:
-                rank_counter[pos[1]] += 1
-
-        for rank, count in rank_counter.items():
-            if count != 0:
-                fen[f"rank_{rank}"] += str(count)
-
-        # Castling rights
-        castling_rights = ""
-        possible_white_h_rook = game.board.get("h1")
-        possible_white_a_rook = game.board.get("a1")
-        possible_black_h_rook = game.board.get("h8")
-        possible_black_a_rook = game.board.get("a8")
-
-        if not game.w_king.has_moved:
-            if possible_white_h_rook is not None and not possible_white_h_rook.has_moved:
-                castling_rights += "K"
-            if possible_white_a_rook is not None and not possible_white_a_rook.has_moved:
-                castling_rights += "Q"
-        if not game.b_king.has_moved:
-            if possible_black_h_rook is not None and not possible_black_h_rook.has_moved:
-                castling_rights += "k"
-            if possible_black_a_rook is not None and not possible_black_a_rook.has_moved:
-                castling_rights += "q"
-
-        fen["castling_rights"] = castling_rights
-
-        # FEN assembly
-        # ei: rnbqkbnr/pp1ppppp/8/2p5/4P3/5N2/PPPP1PPP/RNBQKB1R b KQkq - 1 2
-        final_fen = "".join(fen[f"rank_{rank}"] + "/" for rank in range(8, 1, -1))
-        final_fen += fen[f"rank_{1}"]
-        final_fen += " " + "w" if game.current_player.colour == WHITE else "b"
-        final_fen += " " + fen["castling_rights"]
-        final_fen += " " + fen["en_passant_target"]
-        final_fen += " " + fen["halfmove_clock"]
-        final_fen += " " + fen["fullmove_counter"]
-
-        print(final_fen)
-
-    def to_pgn(self):
-        pass
-
-    def load_from_pgn(self):
-        pass
-
-    def load_from_fen(self):
-        pass
+                continue
+
+            if piece.kind not in (SLIDERS_STRAIGHT if direction < 4 else SLIDERS_DIAGONAL):
+                continue
+
+            side_attacks = attacks[piece.code >= 6]
+            for target in rays[OPPOSITE_RAYS[direction]]:
+                side_attacks[target] += sign
+                if squares[target] is not None:
+                    break
+
+    # Notation API (compatibility layer)
+
+    def __getitem__(self, key: str) -> Optional[Piece]:
+        index = square_index(key)
+        if index is None:
+            raise KeyError(key)
+        return self.squares[index]
+
+    def __setitem__(self, key: str, value: Optional[Piece]) -> None:
+        index = square_index(key)
+        if index is None:
+            raise KeyError(key)
+
+        self._remove(index)
+        if value is not None:
+            self._put(index, value)
+
+    def __contains__(self, key: str) -> bool:
+        return square_index(key) is not None
+
+    def get(self, key: str, default: Optional[Piece] = None) -> Optional[Piece]:
+        index = square_index(key)
+        if index is None:
+            return default
+        return self.squares[index]
+
+    def items(self) -> Iterator[tuple[str, Optional[Piece]]]:
+        """ (notation, piece) pairs, a8 - h8 down to a1 - h1 (same order as the old dict)"""
+        for rank in range(7, -1, -1):
+            for index in range(rank * 16, rank * 16 + 8):
+                yield SQUARE_NAMES[index], self.squares[index]
+
+    def to_fen(self, game: Game) -> str:
+        """ FEN record of the position, side to move / castling rights / en passant target / clocks come from ``game``
+
+            ei: rnbqkbnr/pp1ppppp/8/2p5/4P3/5N2/PPPP1PPP/RNBQKB1R b KQkq - 1 2
+        """
+        ranks = []
+        for rank in range(7, -1, -1):
+            placement, empty = "", 0
+            for index in range(rank * 16, rank * 16 + 8):
+                piece = self.squares[index]
+                if piece is None:
+                    empty += 1
+                    continue
+                if empty:
+                    placement += str(empty)
+                    empty = 0
+                placement += str(piece)
+            ranks.append(placement + str(empty) if empty else placement)
+
+        castling_rights = "".join(char for char, right in zip("KQkq", (WHITE_KING_SIDE, WHITE_QUEEN_SIDE,
+                                                                          BLACK_KING_SIDE, BLACK_QUEEN_SIDE))
+                                  if game.castling_rights & right) or "-"
+        en_passant_target = SQUARE_NAMES[game.en_passant_target] if game.en_passant_target is not None else "-"
+
+        return (f"{'/'.join(ranks)} {'w' if game.turn == WHITE else 'b'} {castling_rights} {en_passant_target} "
+                f"{game.halfmove_clock} {game.fullmove_number}")
+
+    def to_pgn(self, game: Game, headers: Optional[dict[str, str]] = None) -> str:
+        """ PGN of the moves played in ``game`` since it was set up, ``headers`` override the default tags"""
+        from pgn import game_to_pgn
+
+        return game_to_pgn(game, headers)
+
+    def load_from_pgn(self, pgn: str, game: Game) -> None:
+        """ Sets up the first game of ``pgn`` (its FEN tag or the start position) and plays its moves on ``game``"""
+        from pgn import parse_pgn
+
+        if game.board is not self:
+            raise ValueError("game must be played on this board")
+        parse_pgn(pgn).replay(game)
+
+    def to_bytes(self, game: Game) -> bytes:
+        """ 32 byte binary record of the position (see positions), state fields come from ``game`` as in to_fen"""
+        from positions import pack_position
+
+        return pack_position(game)
+
+    def load_from_bytes(self, record: bytes, game: Game) -> None:
+        """ Sets up the position of a binary record (see positions) on ``game``"""
+        from positions import unpack_position
+
+        if game.board is not self:
+            raise ValueError("game must be played on this board")
+        unpack_position(record, game)
+
+    def _clear(self) -> list[list[Piece]]:
+        """ Empties the board, returns the pieces that were on it by code (so they can be placed again)"""
+        spare_pieces = [[] for _ in range(12)]
+        squares = self.squares
+        for index in bits_to_squares(self.occupancy[0] | self.occupancy[1]):
+            piece = squares[index]
+            spare_pieces[piece.code].append(piece)
+            squares[index] = None
+
+        self.bitboards[:] = [0] * 12
+        self.occupancy[:] = [0, 0]
+        self.king_squares[:] = [None, None]
+        self.zobrist_key = self.mg_score = self.eg_score = self.phase = 0
+        if self.attacks is not None:
+            self.attacks[0][:] = self.attacks[1][:] = [0] * 128
+        return spare_pieces
+
+    def castling_rights_in_place(self, rights: int) -> int:
+        """ ``rights`` without the castling rights whose king or rook isn't on its home square"""
+        squares = self.squares
+        for right, (king_square, king_code, rook_square, rook_code) in CASTLING_PIECES.items():
+            if rights & right:
+                king, rook = squares[king_square], squares[rook_square]
+                if king is None or king.code != king_code or rook is None or rook.code != rook_code:
+                    rights &= ~right
+        return rights
+
+    def load_from_fen(self, fen: str, game: Optional[Game] = None) -> None:
+        """ Places the pieces of ``fen`` on the board in one pass over the record
+
+            If ``game`` is given its side to move, castling rights, en passant target and clocks are set from the
+            rest of the record as well; castling rights without their king and rook at home are dropped. Piece
+            objects already on the board are reused for the new position instead of building new ones, which is what
+            makes loading many positions into one board cheap.
+        """
+        fields = fen.split()
+        if not 1 <= len(fields) <= 6:
+            raise InvalidFEN(fen)
+
+        spare_pieces = self._clear()
+        put = self._put
+        index = 0x70  # a8, ranks are listed 8 to 1
+        rank_end = 0x78
+        for char in fields[0]:
+            code = FEN_CODES.get(char)
+            if code is not None:
+                if index >= rank_end:
+                    raise InvalidFEN(fen)
+                if spare_pieces[code]:
+                    piece = spare_pieces[code].pop()
+                    if getattr(piece, "has_moved", False):
+                        piece.has_moved = False
+                else:
+                    piece_type, colour = FEN_PIECES[char]
+                    piece = piece_type(colour)
+                put(index, piece)
+                index += 1
+
+            elif char in EMPTY_RUNS:
+                index += EMPTY_RUNS[char]
+                if index > rank_end:
+                    raise InvalidFEN(fen)
+
+            elif char == "/" and index == rank_end and index != 0x08:
+                index -= 0x18
+                rank_end -= 0x10
+
+            else:
+                raise InvalidFEN(fen)
+
+        if index != 0x08 or None in self.king_squares or self.bitboards[KING_KIND].bit_count() != 1 or \
+                self.bitboards[KING_KIND + 6].bit_count() != 1:
+            raise InvalidFEN(fen)
+
+        if game is None:
+            return
+
+        fields += ["w", "-", "-", "0", "1"][len(fields) - 1:]
+        side, castling, en_passant, halfmove_clock, fullmove_number = fields[1:]
+
+        en_passant_target = square_index(en_passant) if en_passant != "-" else None
+        if side not in ("w", "b") or en_passant != "-" and en_passant_target is None:
+            raise InvalidFEN(fen)
+        # the skipped square is on the 6th rank with white to move, the 3rd with black to move
+        if en_passant_target is not None and en_passant_target >> 4 != (5 if side == "w" else 2):
+            raise InvalidFEN(fen)
+
+        try:
+            game.halfmove_clock, game.fullmove_number = int(halfmove_clock), int(fullmove_number)
+        except ValueError:
+            raise InvalidFEN(fen)
+
+        game.turn = WHITE if side == "w" else BLACK
+        game.castling_rights = 0
+        if castling != "-":
+            for char in castling:
+                if char not in CASTLING_CHARS:
+                    raise InvalidFEN(fen)
+                game.castling_rights |= CASTLING_CHARS[char]
+        game.castling_rights = self.castling_rights_in_place(game.castling_rights)
+        game.en_passant_target = en_passant_target
+        game._reset_state()
 
     def set(self, key: str, value: Optional[Piece]) -> None:
+        index = square_index(key)
+
         # move piece
         if isinstance(value, Piece):
-            self[str(value.pos)] = None
-            value.pos.set_with_notation(key)
-
-        self[key] = value
+            if value.square is not None and self.squares[value.square] is value:
+                self._remove(value.square)
+            self._remove(index)
+            self._put(index, value)
+        else:
+            self._remove(index)
 
     def to_ascii(self) -> list[str]:
         board = ["    a    b    c    d    e    f    g    h", "  " + "-" * 41]
-        for y in range(1, 9):
-            rank = f"{y} |"
-            for x in range(1, 9):
-                piece = self[f"{chr(x + 96)}{y}"]
+        for y in range(8):
+            rank = f"{y + 1} |"
+            for x in range(8):
+                piece = self.squares[y * 16 + x]
                 rank += f" {str(piece)}  |" if piece is not None else "    |"
             board.append(rank)
             board.append("  " + "-" * 41)
@@ -152,10 +441,19 @@ class Board(dict):
 
 
 class Game:
-    def __init__(self, player_1: Player, player_2: Player):
+    def __init__(self, player_1: Player, player_2: Player, movegen: str = "mailbox", attack_maps: bool = False,
+                 move_cache: Optional[MoveCache] = None):
+        if movegen not in MOVEGEN_BACKENDS:
+            raise ValueError(f"Unknown move generation backend: {movegen}")
+
+        # legal_moves / get_legal_moves results by position key, may be shared between games (see movecache)
+        self.move_cache = move_cache
+
+        # mailbox generation is implemented on Game itself, other backends are delegated to
+        self._movegen = BitboardMoveGenerator(self) if movegen == "bitboard" else None
+
         self.w_king = k(WHITE)
         self.b_king = k(BLACK)
-        self._pieces = {}
         # set up board
         _b = {
             "a8": r(BLACK), "b8": n(BLACK), "c8": b(BLACK), "d8": q(BLACK), "e8": self.b_king, "f8": b(BLACK),
@@ -171,23 +469,62 @@ class Game:
             "a1": r(WHITE), "b1": n(WHITE), "c1": b(WHITE), "d1": q(WHITE), "e1": self.w_king, "f1": b(WHITE),
             "g1": n(WHITE), "h1": r(WHITE)
         }
-        self.board = Board(_b)
-
-        for coord, piece in self.board.items():  # for calculation
-            if piece is not None:
-                piece.pos.set_with_notation(coord)
-                # set send pieces to own dict to prevent having to iterate over the entire board
-                # id not used but needed to differentiate between instances
-
-                self._pieces[(str(piece), id(piece))] = piece
+        self.board = Board(_b, attack_maps=attack_maps)
+        self._set_pieces()
 
         # set up players
         # this can now be randomized easily
         self.players = {"WHITE": player_1, "BLACK": player_2}
-        self.current_player = self.players["WHITE"]
+        self.turn: Colour = WHITE
         self.last_move = {"WHITE": {"piece": None, "pos": None},
                           "BLACK": {"piece": None, "pos": None}}
-        self.en_passant_target = None
+        self.en_passant_target: Optional[int] = None  # 0x88 index of the square skipped by a double pawn push
+        self.castling_rights = ALL_CASTLING_RIGHTS
+        self.halfmove_clock = 0
+        self.fullmove_number = 1
+        self._state_key = state_key(False, self.castling_rights, self.en_passant_target)
+
+        # (move, moved piece, captured piece, castling rights, en passant target, halfmove clock, state key) per push
+        self._undo_stack: list[tuple[int, Piece, Optional[Piece], int, Optional[int], int, int]] = []
+
+    @classmethod
+    def from_fen(cls, fen: str, player_1: Optional[Player] = None, player_2: Optional[Player] = None,
+                 movegen: str = "mailbox", attack_maps: bool = False, move_cache: Optional[MoveCache] = None) -> Game:
+        game = cls(player_1 or Player("WHITE", WHITE), player_2 or Player("BLACK", BLACK), movegen=movegen,
+                   attack_maps=attack_maps, move_cache=move_cache)
+        game.board.load_from_fen(fen, game)
+        return game
+
+    def _set_pieces(self) -> None:
+        self._pieces = {}
+        squares = self.board.squares
+        for index in bits_to_squares(self.board.occupancy[0] | self.board.occupancy[1]):
+            piece = squares[index]
+            # set send pieces to own dict to prevent having to iterate over the entire board
+            # id not used but needed to differentiate between instances
+
+            self._pieces[(str(piece), id(piece))] = piece
+
+        self.w_king = self.board.squares[self.board.king_squares[0]]
+        self.b_king = self.board.squares[self.board.king_squares[1]]
+
+    def to_fen(self) -> str:
+        return self.board.to_fen(self)
+
+    def _reset_state(self) -> None:
+        """ Re-derive everything kept incrementally after the board / game fields were set directly"""
+        self._set_pieces()
+        self._undo_stack = []
+        self._state_key = state_key(self.turn == BLACK, self.castling_rights, self.en_passant_target)
+
+    @property
+    def zobrist_key(self) -> int:
+        """ 64-bit position key: pieces (kept by the board) + side to move, castling rights and en passant target"""
+        return self.board.zobrist_key ^ self._state_key
+
+    @property
+    def current_player(self) -> Player:
+        return self.players[self.turn]
 
     def get_pieces(self, colour: Optional[Colour]):
         pieces = {}
@@ -208,389 +545,582 @@ class Game:
         return {"WHITE": self.w_king.pos, "BLACK": self.b_king.pos}
 
     def next_turn(self):
-        self.current_player = self.players["WHITE"] if self.current_player.colour == BLACK else self.players["BLACK"]
+        # the turn is handed over by push(), this only announces it
         print(f"{self.current_player.name}'s turn!")
 
-    def _check_if_legal_castle(self, side: str) -> bool:
-        rank = 1 if self.current_player.colour == WHITE else 8
-        opponent_moves = self._get_opponent_moves()
+    def _check_if_legal_castle(self, side: str, colour: Optional[Colour] = None) -> bool:
+        if colour is None:
+            colour = self.current_player.colour
 
-        if side == 'a':  # If queen-side castle
-            if f"c{rank}" not in opponent_moves and f"d{rank}" not in opponent_moves:
-                return True
+        rank = 0 if colour == WHITE else 0x70
+        opponent = BLACK if colour == WHITE else WHITE
+
+        if side == 'a':  # If queen-side castle (king can't castle out of, through or into check)
+            crossed = (rank + 4, rank + 3, rank + 2)
         elif side == 'h':  # If king-side-castle
-            if f"f{rank}" not in opponent_moves and f"g{rank}" not in opponent_moves:
-                return True
+            crossed = (rank + 4, rank + 5, rank + 6)
         else:  # If not possible
             return False
 
-    @staticmethod
-    def _remove_duplicates(array: list[BoardCoordinates]) -> list[BoardCoordinates]:
-        # TODO is this needed?
-        temp = []
-        for coord in array:
-            if coord not in temp:
-                temp.append(coord)
-        return temp
+        return not any(self.is_square_attacked(index, opponent) for index in crossed)
 
-    def _get_legal_pawn_moves(self, pawn: Pawn) -> list[BoardCoordinates]:
-        legal_moves = []
+    def is_square_attacked(self, square: int, by_colour: Colour, board: Optional[Board] = None) -> bool:
+        """ Is the 0x88 ``square`` attacked by any piece of ``by_colour``
 
-        for move in pawn.move_atlas:
-            try:
-                if move == (0, 2) and pawn.has_moved:
-                    continue
+            Scans outward from the square (knight jumps, pawn diagonals, king neighbours, sliding rays) and stops at
+            the first attacker, instead of generating every opponent move.
+        """
+        if board is None:
+            board = self.board
 
-                new_move = pawn.pos + move
+        if board.attacks is not None:
+            return board.attacks[COLOUR_INDEX[by_colour]][square] > 0
 
-                # check board
-                piece_at_move = self.board.get(str(new_move))
+        if self._movegen is not None:
+            return self._movegen.is_attacked(board, square, by_colour)
 
-                if piece_at_move is not None and piece_at_move.colour == self.current_player.colour:
-                    continue
+        squares = board.squares
+        side = COLOUR_INDEX[by_colour]
+        base = 6 * side
+        target = SQUARES[square]
 
-                if piece_at_move is None and move in ((-1, 1), (1, 1), (1, -1), (-1, -1)):
-                    continue
+        # pawns attack the square from where the defender's pawns would capture
+        for source in target.pawn_captures[side ^ 1]:
+            piece = squares[source]
+            if piece is not None and piece.code == base + PAWN_KIND:
+                return True
 
-                # check en passant
-                if self.en_passant_target is not None:
-                    try:
-                        if self.en_passant_target == str(pawn.pos + (-1, 0)):
-                            legal_moves.append(pawn.pos + (-1, 1) if pawn.colour == WHITE else pawn.pos + (-1, -1))
-                    except InvalidPosition:
-                        pass
-
-                    try:
-                        if self.en_passant_target == str(pawn.pos + (1, 0)):
-                            legal_moves.append(pawn.pos + (1, 1) if pawn.colour == WHITE else pawn.pos + (1, -1))
-                    except InvalidPosition:
-                        pass
-                legal_moves.append(new_move)
+        for source in target.knight_targets:
+            piece = squares[source]
+            if piece is not None and piece.code == base + KNIGHT_KIND:
+                return True
 
-            except InvalidPosition:
-                pass
+        for source in target.king_targets:
+            piece = squares[source]
+            if piece is not None and piece.code == base + KING_KIND:
+                return True
 
-        return self._remove_duplicates(legal_moves)
+        queen = base + QUEEN_KIND
+        for ray_group, slider in ((STRAIGHT_RAYS, base + ROOK_KIND), (DIAGONAL_RAYS, base + BISHOP_KIND)):
+            for ray in target.rays[ray_group]:
+                for source in ray:
+                    piece = squares[source]
+                    if piece is not None:
+                        if piece.code == slider or piece.code == queen:
+                            return True
+                        break
 
-    def _get_opponent_moves(self, board: Board = None) -> list[str]:
+        return False
+
+    def _get_legal_pawn_moves(self, pawn: Pawn, board: Optional[Board] = None) -> list[int]:
         if board is None:
             board = self.board
 
-        opponent_moves = []
-        for _, piece in board.items():
-            if piece is None:
-                continue
+        if self._movegen is not None:
+            return self._movegen.pawn_moves(pawn, board)
 
-            elif isinstance(piece, King):
-                with suppress(InvalidPosition):
-                    for move in piece.move_atlas:
-                        new_pos = str(piece.pos + move)
-                        piece_at_pos = self.board.get(new_pos)
-                        if piece_at_pos is None or piece_at_pos.colour != self.current_player.colour:
-                            opponent_moves.append(new_pos)
+        squares = board.squares
+        square = SQUARES[pawn.square]
+        side = pawn.code >= 6
+        legal_moves = []
 
-            else:
-                if piece.colour != self.current_player.colour:
-                    moves = self.get_legal_moves(piece)
-                    [opponent_moves.append(str(move)) for move in moves]
+        # pushes (double push only from the start rank, and only if the single push is free)
+        for new_move in square.pawn_pushes[side]:
+            if squares[new_move] is not None:
+                break
+            legal_moves.append(new_move)
 
-        return opponent_moves
+        # captures (+ en passant)
+        for new_move in square.pawn_captures[side]:
+            piece_at_move = squares[new_move]
+            if piece_at_move is not None:
+                if piece_at_move.colour != pawn.colour:
+                    legal_moves.append(new_move)
 
-    def _get_legal_king_moves(self, king: King) -> dict[str, [Optional[list[BoardCoordinates]], dict[str, [bool]]]]:
-        legal_moves = []
-        a_castling, h_castling = False, False
+            elif new_move == self.en_passant_target:
+                legal_moves.append(new_move)
 
-        # check if castling possible
-        if not king.has_moved:
-            rank = 1 if self.current_player.colour == WHITE else 8
-            back_rank = [self.board.get(f"{file}{rank}") for file in ('a', 'b', 'c', 'd', 'e', 'f', 'g', 'h')]
-            possible_a_rook, possible_f_rook = back_rank[0], back_rank[7]
-
-            try:
-                if (
-                        isinstance(back_rank[0], Rook)
-                        and not possible_a_rook.has_moved
-                        and all(piece is None for piece in back_rank[1:4])
-                        and self._check_if_legal_castle(side='a')
-                ):
-                    a_castling = True
-
-            except AttributeError:
-                pass
-
-            try:
-                if (
-                        isinstance(back_rank[7], Rook)
-                        and not possible_f_rook.has_moved
-                        and all(piece is None for piece in back_rank[5:7])
-                        and self._check_if_legal_castle(side='h')
-                ):
-                    h_castling = True
-
-            except AttributeError:
-                pass
-
-        with suppress(InvalidPosition):
-            for move in king.move_atlas:
-                new_pos = king.pos + move
-                piece_at_pos = self.board.get(str(new_pos))
-
-                if piece_at_pos is None or piece_at_pos.colour == self.current_player.colour:
-                    continue
+        return legal_moves
 
-                else:
-                    legal_moves.append(move)
+    def _get_piece_moves(self, piece: Piece, board: Optional[Board] = None) -> list[int]:
+        """ Target squares of a knight, bishop, rook, queen or king (castling excluded)"""
+        if board is None:
+            board = self.board
 
-        opponent_moves = self._get_opponent_moves()
+        if self._movegen is not None:
+            return self._movegen.piece_moves(piece, board)
 
-        if all(legal_move in opponent_moves for legal_move in legal_moves):
-            legal_moves = None  # Possible Checkmate
+        squares = board.squares
+        square = SQUARES[piece.square]
+        colour = piece.colour
+        legal_moves = []
 
-        return {"legal_moves": legal_moves, "legal_castling": {"a": a_castling, "h": h_castling}}
+        if piece.can_make_long_move:
+            for ray in square.rays[piece.ray_group]:  # check all possible spaces
+                for new_pos in ray:
+                    piece_at_pos = squares[new_pos]
 
-    def get_legal_moves(self, piece: Piece) -> \
-            Union[list[BoardCoordinates], dict[str, [list[BoardCoordinates], dict[str, str]]]]:
-        # Doesn't check if player is in check
+                    if piece_at_pos is not None:  # Stop checking for moves if piece is in the way
+                        if piece_at_pos.colour != colour:  # if same colour ignore
+                            legal_moves.append(new_pos)
+                        break
 
-        legal_moves = []
+                    legal_moves.append(new_pos)
+
+        else:
+            for new_pos in square.knight_targets if piece.kind == KNIGHT_KIND else square.king_targets:
+                piece_at_pos = squares[new_pos]
+                if piece_at_pos is None or piece_at_pos.colour != colour:
+                    legal_moves.append(new_pos)
+
+        return legal_moves
 
+    def _get_legal_castling(self, king: King) -> dict[str, bool]:
+        a_castling, h_castling = False, False
+
+        # check if castling possible
+        home = 4 if king.colour == WHITE else 0x74
+        a_right, h_right = (WHITE_QUEEN_SIDE, WHITE_KING_SIDE) if king.colour == WHITE else \
+            (BLACK_QUEEN_SIDE, BLACK_KING_SIDE)
+        rook_code = ROOK_KIND + 6 * COLOUR_INDEX[king.colour]
+
+        if king.square == home and self.castling_rights & (a_right | h_right):
+            back_rank = self.board.squares[home - 4:home + 4]
+            possible_a_rook, possible_h_rook = back_rank[0], back_rank[7]
+
+            if (
+                    self.castling_rights & a_right
+                    and possible_a_rook is not None and possible_a_rook.code == rook_code
+                    and all(piece is None for piece in back_rank[1:4])
+                    and self._check_if_legal_castle(side='a', colour=king.colour)
+            ):
+                a_castling = True
+
+            if (
+                    self.castling_rights & h_right
+                    and possible_h_rook is not None and possible_h_rook.code == rook_code
+                    and all(piece is None for piece in back_rank[5:7])
+                    and self._check_if_legal_castle(side='h', colour=king.colour)
+            ):
+                h_castling = True
+
+        return {"a": a_castling, "h": h_castling}
+
+    def _get_legal_king_moves(self, king: King) -> dict[str, [list[int], dict[str, [bool]]]]:
+        return {"legal_moves": self._get_piece_moves(king), "legal_castling": self._get_legal_castling(king)}
+
+    def _get_pins_and_checks(self, colour: Colour) -> tuple[dict[int, tuple[int, ...]], int, Optional[tuple[int, ...]]]:
+        """ Scans outward from ``colour``'s king once
+
+            Returns the pinned pieces (square -> squares they may still move to: the pin ray up to and including the
+            pinner), the number of checkers and, for a single check, the squares that block or capture the checker.
+        """
+        squares = self.board.squares
+        side = COLOUR_INDEX[colour]
+        king = SQUARES[self.board.king_squares[side]]
+        base = 6 * (side ^ 1)
+        queen = base + QUEEN_KIND
+
+        pins = {}
+        checkers = 0
+        check_mask = None
+
+        for ray_group, slider in ((STRAIGHT_RAYS, base + ROOK_KIND), (DIAGONAL_RAYS, base + BISHOP_KIND)):
+            for ray in king.rays[ray_group]:
+                pinned = None
+
+                for distance, target in enumerate(ray):
+                    piece = squares[target]
+                    if piece is None:
+                        continue
+
+                    if piece.colour == colour:
+                        if pinned is not None:  # two of our own pieces, nothing to see
+                            break
+                        pinned = target
+                        continue
+
+                    if piece.code == slider or piece.code == queen:
+                        if pinned is None:
+                            checkers += 1
+                            check_mask = ray[:distance + 1]
+                        else:
+                            pins[pinned] = ray[:distance + 1]
+                    break
+
+        for targets, attacker in ((king.knight_targets, base + KNIGHT_KIND),
+                                  (king.pawn_captures[side], base + PAWN_KIND)):
+            for target in targets:
+                piece = squares[target]
+                if piece is not None and piece.code == attacker:
+                    checkers += 1
+                    check_mask = (target,)
+
+        return pins, checkers, check_mask
+
+    def _get_move_targets(self, piece: Piece) -> list[int]:
+        """ Every target square of ``piece`` including castling, without checking if the king is left in check"""
         if isinstance(piece, Pawn):
             return self._get_legal_pawn_moves(piece)
 
         elif isinstance(piece, King):
-            return self._get_legal_king_moves(piece)
+            king_moves = self._get_legal_king_moves(piece)
+            legal_moves = king_moves["legal_moves"]
+            if king_moves["legal_castling"]["a"]:
+                legal_moves.append(piece.square - 2)
+            if king_moves["legal_castling"]["h"]:
+                legal_moves.append(piece.square + 2)
+            return legal_moves
 
-        for coord in piece.move_atlas:
+        return self._get_piece_moves(piece)
 
-            if piece.can_make_long_move:
-                new_pos = piece.pos
+    def get_legal_moves(self, piece: Piece) -> \
+            Union[list[Square], dict[str, [list[Square], dict[str, bool]]]]:
+        # Doesn't check if player is in check
+        cache = self.move_cache
+        if cache is None:
+            return self._get_piece_legal_moves(piece)
+
+        key = (self.zobrist_key, piece.square)
+        moves = cache.get(key)
+        if moves is None:
+            moves = self._get_piece_legal_moves(piece)
+            cache.put(key, moves)
+        # copies, the cached lists / dicts must not be changed by the caller
+        if isinstance(moves, dict):
+            return {"legal_moves": list(moves["legal_moves"]), "legal_castling": dict(moves["legal_castling"])}
+        return list(moves)
+
+    def _get_piece_legal_moves(self, piece: Piece) -> \
+            Union[list[Square], dict[str, [list[Square], dict[str, bool]]]]:
+        if isinstance(piece, Pawn):
+            return [SQUARES[index] for index in self._get_legal_pawn_moves(piece)]
 
-                while 1 <= piece.pos.x + coord.x <= 8 and 1 <= new_pos.y + coord.y <= 8:  # check all possible spaces
+        elif isinstance(piece, King):
+            king_moves = self._get_legal_king_moves(piece)
+            return {"legal_moves": [SQUARES[index] for index in king_moves["legal_moves"]],
+                    "legal_castling": king_moves["legal_castling"]}
 
-                    try:
-                        new_pos += coord
+        return [SQUARES[index] for index in self._get_piece_moves(piece)]
 
-                    except InvalidPosition:
-                        break
+    def pseudo_legal_moves(self) -> list[int]:
+        """ Every move of the side to move (encoded, see encode_move) without checking if the king is left in check"""
+        moves = []
+        squares = self.board.squares
 
-                    new_pos_notation = str(new_pos)
-                    piece_at_coord = self.board.get(new_pos_notation)
+        for index in BOARD_SQUARES:
+            piece = squares[index]
+            if piece is None or piece.colour != self.turn:
+                continue
 
-                    if piece_at_coord is not None:  # Stop checking for moves if piece is in the way
-                        if piece_at_coord.colour != self.current_player.colour:  # if same colour ignore
-                            legal_moves.append(new_pos)
-                        break
+            for move_pos in self._get_move_targets(piece):
+                if piece.kind == PAWN_KIND and move_pos >> 4 in (0, 7):
+                    for promotion in (QUEEN_KIND, ROOK_KIND, BISHOP_KIND, KNIGHT_KIND):
+                        moves.append(index | move_pos << 7 | promotion << 14)
+                else:
+                    moves.append(index | move_pos << 7)
+
+        return moves
+
+    def legal_moves(self) -> list[int]:
+        """ Every legal move of the side to move (encoded, see encode_move), from the move cache if there is one"""
+        cache = self.move_cache
+        if cache is None:
+            return self._generate_legal_moves()
+
+        key = self.zobrist_key
+        moves = cache.get(key)
+        if moves is None:
+            moves = tuple(self._generate_legal_moves())
+            cache.put(key, moves)
+        return list(moves)
+
+    def _generate_legal_moves(self) -> list[int]:
+        """ Pins and checks are worked out once per position: pinned pieces stay on their pin ray, in single check
+            only blocks and captures of the checker are kept and in double check only the king moves. King moves are
+            checked against attacks with the king lifted off the board (so it can't hide behind itself). En passant
+            is the one move still tried with push / pop, as it can expose the king along its rank.
+
+            The bitboard backend generates the whole list from its bitboards instead.
+        """
+        if self._movegen is not None:
+            return self._movegen.legal_moves()
+
+        board = self.board
+        squares = board.squares
+        colour = self.turn
+        opponent = BLACK if colour == WHITE else WHITE
+        pins, checkers, check_mask = self._get_pins_and_checks(colour)
+        legal_moves = []
 
-                    legal_moves.append(new_pos)
+        # King
+        king_square = board.king_squares[COLOUR_INDEX[colour]]
+        king = board._remove(king_square)
+        for move_pos in self._get_piece_moves(king):
+            if not self.is_square_attacked(move_pos, opponent):
+                legal_moves.append(king_square | move_pos << 7)
+        board._put(king_square, king)
+
+        if checkers > 1:
+            return legal_moves
+
+        if not checkers:
+            castling = self._get_legal_castling(king)
+            if castling["a"]:
+                legal_moves.append(king_square | (king_square - 2) << 7)
+            if castling["h"]:
+                legal_moves.append(king_square | (king_square + 2) << 7)
+
+        # Everything else
+        for index in BOARD_SQUARES:
+            piece = squares[index]
+            if piece is None or piece.colour != colour or piece.kind == KING_KIND:
+                continue
 
-            else:
-                try:
-                    new_pos = piece.pos + coord
+            pin_ray = pins.get(index)
+
+            if piece.kind == PAWN_KIND:
+                for move_pos in self._get_legal_pawn_moves(piece):
+                    if move_pos == self.en_passant_target and (move_pos - index) & 7:
+                        move = index | move_pos << 7
+                        self.push(move)
+                        if not self.check_if_in_check(colour=colour):
+                            legal_moves.append(move)
+                        self.pop()
+                        continue
+
+                    if pin_ray is not None and move_pos not in pin_ray:
+                        continue
+                    if check_mask is not None and move_pos not in check_mask:
+                        continue
+
+                    if move_pos >> 4 in (0, 7):
+                        for promotion in (QUEEN_KIND, ROOK_KIND, BISHOP_KIND, KNIGHT_KIND):
+                            legal_moves.append(index | move_pos << 7 | promotion << 14)
+                    else:
+                        legal_moves.append(index | move_pos << 7)
+
+            elif pin_ray is None or piece.kind != KNIGHT_KIND:  # a pinned knight can never move
+                for move_pos in self._get_piece_moves(piece):
+                    if pin_ray is not None and move_pos not in pin_ray:
+                        continue
+                    if check_mask is not None and move_pos not in check_mask:
+                        continue
+                    legal_moves.append(index | move_pos << 7)
 
-                except InvalidPosition:
-                    continue
+        return legal_moves
 
-            if self.board[str(new_pos)] is None:
-                legal_moves.append(new_pos)
+    def push(self, move: int) -> None:
+        """ Applies ``move`` in place (no legality check), pop() reverts it
 
-            elif self.board[str(new_pos)].colour != self.current_player.colour:
-                legal_moves.append(new_pos)
+            Only what can't be recomputed is stored on the undo stack: the moved and captured pieces, castling
+            rights, en passant target, halfmove clock and the non-piece part of the Zobrist key.
+        """
+        board = self.board
+        current_pos, move_pos, promotion = move & 0x7F, move >> 7 & 0x7F, move >> 14
 
-        return legal_moves
+        piece = board._remove(current_pos)
+        piece_at_board_pos = board._remove(move_pos)
 
-    def _set_up_move(self, piece: Piece, new_move_position: BoardCoordinates):
-        current_pos = str(piece.pos)
-        move_pos = str(new_move_position)
-        legal_moves = self.get_legal_moves(piece)
-        invalid_move = False
-
-        if (
-            isinstance(legal_moves, dict)
-            and legal_moves["legal_moves"] is not None
-            and new_move_position not in legal_moves["legal_moves"]
-        ):
-            invalid_move = True
-
-        elif (
-            isinstance(legal_moves, dict)
-            and legal_moves["legal_moves"] is None
-            and not legal_moves["legal_castling"]["a"]
-            and not legal_moves["legal_castling"]["h"]
-        ):
-            invalid_move = True
-                
-        elif not isinstance(legal_moves, dict) and new_move_position not in legal_moves:
-            invalid_move = True
-
-        if invalid_move:
-            if isinstance(piece, King):
-                return MoveStatus.INVALID_MOVE, None, None, None
-            return MoveStatus.INVALID_MOVE, None, None
-
-        temp_board = deepcopy(self.board)
-        temp_board[current_pos] = None
-        temp_board[move_pos] = piece
-
-        if self.check_if_in_check(temp_board):
-            return MoveStatus.PUTS_KING_IN_CHECK, None, None
+        if piece.kind == PAWN_KIND and piece_at_board_pos is None and (move_pos - current_pos) & 7:  # en passant
+            piece_at_board_pos = board._remove(move_pos - piece.push_offset)
 
-        if isinstance(piece, King):
-            return MoveStatus.VALID_SETUP, current_pos, move_pos, legal_moves
+        self._undo_stack.append((move, piece, piece_at_board_pos, self.castling_rights, self.en_passant_target,
+                                 self.halfmove_clock, self._state_key))
 
-        return MoveStatus.VALID_SETUP, current_pos, move_pos
+        # XOR out the old castling rights / en passant file, flip the side to move
+        zobrist_key = self._state_key ^ CASTLING_KEYS[self.castling_rights] ^ SIDE_KEY
+        if self.en_passant_target is not None:
+            zobrist_key ^= EN_PASSANT_KEYS[self.en_passant_target & 7]
 
-    def _make_pawn_move(self, pawn: Pawn, new_move_position: BoardCoordinates) -> MoveStatus:
-        move_status, current_pos, move_pos = self._set_up_move(pawn, new_move_position)
-        piece_at_board_pos = None
+        self.en_passant_target = None
 
-        if move_status != MoveStatus.VALID_SETUP:
-            return move_status
+        if piece.kind == PAWN_KIND:
+            if abs(move_pos - current_pos) == 32:
+                self.en_passant_target = (current_pos + move_pos) // 2
+                zobrist_key ^= EN_PASSANT_KEYS[current_pos & 7]
 
-        if abs(pawn.pos - new_move_position) == (1, 1):
+            if promotion:
+                piece = PROMOTION_PIECES[promotion](piece.colour)
 
-            try:
-                if self.en_passant_target == str(pawn.pos + (-1, 0)):
-                    piece_at_board_pos = self.board.get(str(pawn.pos + (-1, 0)))
+            self.halfmove_clock = 0
 
-            except InvalidPosition:
-                pass
+        else:
+            if piece.kind == KING_KIND and abs(move_pos - current_pos) == 2:  # castle
+                rank = current_pos & 0x70
+                if move_pos > current_pos:
+                    board._put(rank + 5, board._remove(rank + 7))
+                else:
+                    board._put(rank + 3, board._remove(rank))
 
-            try:
-                if self.en_passant_target == str(pawn.pos + (1, 0)):
-                    piece_at_board_pos = self.board.get(str(pawn.pos + (1, 0)))
+            self.halfmove_clock = 0 if piece_at_board_pos is not None else self.halfmove_clock + 1
 
-            except InvalidPosition:
-                pass
+        board._put(move_pos, piece)
+        self.castling_rights &= CASTLING_MASKS[current_pos] & CASTLING_MASKS[move_pos]
+        self._state_key = zobrist_key ^ CASTLING_KEYS[self.castling_rights]
 
-            if piece_at_board_pos is None:
-                piece_at_board_pos = self.board.get(str(new_move_position))
+        if self.turn == BLACK:
+            self.fullmove_number += 1
+            self.turn = WHITE
+        else:
+            self.turn = BLACK
 
-            self.current_player.captured_pieces.append(piece_at_board_pos)
-            self.board.set(str(piece_at_board_pos.pos), None)
+    def pop(self) -> int:
+        """ Reverts the last push(), returns the reverted move"""
+        board = self.board
+        (move, piece, piece_at_board_pos, self.castling_rights, self.en_passant_target, self.halfmove_clock,
+         self._state_key) = self._undo_stack.pop()
+        current_pos, move_pos = move & 0x7F, move >> 7 & 0x7F
 
-        if abs(pawn.pos - new_move_position) in ((0, -2), (0, 2)):
+        board._remove(move_pos)
+        board._put(current_pos, piece)
 
-            try:
-                if self.current_player.colour == WHITE:
-                    self.en_passant_target = str(pawn.pos + (0, 2))
+        if piece_at_board_pos is not None:
+            board._put(piece_at_board_pos.square, piece_at_board_pos)
 
-            except InvalidPosition:
-                pass
+        elif piece.kind == KING_KIND and abs(move_pos - current_pos) == 2:  # castle
+            rank = current_pos & 0x70
+            if move_pos > current_pos:
+                board._put(rank + 7, board._remove(rank + 5))
+            else:
+                board._put(rank, board._remove(rank + 3))
 
-            try:
-                if self.current_player.colour == BLACK:
-                    self.en_passant_target = str(pawn.pos + (0, -2))
+        if self.turn == WHITE:
+            self.fullmove_number -= 1
+            self.turn = BLACK
+        else:
+            self.turn = WHITE
 
-            except InvalidPosition:
-                pass
+        return move
 
-            pawn.has_moved = True
+    def _set_up_move(self, piece: Piece, new_move_position: BoardCoordinates,
+                     promotion: int = QUEEN_KIND) -> tuple[MoveStatus, Optional[int]]:
+        current_pos = piece.square
+        move_pos = xy_to_index(new_move_position.x, new_move_position.y)
 
-        self.board.set(current_pos, None)
-        self.board.set(move_pos, pawn)
+        if move_pos & OFF_BOARD or move_pos not in self._get_move_targets(piece):
+            return MoveStatus.INVALID_MOVE, None
 
-        return MoveStatus.VALID_MOVE
+        if piece.kind != PAWN_KIND or move_pos >> 4 not in (0, 7):
+            promotion = 0
+        move = encode_move(current_pos, move_pos, promotion)
 
-    def _make_king_move(self, piece: King, new_move_position: BoardCoordinates) -> MoveStatus:
-        move_status, current_pos, move_pos, legal_moves = self._set_up_move(piece, new_move_position)
+        self.push(move)
+        puts_king_in_check = self.check_if_in_check(colour=piece.colour)
+        self.pop()
 
-        if move_status != MoveStatus.VALID_SETUP:
-            return move_status
+        if puts_king_in_check:
+            return MoveStatus.PUTS_KING_IN_CHECK, None
 
-        piece_at_board_pos = self.board.get(move_pos)
+        return MoveStatus.VALID_SETUP, move
 
-        if new_move_position.x == 3 and legal_moves["legal_castling"]["a"]:
-            # castle
-            rank = 1 if self.current_player.colour == WHITE else 8
+    def _finish_move(self, move: int) -> None:
+        """ push() a validated move + keep track of captured / promoted pieces"""
+        mover = self.current_player
+        self.push(move)
 
-            rook = self.board.get(f"a{rank}")
-            king = self.board.get(f"e{rank}")
+        piece_at_board_pos = self._undo_stack[-1][2]
+        if piece_at_board_pos is not None:
+            mover.captured_pieces.append(piece_at_board_pos)
 
-            rook.pos.set_with_notation(f"d{rank}")
-            king.pos.set_with_notation(f"c{rank}")
+        promoted_piece = self.board.squares[move_to(move)]
+        if move_promotion(move):
+            self._pieces[(str(promoted_piece), id(promoted_piece))] = promoted_piece
 
-            self.board.set(f"d{rank}", rook)
-            self.board.set(f"c{rank}", king)
+    def _make_pawn_move(self, pawn: Pawn, new_move_position: BoardCoordinates,
+                        promotion: int = QUEEN_KIND) -> MoveStatus:
+        move_status, move = self._set_up_move(pawn, new_move_position, promotion)
 
-        elif new_move_position.x == 7 and legal_moves["legal_castling"]["h"]:
-            # castle
-            rank = 1 if self.current_player.colour == WHITE else 8
-            rook = self.board.get(f"h{rank}")
-            king = self.board.get(f"e{rank}")
+        if move_status != MoveStatus.VALID_SETUP:
+            return move_status
 
-            self.board.set(f"f{rank}", rook)
-            self.board.set(f"g{rank}", king)
+        self._finish_move(move)
+        pawn.has_moved = True
 
-        elif piece_at_board_pos is None:
-            self.board.set(move_pos, piece)
-            self.board[current_pos] = None
+        return MoveStatus.VALID_MOVE
 
-        elif piece_at_board_pos.colour != self.current_player.colour:
-            self.current_player.captured_pieces.append(piece_at_board_pos)
-            self.board.set(move_pos, piece)
-            self.board[current_pos] = None
+    def _make_king_move(self, piece: King, new_move_position: BoardCoordinates) -> MoveStatus:
+        move_status, move = self._set_up_move(piece, new_move_position)
+
+        if move_status != MoveStatus.VALID_SETUP:
+            return move_status
+
+        self._finish_move(move)
+
+        current_pos, move_pos = move_from(move), move_to(move)
+        if abs(move_pos - current_pos) == 2:  # castled
+            self.board.squares[move_pos - 1 if move_pos > current_pos else move_pos + 1].has_moved = True
 
         if not piece.has_moved:
             piece.has_moved = True
 
         return MoveStatus.VALID_MOVE
 
-    def make_move(self, piece: Piece, new_move_position: BoardCoordinates) -> MoveStatus:
-        """ Returns a bool based on if the move was successful or not"""
+    def make_move(self, piece: Piece, new_move_position: BoardCoordinates,
+                  promotion: int = QUEEN_KIND) -> MoveStatus:
+        """ Validates + plays the move, the turn passes to the other player if it was successful
+
+            ``promotion`` is the kind a pawn reaching the last rank becomes (ignored for any other move).
+        """
         if isinstance(piece, Pawn):
-            return self._make_pawn_move(piece, new_move_position)
-        else:
-            self.en_passant_target = None
+            return self._make_pawn_move(piece, new_move_position, promotion)
 
         if isinstance(piece, King):
             return self._make_king_move(piece, new_move_position)
 
-        current_pos = str(piece.pos)
-        move_pos = str(new_move_position)
-        legal_moves = self.get_legal_moves(piece)
-
-        if new_move_position not in legal_moves:
-            print(new_move_position, legal_moves)
-            return MoveStatus.INVALID_MOVE  # Illegal, illegal move
-
-        temp_board = deepcopy(self.board)
-
-        temp_board[move_pos] = piece
-        temp_board[current_pos] = None
-
-        if self.check_if_in_check(temp_board):
-            return MoveStatus.PUTS_KING_IN_CHECK  # Illegal, move puts player in check
+        move_status, move = self._set_up_move(piece, new_move_position)
 
-        piece_at_board_pos = self.board.get(move_pos)
-
-        try:
-            if piece_at_board_pos.colour != self.current_player.colour:
-                self.current_player.captured_pieces.append(piece_at_board_pos)
-
-        except AttributeError:
-            pass
+        if move_status != MoveStatus.VALID_SETUP:
+            return move_status  # Illegal move or move puts player in check
 
-        self.board.set(move_pos, piece)
-        self.board.set(current_pos, None)
+        self._finish_move(move)
 
         if isinstance(piece, Rook) and not piece.has_moved:
             piece.has_moved = True
 
         return MoveStatus.VALID_MOVE
 
-    def check_if_in_check(self, board: Optional[Board] = None) -> bool:
+    def check_if_in_check(self, board: Optional[Board] = None, colour: Optional[Colour] = None) -> bool:
         if board is None:
             board = self.board
+        if colour is None:
+            colour = self.current_player.colour
+
+        king_square = board.king_squares[COLOUR_INDEX[colour]]
+        return king_square is not None and self.is_square_attacked(king_square, BLACK if colour == WHITE else WHITE,
+                                                                    board)
+
+
+def iter_fens(source: Union[str, Iterable[str]], game: Optional[Game] = None, movegen: str = "mailbox",
+              attack_maps: bool = False) -> Iterator[Game]:
+    """ Streams the FEN records of ``source`` (a file path or an iterable of lines) into one game
+
+        The same Game (and its Board / Piece objects) is yielded for every record, loaded in place, so it is only
+        valid until the next record is read: copy what is needed (to_fen, zobrist_key, ...) before moving on. Blank
+        lines and lines starting with # are skipped, anything after a ; (EPD style operations) is ignored.
+    """
+    if game is None:
+        game = Game(Player("WHITE", WHITE), Player("BLACK", BLACK), movegen=movegen, attack_maps=attack_maps)
 
-        return self.king_pos[self.current_player.colour] in self._get_opponent_moves(board)
+    lines = open(source) if isinstance(source, str) else source
+    try:
+        for line in lines:
+            fen = line.split(";", 1)[0].strip()
+            if fen and not fen.startswith("#"):
+                game.board.load_from_fen(fen, game)
+                yield game
+    finally:
+        if isinstance(source, str):
+            lines.close()
 
 
 class Player:
     name: str
     game: Game
     hasMoved: bool
-    captured_pieces = []
+    captured_pieces: list[Piece]
 
     def __init__(self, name, colour):
         self.in_check = False
         self.name, self.colour, self.hasMoved = name, colour, False
+        self.captured_pieces = []
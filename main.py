@@ -10,9 +10,12 @@ class _Exception(BaseException):
 
 
 class Chess:
+    movegen = "mailbox"  # see game.MOVEGEN_BACKENDS
+    attack_maps = False
+
     def __init__(self):
         self.player_1, self.player_2 = self.start()
-        self.game = Game(self.player_1, self.player_2)
+        self.game = Game(self.player_1, self.player_2, movegen=self.movegen, attack_maps=self.attack_maps)
 
     def start_game_loop(self):
         self._game_loop()
@@ -0,0 +1,57 @@
+""" Legal move cache
+
+    Opt-in memo of move generation for services that see the same positions over and over (opening lines, replays,
+    hover hints): ``Game(..., move_cache=MoveCache())`` makes ``Game.legal_moves`` and ``Game.get_legal_moves`` look
+    the position up before generating anything. One cache can be shared by any number of games.
+
+    Entries are keyed by ``Game.zobrist_key``, which covers the pieces, side to move, castling rights and en passant
+    target, so a position reached by make_move, castling or a double pawn push is a different key and nothing ever has
+    to be invalidated. The least recently used entry is dropped once ``capacity`` is reached.
+"""
+
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class MoveCache:
+    def __init__(self, capacity: int = 100_000):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = capacity
+        self._entries: OrderedDict[Hashable, Any] = OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """ Cached moves for ``key`` (marked most recently used), None on a miss"""
+        moves = self._entries.get(key)
+        if moves is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return moves
+
+    def put(self, key: Hashable, moves: Any) -> None:
+        entries = self._entries
+        entries[key] = moves
+        entries.move_to_end(key)
+        if len(entries) > self.capacity:
+            entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.hits = self.misses = self.evictions = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "entries": len(self._entries)}
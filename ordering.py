@@ -0,0 +1,104 @@
+""" Move ordering for alpha-beta searches on a ``Game``
+
+    Alpha-beta cuts off as soon as a move is good enough, so the earlier the best move is tried the fewer nodes get
+    searched. ``MoveOrderer.order`` sorts the encoded moves of a position:
+
+        1. hash move (best move stored in the transposition table / previous principal variation)
+        2. captures and promotions, most valuable victim first, then least valuable attacker (MVV-LVA)
+        3. killer moves: quiet moves that caused a cutoff at the same ply elsewhere in the tree
+        4. the other quiet moves by history score: how often (weighted by depth) the piece moving to that square
+           caused a cutoff
+
+    Searches report their cutoffs with ``record_cutoff`` and call ``new_search`` before each search.
+"""
+
+from __future__ import annotations
+
+from typing import Optional
+
+from game import Game
+from pieces import BISHOP_KIND, KING_KIND, KNIGHT_KIND, PAWN_KIND, QUEEN_KIND, ROOK_KIND
+
+MAX_PLY = 128
+
+HASH_MOVE_SCORE = 1 << 30
+CAPTURE_SCORE = 1 << 26
+KILLER_SCORE = 1 << 24
+HISTORY_LIMIT = 1 << 20  # history is halved when an entry gets here, staying well below the killers
+
+# MVV-LVA values by kind
+VICTIM_VALUES = {PAWN_KIND: 1, KNIGHT_KIND: 3, BISHOP_KIND: 3, ROOK_KIND: 5, QUEEN_KIND: 9, KING_KIND: 100}
+
+
+class MoveOrderer:
+    def __init__(self):
+        self.killers: list[list[int]] = [[0, 0] for _ in range(MAX_PLY + 1)]
+        self.history: list[list[int]] = [[0] * 128 for _ in range(12)]  # piece code -> 0x88 target
+
+    def new_search(self) -> None:
+        """ Killers are position specific so they are cleared, history carries over (aged)"""
+        for killers in self.killers:
+            killers[0] = killers[1] = 0
+        self._age_history()
+
+    def _age_history(self) -> None:
+        for targets in self.history:
+            for index, value in enumerate(targets):
+                if value:
+                    targets[index] = value >> 1
+
+    def order(self, game: Game, moves: list[int], ply: int = 0, hash_move: Optional[int] = None) -> list[int]:
+        squares = game.board.squares
+        en_passant_target = game.en_passant_target
+        killer_1, killer_2 = self.killers[ply]
+        history = self.history
+
+        def score(move: int) -> int:
+            if move == hash_move:
+                return HASH_MOVE_SCORE
+
+            current_pos, move_pos, promotion = move & 0x7F, move >> 7 & 0x7F, move >> 14
+            piece = squares[current_pos]
+            victim = squares[move_pos]
+
+            if victim is not None:
+                value = CAPTURE_SCORE + VICTIM_VALUES[victim.kind] * 16 - piece.kind
+            elif move_pos == en_passant_target and piece.kind == PAWN_KIND and (move_pos - current_pos) & 7:
+                value = CAPTURE_SCORE + VICTIM_VALUES[PAWN_KIND] * 16
+            elif promotion:
+                value = CAPTURE_SCORE
+            elif move == killer_1:
+                return KILLER_SCORE + 1
+            elif move == killer_2:
+                return KILLER_SCORE
+            else:
+                return history[piece.code][move_pos]
+
+            if promotion:
+                value += VICTIM_VALUES[promotion] * 16
+            return value
+
+        return sorted(moves, key=score, reverse=True)
+
+    def is_quiet(self, game: Game, move: int) -> bool:
+        """ Neither a capture nor a promotion (in the position before ``move`` is made)"""
+        current_pos, move_pos = move & 0x7F, move >> 7 & 0x7F
+        if move >> 14 or game.board.squares[move_pos] is not None:
+            return False
+        return not (move_pos == game.en_passant_target and game.board.squares[current_pos].kind == PAWN_KIND
+                    and (move_pos - current_pos) & 7)
+
+    def record_cutoff(self, game: Game, move: int, depth: int, ply: int) -> None:
+        """ ``move`` (not yet made) caused a beta cutoff at ``ply``, only quiet moves are remembered"""
+        if not self.is_quiet(game, move):
+            return
+
+        killers = self.killers[ply]
+        if killers[0] != move:
+            killers[1], killers[0] = killers[0], move
+
+        targets = self.history[game.board.squares[move & 0x7F].code]
+        move_pos = move >> 7 & 0x7F
+        targets[move_pos] += depth * depth
+        if targets[move_pos] >= HISTORY_LIMIT:
+            self._age_history()
@@ -0,0 +1,177 @@
+""" Multi-process perft and search
+
+    Root split: ``parallel_perft`` / ``parallel_divide`` / ``parallel_search`` give every root move its own task.
+    Lazy SMP: ``lazy_smp_search`` runs whole searches side by side that share a transposition table in shared memory.
+    PGN validation: ``parallel_validate`` replays the games of a PGN file in shards cut at game boundaries.
+
+    Python runs one thread of bytecode per process, so both spread the work over a ``ProcessPoolExecutor``. Workers
+    get the position as its FEN record (plus the encoded root move for root split) and rebuild it with
+    ``Game.from_fen``, nothing else (players, piece objects, undo stack) crosses the process boundary.
+
+    Results are collected in task order, so totals and the chosen move don't depend on which worker finished first.
+"""
+
+from __future__ import annotations
+
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, Optional
+
+from board_layout import SQUARES
+from engine import MATE_SCORE, MAX_PLY, Engine, SearchInfo, SearchResult
+from game import Game, move_from, move_notation, move_to
+from perft import perft
+from pgn import GameReport, read_games, shard_offsets, validate_game
+from transposition import SharedTranspositionTable
+
+
+def _perft_worker(task: tuple[str, str, int, int]) -> int:
+    fen, movegen, move, depth = task
+    game = Game.from_fen(fen, movegen=movegen)
+    game.push(move)
+    return perft(game, depth - 1)
+
+
+def _search_worker(task: tuple[str, str, int, int, Optional[float], float]) -> tuple[int, int, list[int]]:
+    """ (score from the root's point of view, nodes, principal variation after the root move)"""
+    fen, movegen, move, depth, time_limit, hash_mb = task
+    game = Game.from_fen(fen, movegen=movegen)
+    game.push(move)
+    result = Engine(game, hash_mb).search(depth - 1, time_limit)
+    return _parent_score(result.score), result.nodes, result.pv
+
+
+def _parent_score(score: int) -> int:
+    """ Child score -> parent score, mate distances grow by the root move"""
+    score = -score
+    if score >= MATE_SCORE - MAX_PLY:
+        return score - 1
+    if score <= -MATE_SCORE + MAX_PLY:
+        return score + 1
+    return score
+
+
+def parallel_divide(game: Game, depth: int, workers: Optional[int] = None, movegen: str = "mailbox") -> dict[str, int]:
+    """ perft split by root move, one pool task per root move"""
+    fen = game.to_fen()
+    moves = game.legal_moves()
+    if depth <= 1:
+        return {move_notation(move): 1 for move in moves}
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        counts = executor.map(_perft_worker, [(fen, movegen, move, depth) for move in moves])
+        return {move_notation(move): count for move, count in zip(moves, counts)}
+
+
+def parallel_perft(game: Game, depth: int, workers: Optional[int] = None, movegen: str = "mailbox") -> int:
+    if depth <= 1:
+        return perft(game, depth)
+    return sum(parallel_divide(game, depth, workers, movegen).values())
+
+
+def parallel_search(game: Game, depth: int, workers: Optional[int] = None, time_limit: Optional[float] = None,
+                    movegen: str = "mailbox", hash_mb: float = 16) -> SearchResult:
+    """ Searches every root move to ``depth`` in its own task (``time_limit`` applies per root move)
+
+        Root moves are searched with a full window each, so there are no alpha-beta cutoffs between them: this trades
+        total nodes for wall clock time. Ties go to the first root move in generation order. The smallest depth is 2
+        (one ply below every root move).
+    """
+    depth = max(depth, 2)
+    start = time.perf_counter()
+    fen = game.to_fen()
+    moves = game.legal_moves()
+    result = SearchResult(None, None, None, 0, 0, 0)
+    if not moves:
+        result.score = -MATE_SCORE if game.check_if_in_check() else 0
+        return result
+
+    tasks = [(fen, movegen, move, depth, time_limit, hash_mb) for move in moves]
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        outcomes = list(executor.map(_search_worker, tasks))
+
+    best_index = max(range(len(moves)), key=lambda index: (outcomes[index][0], -index))
+    score, _, pv = outcomes[best_index]
+    nodes = sum(outcome[1] for outcome in outcomes) + 1
+
+    result.move, result.score, result.depth, result.nodes = moves[best_index], score, depth, nodes
+    result.piece = game.board.squares[move_from(result.move)]
+    result.position = SQUARES[move_to(result.move)]
+    result.iterations.append(SearchInfo(depth, score, nodes, time.perf_counter() - start, [result.move] + pv))
+    return result
+
+
+def _lazy_smp_worker(task: tuple[str, str, str, float, int, int, Optional[float]]) -> tuple[int, Optional[int], int,
+                                                                                               int, list[int]]:
+    """ (depth reached, best move, score, nodes, principal variation) of one helper search"""
+    fen, movegen, table_name, hash_mb, generation, depth, time_limit = task
+    game = Game.from_fen(fen, movegen=movegen)
+    table = SharedTranspositionTable(hash_mb, name=table_name, generation=generation)
+    try:
+        result = Engine(game, tt=table).search(depth, time_limit)
+    finally:
+        table.close()
+    return result.depth, result.move, result.score, result.nodes, result.pv
+
+
+def lazy_smp_search(game: Game, depth: int, workers: Optional[int] = None, time_limit: Optional[float] = None,
+                    movegen: str = "mailbox", hash_mb: float = 64) -> SearchResult:
+    """ Lazy SMP: ``workers`` processes search the whole position at once, sharing one transposition table
+
+        The processes don't talk to each other, they only meet in the shared table, where each one finds the
+        subtrees the others already searched. Every other process searches one ply deeper, so they drift apart in
+        the tree instead of all searching the same nodes in the same order. The result of the deepest finished
+        search is returned (the first process on ties).
+    """
+    start = time.perf_counter()
+    workers = workers or os.cpu_count()
+    fen = game.to_fen()
+    table = SharedTranspositionTable(hash_mb)
+    table.new_search()
+
+    tasks = [(fen, movegen, table.name, hash_mb, table.generation, depth + index % 2, time_limit)
+             for index in range(workers)]
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            outcomes = list(executor.map(_lazy_smp_worker, tasks))
+    finally:
+        table.close()
+        table.unlink()
+
+    best_depth, move, score, _, pv = max(outcomes, key=lambda outcome: outcome[0])
+    nodes = sum(outcome[3] for outcome in outcomes)
+
+    result = SearchResult(move, None, None, score, best_depth, nodes)
+    if move is not None:
+        result.piece = game.board.squares[move_from(move)]
+        result.position = SQUARES[move_to(move)]
+        result.iterations.append(SearchInfo(best_depth, score, nodes, time.perf_counter() - start, pv))
+    return result
+
+
+def _validate_worker(task: tuple[str, int, int, str]) -> list[GameReport]:
+    path, start, stop, movegen = task
+    return [validate_game(pgn_game, movegen) for pgn_game in read_games(path, start=start, stop=stop)]
+
+
+def parallel_validate(path: str, workers: Optional[int] = None, movegen: str = "mailbox",
+                      shard_size: int = 1 << 20) -> Iterator[GameReport]:
+    """ Reports of every game of the PGN file at ``path`` (see pgn.validate_game), in file order
+
+        The file is cut into shards of about ``shard_size`` bytes at game boundaries, each one a pool task that maps
+        the file itself, so only offsets go to the workers. At most two shards per worker are in flight or waiting to
+        be read, memory stays the same however large the file is.
+    """
+    workers = workers or os.cpu_count()
+    offsets = shard_offsets(path, shard_size)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for start, stop in zip(offsets, offsets[1:]):
+            pending.append(executor.submit(_validate_worker, (path, start, stop, movegen)))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
@@ -0,0 +1,152 @@
+""" perft: count the leaf nodes of the legal move tree
+
+    The counts of the reference positions below are known, so any difference points at a move generation bug and
+    ``--divide`` (one count per root move) narrows it down to a move. The nodes per second of a run is the throughput
+    number to compare between backends and releases.
+
+    python perft.py 4                       start position, depth 4
+    python perft.py 3 --fen "<fen>" --divide
+    python perft.py 3 --suite --movegen bitboard
+    python perft.py 5 --compare             nodes / s of every move generation backend
+    python perft.py 6 --workers 32
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+
+from default_positions import starting_fen
+from game import MOVEGEN_BACKENDS, Game, move_notation
+
+START_FEN = starting_fen
+
+# name, FEN, leaf counts for depth 1, 2, ...
+REFERENCE_POSITIONS = [
+    ("start", START_FEN, [20, 400, 8902, 197281, 4865609]),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     [48, 2039, 97862, 4085603]),
+    ("position 3", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", [14, 191, 2812, 43238, 674624]),
+    ("position 4", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1", [6, 264, 9467, 422333]),
+    ("position 4 mirrored", "r2q1rk1/pP1p2pp/Q4n2/bbp1p3/Np6/1B3NBn/pPPP1PPP/R3K2R b KQ - 0 1",
+     [6, 264, 9467, 422333]),
+    ("position 5", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8", [44, 1486, 62379, 2103487]),
+    ("position 6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     [46, 2079, 89890, 3894594]),
+]
+
+
+def perft(game: Game, depth: int) -> int:
+    if depth == 0:
+        return 1
+
+    moves = game.legal_moves()
+    if depth == 1:  # bulk counting, the leaves themselves are never made
+        return len(moves)
+
+    nodes = 0
+    for move in moves:
+        game.push(move)
+        nodes += perft(game, depth - 1)
+        game.pop()
+    return nodes
+
+
+def divide(game: Game, depth: int) -> dict[str, int]:
+    """ perft split by root move"""
+    counts = {}
+    for move in game.legal_moves():
+        game.push(move)
+        counts[move_notation(move)] = perft(game, depth - 1)
+        game.pop()
+    return counts
+
+
+def run_suite(depth: int, movegen: str = "mailbox", attack_maps: bool = False, verbose: bool = True) -> bool:
+    """ Checks every reference position up to ``depth`` (or its deepest known count), True if all match"""
+    passed = True
+    total_nodes, total_time = 0, 0.0
+
+    for name, fen, counts in REFERENCE_POSITIONS:
+        game = Game.from_fen(fen, movegen=movegen, attack_maps=attack_maps)
+        for d, expected in enumerate(counts[:depth], start=1):
+            start = time.perf_counter()
+            nodes = perft(game, d)
+            elapsed = time.perf_counter() - start
+            total_nodes, total_time = total_nodes + nodes, total_time + elapsed
+
+            if nodes != expected:
+                passed = False
+            if verbose or nodes != expected:
+                status = "ok" if nodes == expected else f"FAILED, expected {expected}"
+                print(f"{name:<20} depth {d}: {nodes:>9} {status}")
+
+    if verbose:
+        print(f"{total_nodes} nodes in {total_time:.2f}s ({_nps(total_nodes, total_time)} nodes/s)")
+    return passed
+
+
+def compare_backends(fen: str, depth: int, attack_maps: bool = False) -> dict[str, int]:
+    """ nodes / s of every move generation backend counting ``fen`` to ``depth``"""
+    speeds = {}
+    for movegen in MOVEGEN_BACKENDS:
+        game = Game.from_fen(fen, movegen=movegen, attack_maps=attack_maps)
+        start = time.perf_counter()
+        nodes = perft(game, depth)
+        speeds[movegen] = _nps(nodes, time.perf_counter() - start)
+    return speeds
+
+
+def _nps(nodes: int, seconds: float) -> int:
+    return int(nodes / seconds) if seconds > 0 else 0
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Count the leaf nodes of the legal move tree")
+    parser.add_argument("depth", type=int)
+    parser.add_argument("--fen", default=START_FEN, help="position to count from (start position by default)")
+    parser.add_argument("--divide", action="store_true", help="print the count of every root move")
+    parser.add_argument("--movegen", choices=MOVEGEN_BACKENDS, default="mailbox")
+    parser.add_argument("--attack-maps", action="store_true")
+    parser.add_argument("--suite", action="store_true", help="check the reference positions up to depth")
+    parser.add_argument("--compare", action="store_true", help="time every move generation backend on the position")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="split the root moves over this many processes (see parallel)")
+    args = parser.parse_args(argv)
+
+    if args.suite:
+        return 0 if run_suite(args.depth, args.movegen, args.attack_maps) else 1
+
+    if args.compare:
+        speeds = compare_backends(args.fen, args.depth, args.attack_maps)
+        for movegen, speed in speeds.items():
+            print(f"{movegen:<10} {speed:>9} nodes/s ({speed / speeds['mailbox']:.2f}x mailbox)")
+        return 0
+
+    game = Game.from_fen(args.fen, movegen=args.movegen, attack_maps=args.attack_maps)
+    start = time.perf_counter()
+    if args.workers is not None:
+        from parallel import parallel_divide
+
+        counts = parallel_divide(game, args.depth, args.workers, args.movegen)
+    elif args.divide:
+        counts = divide(game, args.depth)
+    else:
+        counts = None
+
+    if counts is None:
+        nodes = perft(game, args.depth)
+    else:
+        if args.divide:
+            for move, nodes in sorted(counts.items()):
+                print(f"{move}: {nodes}")
+        nodes = sum(counts.values())
+    elapsed = time.perf_counter() - start
+
+    print(f"Nodes: {nodes}")
+    print(f"Time: {elapsed:.2f}s ({_nps(nodes, elapsed)} nodes/s)")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
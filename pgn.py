@@ -0,0 +1,420 @@
+""" PGN reading and writing
+
+    ``read_games`` / ``read_headers`` memory-map the file and find game boundaries by scanning its bytes: a game is
+    its tag lines plus the movetext up to the next tag pair line (``[Name "value"]``) outside a ``{}`` comment. Only
+    the current game is ever copied out of the map, so memory use doesn't depend on the size of the file. Tags are
+    parsed when a game is reached, the movetext only when its moves are asked for, and ``read_headers`` (filtering by
+    player, date, result ...) never touches movetext at all.
+
+    SAN moves are resolved against the legal moves of the position they are played in (``san_to_move``), the other
+    way around ``move_to_san`` writes them.
+
+    python pgn.py games.pgn --workers 16     replay every game through Game.make_move, print the failed ones
+"""
+
+from __future__ import annotations
+
+import argparse
+import mmap
+import re
+import time
+from dataclasses import dataclass
+from typing import Callable, Iterator, Optional
+
+from board_layout import SQUARE_NAMES, SQUARES, square_index
+from default_positions import starting_fen
+from game import MOVEGEN_BACKENDS, Game, InvalidFEN, MoveStatus, Player, move_from, move_promotion, move_to
+from pieces import BISHOP_KIND, BLACK, KING_KIND, KNIGHT_KIND, PAWN_KIND, QUEEN_KIND, ROOK_KIND, WHITE
+
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+SEVEN_TAG_ROSTER = ("Event", "Site", "Date", "Round", "White", "Black", "Result")
+
+KINDS = {"N": KNIGHT_KIND, "B": BISHOP_KIND, "R": ROOK_KIND, "Q": QUEEN_KIND, "K": KING_KIND}
+LETTERS = {kind: letter for letter, kind in KINDS.items()}
+
+TAG_RE = re.compile(rb'\[\s*([A-Za-z0-9_]+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+ESCAPE_RE = re.compile(r"\\(.)")
+NON_SPACE_RE = re.compile(rb"\S")
+# comments, variation brackets, NAGs, move numbers, everything else (moves / results)
+TOKEN_RE = re.compile(r"\{[^}]*\}|;[^\n]*|[()]|\$\d+|\d+\.(?:\.\.)?|[^\s(){};$]+")
+MOVE_NUMBER_RE = re.compile(r"\d+\.+$")
+SAN_RE = re.compile(r"([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQnbrq]))?$")
+
+
+class InvalidPGN(Exception):
+    def __init__(self, pgn: str):
+        super().__init__(f"Invalid PGN received: {pgn}")
+
+
+@dataclass
+class PGNGame:
+    """ One game of a PGN file, movetext left undecoded until it is needed"""
+    headers: dict[str, str]
+    movetext: bytes
+    offset: int  # byte offset of the game in its file
+
+    def san_moves(self) -> list[str]:
+        return list(san_tokens(self.movetext.decode("utf-8", "replace")))
+
+    def replay(self, game: Optional[Game] = None, movegen: str = "mailbox") -> Game:
+        """ Plays the game's moves from its starting position (FEN tag or the start position) into ``game``"""
+        if game is None:
+            game = Game(Player(self.headers.get("White", "WHITE"), WHITE),
+                        Player(self.headers.get("Black", "BLACK"), BLACK), movegen=movegen)
+        game.board.load_from_fen(self.headers.get("FEN", starting_fen), game)
+
+        for san in self.san_moves():
+            game.push(san_to_move(game, san))
+        game._set_pieces()
+        return game
+
+
+def san_tokens(movetext: str) -> Iterator[str]:
+    """ SAN moves of the main line: comments, variations, NAGs, move numbers and the result left out"""
+    depth = 0
+    for token in TOKEN_RE.findall(movetext):
+        first = token[0]
+        if first == "(":
+            depth += 1
+        elif first == ")":
+            depth -= 1
+        elif depth or first in "{;$" or token in RESULTS or MOVE_NUMBER_RE.match(token):
+            continue
+        else:
+            yield token
+
+
+def san_to_move(game: Game, san: str, moves: Optional[list[int]] = None) -> int:
+    """ Encoded legal move of ``game`` written as ``san`` (one of ``moves`` if given)"""
+    text = san.rstrip("+#!?")
+    moves = game.legal_moves() if moves is None else moves
+    squares = game.board.squares
+
+    if text in ("O-O", "0-0", "O-O-O", "0-0-0"):
+        king_square = game.board.king_squares[0 if game.turn == WHITE else 1]
+        target = king_square + 2 if len(text) == 3 else king_square - 2
+        candidates = [move for move in moves if move_from(move) == king_square and move_to(move) == target]
+    else:
+        match = SAN_RE.match(text)
+        if match is None:
+            raise InvalidPGN(san)
+
+        letter, from_file, from_rank, target, promotion = match.groups()
+        kind = KINDS[letter] if letter else PAWN_KIND
+        target = square_index(target)
+        promotion = KINDS[promotion.upper()] if promotion else 0
+        candidates = []
+        for move in moves:
+            current_pos = move & 0x7F
+            if move >> 7 & 0x7F != target or squares[current_pos].kind != kind or move >> 14 != promotion:
+                continue
+            name = SQUARE_NAMES[current_pos]
+            if from_file and name[0] != from_file or from_rank and name[1] != from_rank:
+                continue
+            candidates.append(move)
+
+    if len(candidates) != 1:
+        raise InvalidPGN(san)
+    return candidates[0]
+
+
+def move_to_san(game: Game, move: int) -> str:
+    """ SAN of the legal move ``move`` in ``game``'s current position"""
+    squares = game.board.squares
+    current_pos, move_pos, promotion = move_from(move), move_to(move), move >> 14
+    piece = squares[current_pos]
+
+    if piece.kind == KING_KIND and abs(move_pos - current_pos) == 2:
+        san = "O-O" if move_pos > current_pos else "O-O-O"
+    elif piece.kind == PAWN_KIND:
+        san = SQUARE_NAMES[current_pos][0] + "x" if (move_pos - current_pos) & 7 else ""
+        san += SQUARE_NAMES[move_pos] + ("=" + LETTERS[promotion] if promotion else "")
+    else:
+        others = [move_from(other) for other in game.legal_moves()
+                  if move_to(other) == move_pos and move_from(other) != current_pos
+                  and squares[move_from(other)].kind == piece.kind]
+        disambiguation = ""
+        if others:
+            if all(other & 7 != current_pos & 7 for other in others):
+                disambiguation = SQUARE_NAMES[current_pos][0]
+            elif all(other >> 4 != current_pos >> 4 for other in others):
+                disambiguation = SQUARE_NAMES[current_pos][1]
+            else:
+                disambiguation = SQUARE_NAMES[current_pos]
+        capture = "x" if squares[move_pos] is not None else ""
+        san = LETTERS[piece.kind] + disambiguation + capture + SQUARE_NAMES[move_pos]
+
+    game.push(move)
+    if game.check_if_in_check():
+        san += "+" if game.legal_moves() else "#"
+    game.pop()
+    return san
+
+
+@dataclass
+class GameReport:
+    """ Outcome of replaying one game move by move through ``Game.make_move``
+
+        ``status`` is the MoveStatus of the first move that failed (INVALID_MOVE for a move that can't be read or
+        has no piece to make it), else VALID_MOVE, or KING_IN_CHECKMATE / DRAW when the game ends in mate /
+        stalemate. ``plies`` counts the moves played before it stopped, ``fen`` is the position it stopped in (the
+        FEN tag itself if that can't be loaded).
+    """
+    offset: int
+    headers: dict[str, str]
+    status: MoveStatus
+    plies: int
+    move: Optional[str]  # SAN of the failed move
+    fen: str
+
+    @property
+    def valid(self) -> bool:
+        return self.status not in (MoveStatus.INVALID_MOVE, MoveStatus.PUTS_KING_IN_CHECK)
+
+
+def validate_game(pgn_game: PGNGame, movegen: str = "mailbox") -> GameReport:
+    """ Replays ``pgn_game`` through ``Game.make_move``, stopping at the first move it rejects"""
+    headers = pgn_game.headers
+    game = Game(Player(headers.get("White", "WHITE"), WHITE), Player(headers.get("Black", "BLACK"), BLACK),
+                movegen=movegen)
+    fen = headers.get("FEN", starting_fen)
+    try:
+        game.board.load_from_fen(fen, game)
+    except InvalidFEN:
+        return GameReport(pgn_game.offset, headers, MoveStatus.INVALID_MOVE, 0, None, fen)
+
+    status = MoveStatus.VALID_MOVE
+    for plies, san in enumerate(pgn_game.san_moves()):
+        try:
+            move = san_to_move(game, san)
+        except InvalidPGN:
+            try:  # a move leaving the king in check still has a piece + target for make_move to reject
+                move = san_to_move(game, san, game.pseudo_legal_moves())
+            except InvalidPGN:
+                return GameReport(pgn_game.offset, headers, MoveStatus.INVALID_MOVE, plies, san, game.to_fen())
+
+        piece = game.board.squares[move_from(move)]
+        status = game.make_move(piece, SQUARES[move_to(move)], move_promotion(move) or QUEEN_KIND)
+        if status != MoveStatus.VALID_MOVE:
+            return GameReport(pgn_game.offset, headers, status, plies, san, game.to_fen())
+
+    if not game.legal_moves():
+        status = MoveStatus.KING_IN_CHECKMATE if game.check_if_in_check() else MoveStatus.DRAW
+    return GameReport(pgn_game.offset, headers, status, len(game._undo_stack), None, game.to_fen())
+
+
+def result_of(game: Game) -> str:
+    """ Result tag for the current position: decided if the side to move has no legal moves, * otherwise"""
+    if game.legal_moves():
+        return "*"
+    if not game.check_if_in_check():
+        return "1/2-1/2"
+    return "0-1" if game.turn == WHITE else "1-0"
+
+
+def game_to_pgn(game: Game, headers: Optional[dict[str, str]] = None) -> str:
+    """ PGN of every move pushed on ``game`` since it was set up (the position is left as it was)"""
+    moves = [entry[0] for entry in game._undo_stack]
+    for _ in moves:
+        game.pop()
+
+    root_fen = game.to_fen()
+    tags = {"Event": "?", "Site": "?", "Date": "????.??.??", "Round": "?", "White": game.players[WHITE].name,
+            "Black": game.players[BLACK].name, "Result": "*"}
+    if root_fen != starting_fen:
+        tags["SetUp"], tags["FEN"] = "1", root_fen
+
+    tokens = []
+    for index, move in enumerate(moves):
+        if game.turn == WHITE:
+            tokens.append(f"{game.fullmove_number}.")
+        elif index == 0:
+            tokens.append(f"{game.fullmove_number}...")
+        tokens.append(move_to_san(game, move))
+        game.push(move)
+
+    tags["Result"] = result_of(game)
+    tags.update(headers or {})
+    tokens.append(tags["Result"])
+
+    lines, line = [], ""
+    for token in tokens:  # movetext lines are kept under 80 characters
+        if len(line) + len(token) + 1 > 79:
+            lines.append(line)
+            line = token
+        else:
+            line = f"{line} {token}" if line else token
+    lines.append(line)
+
+    tag_lines = "\n".join(f'[{name} "{_escape(value)}"]' for name, value in tags.items())
+    return f"{tag_lines}\n\n" + "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def parse_pgn(text: str) -> PGNGame:
+    """ First game of a PGN string"""
+    data = text.encode("utf-8")
+    for start, movetext_start, end in game_spans(data):
+        return PGNGame(parse_headers(data[start:movetext_start]), data[movetext_start:end], start)
+    raise InvalidPGN(text)
+
+
+def parse_headers(tag_section: bytes) -> dict[str, str]:
+    return {name.decode("utf-8", "replace"): ESCAPE_RE.sub(r"\1", value.decode("utf-8", "replace"))
+            for name, value in TAG_RE.findall(tag_section)}
+
+
+def game_spans(data, start: int = 0, stop: Optional[int] = None) -> Iterator[tuple[int, int, int]]:
+    """ (start, movetext start, end) byte offsets of the games of ``data`` (bytes or mmap) starting in [start, stop)
+
+        ``start`` must be at the beginning of a game (or of the file).
+    """
+    size = len(data)
+    stop = size if stop is None else stop
+    position = start
+
+    while True:
+        match = NON_SPACE_RE.search(data, position)
+        if match is None or match.start() >= stop:
+            return
+        game_start = position = match.start()
+
+        # tag section: lines starting with [, blank lines between them allowed
+        while data[position:position + 1] == b"[":
+            line_end = data.find(b"\n", position)
+            position = size if line_end == -1 else line_end + 1
+            match = NON_SPACE_RE.search(data, position)
+            if match is None or data[match.start():match.start() + 1] != b"[":
+                break
+            position = match.start()
+        movetext_start = position
+
+        # movetext: up to the next tag pair line outside a {} comment (a wrapped comment can go on with "[%clk ...")
+        in_comment = False
+        while True:
+            next_tags = data.find(b"\n[", position)
+            if next_tags == -1:
+                position = size
+                break
+            in_comment = _comment_open(data, position, next_tags, in_comment)
+            position = next_tags + 1
+            if not in_comment and TAG_RE.match(data, position):
+                break
+        yield game_start, movetext_start, position
+
+
+def _comment_open(data, start: int, end: int, open_comment: bool) -> bool:
+    """ Is a {} comment open at ``end``, given whether one was at ``start``"""
+    while True:
+        brace = data.find(b"}" if open_comment else b"{", start, end)
+        if brace == -1:
+            return open_comment
+        open_comment, start = not open_comment, brace + 1
+
+
+def next_game_start(data, offset: int) -> int:
+    """ Offset of the first game starting at or after ``offset`` (``len(data)`` if there is none)
+
+        A game starts at a tag pair line whose previous non-blank line isn't one, the boundary ``game_spans`` ends a
+        game on. Comments before ``offset`` aren't tracked, so a tag pair line inside a comment would still split.
+    """
+    size = len(data)
+    if offset <= 0:
+        return 0
+
+    position = offset - 1
+    while True:
+        tags = data.find(b"\n[", position)
+        if tags == -1:
+            return size
+
+        previous = tags
+        while previous > 0 and data[previous - 1:previous] in b" \t\r\n":
+            previous -= 1
+        line_start = data.rfind(b"\n", 0, previous) + 1
+        if TAG_RE.match(data, tags + 1) and (previous == 0 or not TAG_RE.match(data, line_start)):
+            return tags + 1
+        position = tags + 1
+
+
+def shard_offsets(path: str, shard_size: int = 1 << 20) -> list[int]:
+    """ Game boundaries splitting the file at ``path`` into pieces of about ``shard_size`` bytes
+
+        Consecutive offsets are the ``start`` / ``stop`` of ``read_games`` for one shard, the last one is the file
+        size.
+    """
+    data = _open(path)
+    if data is None:
+        return [0]
+    with data:
+        offsets = [0]
+        while offsets[-1] < len(data):
+            offsets.append(next_game_start(data, offsets[-1] + shard_size))
+        return offsets
+
+
+def _open(path: str) -> Optional[mmap.mmap]:
+    with open(path, "rb") as file:
+        if file.seek(0, 2) == 0:  # empty files can't be mapped
+            return None
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def read_games(path: str, where: Optional[Callable[[dict[str, str]], bool]] = None, start: int = 0,
+               stop: Optional[int] = None) -> Iterator[PGNGame]:
+    """ Games of the PGN file at ``path``, optionally only those whose headers pass ``where``
+
+        ``start`` / ``stop`` restrict it to the games starting in that byte range (``start`` on a game boundary).
+    """
+    data = _open(path)
+    if data is None:
+        return
+    with data:
+        for game_start, movetext_start, end in game_spans(data, start, stop):
+            headers = parse_headers(data[game_start:movetext_start])
+            if where is None or where(headers):
+                yield PGNGame(headers, data[movetext_start:end], game_start)
+
+
+def read_headers(path: str, start: int = 0, stop: Optional[int] = None) -> Iterator[dict[str, str]]:
+    """ Tag pairs of every game, movetext is skipped without being decoded"""
+    data = _open(path)
+    if data is None:
+        return
+    with data:
+        for game_start, movetext_start, _ in game_spans(data, start, stop):
+            yield parse_headers(data[game_start:movetext_start])
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Check that every move of every game of a PGN file is legal")
+    parser.add_argument("path")
+    parser.add_argument("--workers", type=int, default=None, help="processes replaying the games (all CPUs by default)")
+    parser.add_argument("--movegen", choices=MOVEGEN_BACKENDS, default="mailbox")
+    parser.add_argument("--fens", action="store_true", help="also print the final position of every valid game")
+    args = parser.parse_args(argv)
+
+    from parallel import parallel_validate
+
+    games = failed = 0
+    start = time.perf_counter()
+    for report in parallel_validate(args.path, args.workers, args.movegen):
+        games += 1
+        players = f"{report.headers.get('White', '?')} - {report.headers.get('Black', '?')}"
+        if not report.valid:
+            failed += 1
+            print(f"{report.offset}: {players}, ply {report.plies + 1} {report.move}: {report.status.name} "
+                  f"({report.fen})")
+        elif args.fens:
+            print(f"{report.offset}: {players}, {report.fen}")
+    elapsed = time.perf_counter() - start
+
+    print(f"{games} games, {failed} failed in {elapsed:.2f}s")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
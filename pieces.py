@@ -3,6 +3,8 @@ from __future__ import annotations
 from dataclasses import dataclass
 from typing import Literal, Union, Optional
 
+from board_layout import ALL_RAYS, DIAGONAL_RAYS, SQUARES, STRAIGHT_RAYS, Square
+
 
 # Consts
 WHITE, BLACK = "WHITE", "BLACK"
@@ -10,6 +12,10 @@ WHITE, BLACK = "WHITE", "BLACK"
 # Typing
 Colour = Literal["WHITE", "BLACK"]
 
+# Piece kinds (index into per-piece tables, black pieces are offset by 6)
+PAWN_KIND, KNIGHT_KIND, BISHOP_KIND, ROOK_KIND, QUEEN_KIND, KING_KIND = range(6)
+COLOUR_INDEX = {WHITE: 0, BLACK: 1}
+
 
 @dataclass
 class BoardCoordinates:
@@ -132,13 +138,23 @@ class InvalidPosition(Exception):
 
 
 class Piece:
-    pos: BoardCoordinates
     colour: Colour
     move_atlas: list[BoardCoordinates]
+    ray_group: int  # sliders only, index into Square.rays
     can_make_long_move: bool
+    kind: int
+    code: int  # kind + 6 * COLOUR_INDEX[colour]
+    square: Optional[int]  # 0x88 index, kept up to date by the board
 
     def __init__(self):
-        self.pos = BoardCoordinates(-1, -1)  # init with invalid pos
+        self.code = self.kind + 6 * COLOUR_INDEX[self.colour]
+        self.square = None  # init with invalid pos
+
+    @property
+    def pos(self) -> Union[Square, BoardCoordinates]:
+        if self.square is None:
+            return BoardCoordinates(-1, -1)
+        return SQUARES[self.square]
 
 
 class Pawn(Piece):
@@ -146,6 +162,7 @@ class Pawn(Piece):
                   BoardCoordinates(0, 2),
                   BoardCoordinates(1, 1),
                   BoardCoordinates(-1, 1)]
+    kind = PAWN_KIND
     can_make_long_move = False
     has_moved = False
     atlas_was_flipped = False
@@ -161,6 +178,8 @@ class Pawn(Piece):
                 temp.append(move)
             self.move_atlas = temp
 
+        self.push_offset = 16 if self.colour == WHITE else -16  # 0x88 offset of a single push
+
     def __str__(self):
         return 'P' if self.colour == WHITE else 'p'
 
@@ -170,6 +189,8 @@ class Rook(Piece):
                   BoardCoordinates(0, -1),
                   BoardCoordinates(1, 0),
                   BoardCoordinates(-1, 0)]
+    kind = ROOK_KIND
+    ray_group = STRAIGHT_RAYS
     can_make_long_move = True
     has_moved = False
 
@@ -190,6 +211,7 @@ class Knight(Piece):
                   BoardCoordinates(1, -2),
                   BoardCoordinates(-1, 2),
                   BoardCoordinates(-1, -2)]
+    kind = KNIGHT_KIND
     can_make_long_move = False
 
     def __init__(self, colour: Colour):
@@ -205,7 +227,8 @@ class Bishop(Piece):
                   BoardCoordinates(-1, 1),
                   BoardCoordinates(-1, -1),
                   BoardCoordinates(1, -1)]
-
+    kind = BISHOP_KIND
+    ray_group = DIAGONAL_RAYS
     can_make_long_move = True
 
     def __init__(self, colour: Colour):
@@ -225,7 +248,8 @@ class Queen(Piece):
                   BoardCoordinates(1, -1),
                   BoardCoordinates(-1, 1),
                   BoardCoordinates(-1, -1)]
-
+    kind = QUEEN_KIND
+    ray_group = ALL_RAYS
     can_make_long_move = True
 
     def __init__(self, colour: Colour):
@@ -245,7 +269,7 @@ class King(Piece):
                   BoardCoordinates(1, -1),
                   BoardCoordinates(-1, 1),
                   BoardCoordinates(-1, -1)]
-
+    kind = KING_KIND
     can_make_long_move = False
     has_moved = False
 
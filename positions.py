@@ -0,0 +1,195 @@
+""" Fixed-width binary positions and position files
+
+    A position record is 32 bytes, little endian:
+        8 bytes   occupancy bitboard (a1 = bit 0, as in ``bitboard``)
+       16 bytes   piece codes (``Piece.code``, 4 bits each) of the occupied squares, lowest bit first, low nibble
+                  first, so at most 32 pieces
+        1 byte    side to move (bit 0, set for black) + castling rights (bits 1 - 4, ``game`` bit flags)
+        1 byte    en passant file (0 - 7, NO_EN_PASSANT for none), the rank follows from the side to move
+        2 bytes   halfmove clock
+        2 bytes   fullmove number
+        2 bytes   padding
+
+    A position file is a 32 byte header (MAGIC, format version) followed by records, nothing else, so the Nth
+    position is at ``HEADER_SIZE + N * RECORD_SIZE`` and ``PositionFile`` reads it straight out of a memory map
+    without parsing anything before it. ``PositionFile.array`` views the records as a NumPy structured array
+    (``POSITION_FIELDS``) over the same map, no copy is made.
+
+    python positions.py positions.fen positions.bin       convert a file of FEN records, one per line
+"""
+
+from __future__ import annotations
+
+import argparse
+import mmap
+import struct
+import time
+from typing import Iterable, Iterator, Optional, Union
+
+from bitboard import bits_to_squares
+from game import FEN_CODES, FEN_PIECES, Game, Player, iter_fens
+from pieces import BLACK, KING_KIND, WHITE
+
+RECORD = struct.Struct("<Q16sBBHH2x")
+RECORD_SIZE = RECORD.size  # 32
+HEADER = struct.Struct("<8sI20x")
+HEADER_SIZE = HEADER.size  # 32
+MAGIC = b"CHESSPOS"
+VERSION = 1
+NO_EN_PASSANT = 8
+
+# numpy.dtype spec of a record, field names match the layout above
+POSITION_FIELDS = [("occupancy", "<u8"), ("pieces", "u1", (16,)), ("flags", "u1"), ("en_passant", "u1"),
+                   ("halfmove_clock", "<u2"), ("fullmove_number", "<u2"), ("padding", "V2")]
+
+CODE_PIECES = {FEN_CODES[char]: piece for char, piece in FEN_PIECES.items()}  # code -> (piece class, colour)
+
+
+class InvalidRecord(Exception):
+    def __init__(self, record: bytes):
+        super().__init__(f"Invalid position record received: {bytes(record).hex()}")
+
+
+def pack_position(game: Game) -> bytes:
+    """ 32 byte record of ``game``'s current position"""
+    board = game.board
+    squares = board.squares
+    occupancy = board.occupancy[0] | board.occupancy[1]
+
+    codes, shift = 0, 0
+    for index in bits_to_squares(occupancy):
+        codes |= squares[index].code << shift
+        shift += 4
+    if shift > 128:
+        raise ValueError("a position record holds at most 32 pieces")
+
+    flags = (game.turn == BLACK) | game.castling_rights << 1
+    en_passant = NO_EN_PASSANT if game.en_passant_target is None else game.en_passant_target & 7
+    return RECORD.pack(occupancy, codes.to_bytes(16, "little"), flags, en_passant, game.halfmove_clock,
+                       game.fullmove_number)
+
+
+def unpack_position(record: Union[bytes, memoryview], game: Game) -> None:
+    """ Sets up the position of ``record`` on ``game`` (board, side to move, castling rights, en passant, clocks)
+
+        Piece objects already on the board are reused and castling rights without their king and rook at home are
+        dropped, like ``Board.load_from_fen`` does.
+    """
+    occupancy, pieces, flags, en_passant, halfmove_clock, fullmove_number = RECORD.unpack(record)
+    board = game.board
+    codes = int.from_bytes(pieces, "little")
+
+    spare_pieces = board._clear()
+    put = board._put
+    for index in bits_to_squares(occupancy):
+        code = codes & 0xF
+        codes >>= 4
+        if code not in CODE_PIECES:
+            raise InvalidRecord(record)
+        if spare_pieces[code]:
+            piece = spare_pieces[code].pop()
+            if getattr(piece, "has_moved", False):
+                piece.has_moved = False
+        else:
+            piece_type, colour = CODE_PIECES[code]
+            piece = piece_type(colour)
+        put(index, piece)
+
+    if board.bitboards[KING_KIND].bit_count() != 1 or board.bitboards[KING_KIND + 6].bit_count() != 1 or \
+            en_passant > NO_EN_PASSANT:
+        raise InvalidRecord(record)
+
+    game.turn = BLACK if flags & 1 else WHITE
+    game.castling_rights = board.castling_rights_in_place(flags >> 1 & 0xF)
+    if en_passant == NO_EN_PASSANT:
+        game.en_passant_target = None
+    else:
+        game.en_passant_target = (0x20 if flags & 1 else 0x50) + en_passant
+    game.halfmove_clock, game.fullmove_number = halfmove_clock, fullmove_number
+    game._reset_state()
+
+
+def write_positions(path: str, positions: Iterable[Union[Game, bytes]]) -> int:
+    """ Writes a position file of ``positions`` (games are packed as they come), returns the number written"""
+    count = 0
+    with open(path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION))
+        for position in positions:
+            file.write(position if isinstance(position, bytes) else pack_position(position))
+            count += 1
+    return count
+
+
+class PositionFile:
+    """ Read-only memory map of a position file, indexed like a list of records
+
+        ``file[n]`` is the record of the Nth position (bytes), ``load(n, game)`` sets it up on a game and ``array()``
+        is the NumPy view of every record. Use it as a context manager or ``close`` it, after dropping any array
+        taken from it (the map can't be closed while a view of it is alive).
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self._map) < HEADER_SIZE or (len(self._map) - HEADER_SIZE) % RECORD_SIZE:
+            self._map.close()
+            raise ValueError(f"{path} is not a position file")
+        magic, version = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION:
+            self._map.close()
+            raise ValueError(f"{path} is not a version {VERSION} position file")
+        self._count = (len(self._map) - HEADER_SIZE) // RECORD_SIZE
+
+    def __enter__(self) -> PositionFile:
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._map.close()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, n: int) -> bytes:
+        if n < 0:
+            n += self._count
+        if not 0 <= n < self._count:
+            raise IndexError("position index out of range")
+        offset = HEADER_SIZE + n * RECORD_SIZE
+        return self._map[offset:offset + RECORD_SIZE]
+
+    def __iter__(self) -> Iterator[bytes]:
+        for n in range(self._count):
+            yield self[n]
+
+    def load(self, n: int, game: Optional[Game] = None) -> Game:
+        """ Game set up in the Nth position (``game`` itself if given)"""
+        if game is None:
+            game = Game(Player("WHITE", WHITE), Player("BLACK", BLACK))
+        unpack_position(self[n], game)
+        return game
+
+    def array(self):
+        """ Structured NumPy array (``POSITION_FIELDS``) viewing the records in the map (needs NumPy)"""
+        import numpy as np
+
+        return np.frombuffer(self._map, dtype=np.dtype(POSITION_FIELDS), count=self._count, offset=HEADER_SIZE)
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Convert a file of FEN records to a position file")
+    parser.add_argument("fen_path")
+    parser.add_argument("path")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    count = write_positions(args.path, iter_fens(args.fen_path))
+    print(f"{count} positions in {time.perf_counter() - start:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,280 @@
+""" asyncio game server
+
+    Hosts any number of ``Game`` sessions in one event loop, clients talk JSON lines over TCP or a Unix socket: one
+    request object per line, one response object per line, in request order. Every response has ``ok``, failed
+    requests an ``error``, and an ``id`` given in the request is sent back.
+
+        {"cmd": "new", "white": "Alice", "black": "Bob", "fen": "<optional>"}  -> game, fen
+        {"cmd": "move", "game": 1, "move": "e2e4"}      -> status (MoveStatus name), fen, result; made with make_move
+        {"cmd": "moves", "game": 1}                     -> moves (legal, e7e8q style)
+        {"cmd": "engine", "game": 1, "depth": 3, "time": 1.0, "play": true}  -> move, score, depth, nodes, pv, fen
+        {"cmd": "fen", "game": 1} / {"cmd": "pgn", "game": 1} / {"cmd": "close", "game": 1} / {"cmd": "stats"}
+
+    Moves are validated on the loop, they take well under a millisecond. Engine searches go to a process pool as FEN
+    records (see parallel), so the loop keeps serving every other game while they run; a reply whose game moved on in
+    the meantime is returned but not played.
+
+    python server.py --port 8765 --workers 4
+    python server.py --port 8765 --load 500           load client: 500 concurrent games, moves / s and latencies
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Optional
+
+from board_layout import SQUARES, square_index
+from engine import Engine
+from game import Game, InvalidFEN, MoveStatus, Player, move_from, move_notation, move_promotion, move_to
+from movecache import MoveCache
+from pgn import result_of
+from pieces import BISHOP_KIND, BLACK, KNIGHT_KIND, QUEEN_KIND, ROOK_KIND, WHITE
+
+PROMOTIONS = {"n": KNIGHT_KIND, "b": BISHOP_KIND, "r": ROOK_KIND, "q": QUEEN_KIND}
+MAX_DEPTH = 8
+
+
+class RequestError(Exception):
+    """ Request the server can't act on, sent back as the response's error"""
+
+
+def _engine_worker(fen: str, depth: int, time_limit: Optional[float]) -> tuple[Optional[int], int, int, int, list[int]]:
+    """ (best move, score, depth, nodes, principal variation) of a search of ``fen``"""
+    result = Engine(Game.from_fen(fen)).search(depth, time_limit)
+    return result.move, result.score, result.depth, result.nodes, result.pv
+
+
+class GameServer:
+    def __init__(self, workers: Optional[int] = None, move_cache: Optional[MoveCache] = None):
+        self.games: dict[int, Game] = {}
+        self.move_cache = move_cache
+        self.requests = 0
+        self._next_id = 1
+        self._executor = ProcessPoolExecutor(max_workers=workers or os.cpu_count())
+        self._commands = {"new": self._new, "move": self._move, "moves": self._moves, "engine": self._engine,
+                          "fen": self._fen, "pgn": self._pgn, "close": self._close, "stats": self._stats}
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(cancel_futures=True)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while line := await reader.readline():
+                response = await self.handle_line(line)
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def handle_line(self, line: bytes) -> dict[str, Any]:
+        self.requests += 1
+        request = {}
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                request = {}
+                raise RequestError("a request must be a JSON object")
+            command = self._commands.get(request.get("cmd"))
+            if command is None:
+                raise RequestError(f"unknown command: {request.get('cmd')}")
+            response = await command(request)
+        except (RequestError, InvalidFEN) as error:
+            response = {"ok": False, "error": str(error)}
+        except (ValueError, TypeError) as error:  # not JSON, wrong field types
+            response = {"ok": False, "error": f"invalid request: {error}"}
+        except Exception as error:  # one bad request must not take the connection (and every later one) down
+            response = {"ok": False, "error": f"{type(error).__name__}: {error}"}
+
+        if "id" in request:
+            response["id"] = request["id"]
+        return response
+
+    def _game(self, request: dict[str, Any]) -> Game:
+        game = self.games.get(request.get("game"))
+        if game is None:
+            raise RequestError(f"no game {request.get('game')}")
+        return game
+
+    async def _new(self, request: dict[str, Any]) -> dict[str, Any]:
+        game = Game(Player(str(request.get("white", "WHITE")), WHITE),
+                    Player(str(request.get("black", "BLACK")), BLACK), move_cache=self.move_cache)
+        if "fen" in request:
+            game.board.load_from_fen(str(request["fen"]), game)
+        game_id, self._next_id = self._next_id, self._next_id + 1
+        self.games[game_id] = game
+        return {"ok": True, "game": game_id, "fen": game.to_fen()}
+
+    async def _move(self, request: dict[str, Any]) -> dict[str, Any]:
+        game = self._game(request)
+        text = str(request.get("move", ""))
+        current_pos, move_pos = square_index(text[:2]), square_index(text[2:4])
+        if current_pos is None or move_pos is None or len(text) > 5 or len(text) == 5 and text[4] not in PROMOTIONS:
+            raise RequestError(f"invalid move: {text}")
+
+        piece = game.board.squares[current_pos]
+        if piece is None or piece.colour != game.turn:
+            status = MoveStatus.INVALID_MOVE
+        else:
+            status = game.make_move(piece, SQUARES[move_pos], PROMOTIONS[text[4]] if len(text) == 5 else QUEEN_KIND)
+        return {"ok": status == MoveStatus.VALID_MOVE, "status": status.name, "fen": game.to_fen(),
+                "result": result_of(game)}
+
+    async def _moves(self, request: dict[str, Any]) -> dict[str, Any]:
+        return {"ok": True, "moves": [move_notation(move) for move in self._game(request).legal_moves()]}
+
+    async def _engine(self, request: dict[str, Any]) -> dict[str, Any]:
+        game = self._game(request)
+        depth = max(1, min(int(request.get("depth", 3)), MAX_DEPTH))
+        time_limit = float(request["time"]) if "time" in request else None
+        fen = game.to_fen()
+
+        loop = asyncio.get_running_loop()
+        move, score, depth, nodes, pv = await loop.run_in_executor(self._executor, _engine_worker, fen, depth,
+                                                                   time_limit)
+        response = {"ok": True, "move": move_notation(move) if move is not None else None, "score": score,
+                    "depth": depth, "nodes": nodes, "pv": [move_notation(pv_move) for pv_move in pv]}
+
+        if request.get("play") and move is not None:
+            if self.games.get(request.get("game")) is not game or game.to_fen() != fen:
+                response.update(ok=False, error="the game moved on during the search", fen=game.to_fen())
+                return response
+            game.make_move(game.board.squares[move_from(move)], SQUARES[move_to(move)],
+                           move_promotion(move) or QUEEN_KIND)
+            response["result"] = result_of(game)
+        response["fen"] = game.to_fen()
+        return response
+
+    async def _fen(self, request: dict[str, Any]) -> dict[str, Any]:
+        return {"ok": True, "fen": self._game(request).to_fen()}
+
+    async def _pgn(self, request: dict[str, Any]) -> dict[str, Any]:
+        game = self._game(request)
+        return {"ok": True, "pgn": game.board.to_pgn(game)}
+
+    async def _close(self, request: dict[str, Any]) -> dict[str, Any]:
+        self._game(request)
+        del self.games[request["game"]]
+        return {"ok": True}
+
+    async def _stats(self, request: dict[str, Any]) -> dict[str, Any]:
+        stats = {"ok": True, "games": len(self.games), "requests": self.requests}
+        if self.move_cache is not None:
+            stats["move_cache"] = self.move_cache.stats()
+        return stats
+
+
+async def serve(host: str = "127.0.0.1", port: int = 8765, path: Optional[str] = None, workers: Optional[int] = None,
+                move_cache: Optional[MoveCache] = None) -> None:
+    """ Runs a GameServer on a TCP port (or the Unix socket ``path``) until cancelled"""
+    game_server = GameServer(workers, move_cache)
+    if path is not None:
+        server = await asyncio.start_unix_server(game_server.handle_connection, path)
+    else:
+        server = await asyncio.start_server(game_server.handle_connection, host, port)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        game_server.shutdown()
+
+
+async def _load_client(connect, games: int, moves_per_game: int, engine_every: int, latencies: list[float],
+                       rng: random.Random) -> int:
+    """ Plays ``games`` games of random moves one after the other, returns the number of moves made"""
+    reader, writer = await connect()
+
+    async def call(request: dict[str, Any]) -> dict[str, Any]:
+        writer.write(json.dumps(request).encode() + b"\n")
+        await writer.drain()
+        response = json.loads(await reader.readline())
+        if "error" in response:
+            raise RequestError(response["error"])
+        return response
+
+    moves_made = 0
+    try:
+        for _ in range(games):
+            game_id = (await call({"cmd": "new"}))["game"]
+            for ply in range(moves_per_game):
+                moves = (await call({"cmd": "moves", "game": game_id}))["moves"]
+                if not moves:
+                    break
+
+                start = time.perf_counter()
+                if engine_every and ply % engine_every == engine_every - 1:
+                    response = await call({"cmd": "engine", "game": game_id, "depth": 2, "play": True})
+                else:
+                    response = await call({"cmd": "move", "game": game_id, "move": rng.choice(moves)})
+                latencies.append(time.perf_counter() - start)
+                moves_made += 1
+                if response.get("result", "*") != "*":
+                    break
+            await call({"cmd": "close", "game": game_id})
+    finally:
+        writer.close()
+    return moves_made
+
+
+async def run_load(host: str = "127.0.0.1", port: int = 8765, path: Optional[str] = None, clients: int = 100,
+                   games: int = 1, moves_per_game: int = 60, engine_every: int = 0, seed: int = 0) -> dict[str, float]:
+    """ ``clients`` connections playing random games at once, returns moves / s and move latencies in ms"""
+    if path is not None:
+        def connect():
+            return asyncio.open_unix_connection(path, limit=1 << 20)
+    else:
+        def connect():
+            return asyncio.open_connection(host, port, limit=1 << 20)
+
+    latencies = []
+    start = time.perf_counter()
+    moves = await asyncio.gather(*(_load_client(connect, games, moves_per_game, engine_every, latencies,
+                                                random.Random(seed + client)) for client in range(clients)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    total = sum(moves)
+    return {"moves": total, "seconds": elapsed, "moves_per_second": total / elapsed if elapsed > 0 else 0.0,
+            "p50_ms": 1000 * latencies[len(latencies) // 2] if latencies else 0.0,
+            "p99_ms": 1000 * latencies[int(0.99 * (len(latencies) - 1))] if latencies else 0.0}
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Serve games over JSON lines, or load test a running server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", default=None, metavar="PATH", help="Unix socket instead of TCP")
+    parser.add_argument("--workers", type=int, default=None, help="engine processes (all CPUs by default)")
+    parser.add_argument("--move-cache", type=int, default=100_000,
+                        help="positions in the legal move cache shared by all games, 0 to turn it off")
+    parser.add_argument("--load", type=int, default=None, metavar="CLIENTS",
+                        help="run the load client with this many concurrent games instead of serving")
+    parser.add_argument("--games", type=int, default=1, help="load client: games per client")
+    parser.add_argument("--moves", type=int, default=60, help="load client: moves per game at most")
+    parser.add_argument("--engine-every", type=int, default=0, help="load client: every Nth move is an engine reply")
+    args = parser.parse_args(argv)
+
+    if args.load is not None:
+        stats = asyncio.run(run_load(args.host, args.port, args.unix, args.load, args.games, args.moves,
+                                     args.engine_every))
+        print(f"{stats['moves']} moves in {stats['seconds']:.2f}s ({stats['moves_per_second']:.0f} moves/s), "
+              f"latency p50 {stats['p50_ms']:.2f}ms p99 {stats['p99_ms']:.2f}ms")
+        return 0
+
+    move_cache = MoveCache(args.move_cache) if args.move_cache else None
+    try:
+        asyncio.run(serve(args.host, args.port, args.unix, args.workers, move_cache))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
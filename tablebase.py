@@ -0,0 +1,555 @@
+""" Endgame tablebases: retrograde generation and probing
+
+    A table holds every position of one material signature ("KQvK", "KPvK", "KBNvK", ...), the side with more
+    material always white in the name. Positions are indexed by the squares of the pieces in a fixed order (white
+    king, black king, other white pieces, other black pieces, strongest first) and the side to move:
+
+        index = ((white king slot * 64 + black king) * 64 + piece 3 ...) * 2 + side to move
+
+    Symmetry keeps the white king in a slot: the a1-d1-d4 triangle (10 squares, any of the 8 board symmetries
+    applies) or, with pawns on the board, files a-d (32 squares, left-right mirror only). A position stands for its
+    whole symmetry class through the smallest index of the class; the other indexes of the class, like impossible
+    positions, hold INVALID.
+
+    One byte per position, from the side to move's point of view:
+        0         draw
+        1 + d     mate in d plies: d even, the side to move gets mated (1 = checkmated now), d odd, it mates
+        INVALID   not a position of the table
+
+    Generation (``generate``) is retrograde: every position's legal moves are counted once, then results spread
+    backwards from the checkmates one ply at a time by un-making moves. A predecessor of a lost position is won, a
+    predecessor is lost once all of its moves lead to won positions. Captures and promotions leave the table, their
+    results come from the smaller tables, which are generated first. Both passes are spread over a process pool.
+    Castling rights, en passant and the 50 move rule are left out, ``probe`` returns None for a position with
+    castling rights or an en passant capture on the board.
+
+    A table file is a 16 byte header (MAGIC, format version, number of entries) followed by the entries, ``Tablebase``
+    memory-maps it so a probe is an index computation and one byte read.
+
+    python tablebase.py KQvK KRvK KPvK --dir tables
+    python tablebase.py --dir tables --probe "8/8/8/4k3/8/8/8/KQ6 w - - 0 1"
+
+    Generation runs at roughly 20k positions per second per process: seconds for a 3 piece table, minutes for a 4
+    piece one (KBNvK, 5M entries, about 5 minutes on one core). 5 piece tables fit the format but take hours.
+"""
+
+from __future__ import annotations
+
+import argparse
+import mmap
+import os
+import struct
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+from bitboard import PAWN_ATTACKS, TO_64, bits_to_squares, piece_attacks
+from game import Game
+from pieces import BISHOP_KIND, KING_KIND, KNIGHT_KIND, PAWN_KIND, QUEEN_KIND, ROOK_KIND, WHITE
+
+HEADER = struct.Struct("<8sII")
+HEADER_SIZE = HEADER.size  # 16
+MAGIC = b"CHESSTB\0"
+VERSION = 1
+
+DRAW, INVALID = 0, 255
+MAX_PLIES = INVALID - 2  # longest mate a byte holds: 1 + MAX_PLIES is the last value below INVALID
+
+LETTERS = {QUEEN_KIND: "Q", ROOK_KIND: "R", BISHOP_KIND: "B", KNIGHT_KIND: "N", PAWN_KIND: "P"}
+KINDS = {letter: kind for kind, letter in LETTERS.items()}
+PROMOTIONS = (QUEEN_KIND, ROOK_KIND, BISHOP_KIND, KNIGHT_KIND)
+# nobody can ever be mated: no table needed, every position is a draw
+DRAWN_SIGNATURES = {"KvK", "KBvK", "KNvK"}
+
+# the 8 symmetries of the board as square -> square tables (a1 = 0), identity first, then the left-right mirror
+_transforms = []
+for _flip_file in (False, True):
+    for _flip_rank in (False, True):
+        for _swap in (False, True):
+            _table = []
+            for _sq in range(64):
+                _file, _rank = _sq & 7, _sq >> 3
+                _file, _rank = (7 - _file if _flip_file else _file), (7 - _rank if _flip_rank else _rank)
+                _table.append(_file * 8 + _rank if _swap else _rank * 8 + _file)
+            _transforms.append(_table)
+TRANSFORMS = [_transforms[0], _transforms[4]] + _transforms[1:4] + _transforms[5:]
+
+TRIANGLE = [0, 1, 2, 3, 9, 10, 11, 18, 19, 27]  # a1 b1 c1 d1 b2 c2 d2 c3 d3 d4
+HALF_BOARD = [rank * 8 + file for rank in range(8) for file in range(4)]
+
+
+def _side_strength(kinds: list[int]) -> tuple[int, ...]:
+    return tuple(sorted(kinds, reverse=True))
+
+
+def _name(white_kinds: list[int], black_kinds: list[int]) -> str:
+    return ("K" + "".join(LETTERS[kind] for kind in sorted(white_kinds, reverse=True)) + "vK"
+            + "".join(LETTERS[kind] for kind in sorted(black_kinds, reverse=True)))
+
+
+class Signature:
+    """ Material of a table: its piece order, index layout and symmetries"""
+
+    def __init__(self, name: str):
+        white, _, black = name.upper().partition("V")
+        if not white.startswith("K") or not black.startswith("K") or \
+                any(letter not in KINDS for letter in white[1:] + black[1:]):
+            raise ValueError(f"Invalid material signature: {name}")
+
+        white_kinds, black_kinds = [KINDS[letter] for letter in white[1:]], [KINDS[letter] for letter in black[1:]]
+        if _side_strength(black_kinds) > _side_strength(white_kinds):
+            white_kinds, black_kinds = black_kinds, white_kinds
+        self.name = _name(white_kinds, black_kinds)
+
+        # piece codes in table order
+        self.codes = tuple([KING_KIND, KING_KIND + 6] + sorted(white_kinds, reverse=True)
+                           + [kind + 6 for kind in sorted(black_kinds, reverse=True)])
+        # runs of identical pieces, their squares are sorted so swapping them gives the same index
+        self.groups = []
+        start = 2
+        for end in range(3, len(self.codes) + 1):
+            if end == len(self.codes) or self.codes[end] != self.codes[start]:
+                if end - start > 1:
+                    self.groups.append((start, end))
+                start = end
+
+        self.has_pawns = PAWN_KIND in self.codes or PAWN_KIND + 6 in self.codes
+        self.slot_squares = HALF_BOARD if self.has_pawns else TRIANGLE
+        self.slots = {square: slot for slot, square in enumerate(self.slot_squares)}
+        transforms = TRANSFORMS[:2] if self.has_pawns else TRANSFORMS
+        # white king square -> symmetries taking it into a slot
+        self.king_transforms = [[table for table in transforms if table[square] in self.slots] for square in range(64)]
+
+        self.slot_size = 2 * 64 ** (len(self.codes) - 1)
+        self.size = len(self.slot_squares) * self.slot_size
+
+    def index(self, squares: list[int], turn: int) -> int:
+        """ Smallest index of the symmetry class of the position (squares in table order, ``turn`` 0 = white)"""
+        best = None
+        for table in self.king_transforms[squares[0]]:
+            mapped = [table[square] for square in squares]
+            for start, end in self.groups:
+                mapped[start:end] = sorted(mapped[start:end])
+            index = self.slots[mapped[0]]
+            for square in mapped[1:]:
+                index = index * 64 + square
+            index = index * 2 + turn
+            if best is None or index < best:
+                best = index
+        return best
+
+    def decode(self, index: int) -> tuple[list[int], int]:
+        """ (squares, turn) of an index"""
+        turn = index & 1
+        index >>= 1
+        squares = []
+        for _ in range(len(self.codes) - 1):
+            squares.append(index & 63)
+            index >>= 6
+        squares.append(self.slot_squares[index])
+        squares.reverse()
+        return squares, turn
+
+    def children(self) -> set[str]:
+        """ Signatures a capture or a promotion leads to"""
+        children = set()
+        for position, code in enumerate(self.codes[2:], start=2):
+            rest = self.codes[:position] + self.codes[position + 1:]
+            children.add(_signature_of(rest))
+            if code % 6 == PAWN_KIND:
+                for kind in PROMOTIONS:
+                    children.add(_signature_of(self.codes[:position] + (kind + code - code % 6,)
+                                               + self.codes[position + 1:]))
+        return children
+
+
+def _signature_of(codes) -> str:
+    return Signature(_name([code for code in codes if code < 6 and code != KING_KIND],
+                           [code - 6 for code in codes if code >= 6 and code != KING_KIND + 6])).name
+
+
+def _normalize(codes, squares: list[int], turn: int) -> tuple[str, list[int], int]:
+    """ (signature, squares in the table's piece order, turn), colours swapped if black has more material"""
+    white_kinds = [code for code in codes if code < 6 and code != KING_KIND]
+    black_kinds = [code - 6 for code in codes if code >= 6 and code != KING_KIND + 6]
+    if _side_strength(black_kinds) > _side_strength(white_kinds):
+        codes = [(code + 6) % 12 for code in codes]
+        squares = [square ^ 56 for square in squares]
+        turn ^= 1
+        white_kinds, black_kinds = black_kinds, white_kinds
+
+    # table order: white king, black king, white pieces then black pieces, strongest first
+    order = sorted(range(len(codes)), key=lambda position: (codes[position] != KING_KIND,
+                                                            codes[position] != KING_KIND + 6, codes[position] >= 6,
+                                                            -(codes[position] % 6)))
+    return _name(white_kinds, black_kinds), [squares[position] for position in order], turn
+
+
+def _in_check(codes, squares: list[int], colour: int, occupied: int) -> bool:
+    king_bit = 1 << squares[codes.index(KING_KIND + 6 * colour)]
+    for code, square in zip(codes, squares):
+        if (code >= 6) == colour:
+            continue
+        kind = code % 6
+        attacks = PAWN_ATTACKS[colour ^ 1][square] if kind == PAWN_KIND else piece_attacks(kind, colour ^ 1, square,
+                                                                                            occupied)
+        if attacks & king_bit:
+            return True
+    return False
+
+
+def _is_valid(codes, squares: list[int], turn: int) -> bool:
+    occupied = 0
+    for code, square in zip(codes, squares):
+        if code % 6 == PAWN_KIND and square >> 3 in (0, 7):
+            return False
+        occupied |= 1 << square
+    return occupied.bit_count() == len(squares) and not _in_check(codes, squares, turn ^ 1, occupied)
+
+
+def _moves(codes, squares: list[int], turn: int) -> Iterator[tuple[tuple[int, ...], list[int]]]:
+    """ (codes, squares) after every legal move, codes is ``codes`` itself unless something was captured / promoted"""
+    occupied = own = 0
+    for code, square in zip(codes, squares):
+        occupied |= 1 << square
+        if (code >= 6) == turn:
+            own |= 1 << square
+
+    for position, (code, square) in enumerate(zip(codes, squares)):
+        if (code >= 6) != turn:
+            continue
+        kind = code % 6
+        if kind == PAWN_KIND:
+            step = -8 if turn else 8
+            targets = PAWN_ATTACKS[turn][square] & occupied & ~own
+            if not occupied & (1 << (square + step)):
+                targets |= 1 << (square + step)
+                if square >> 3 == (6 if turn else 1) and not occupied & (1 << (square + 2 * step)):
+                    targets |= 1 << (square + 2 * step)
+        else:
+            targets = piece_attacks(kind, turn, square, occupied) & ~own
+
+        while targets:
+            bit = targets & -targets
+            targets ^= bit
+            target = bit.bit_length() - 1
+
+            new_codes, new_squares = codes, list(squares)
+            new_squares[position] = target
+            if bit & occupied:
+                captured = squares.index(target)
+                new_codes = codes[:captured] + codes[captured + 1:]
+                del new_squares[captured]
+            if _in_check(new_codes, new_squares, turn, (occupied | bit) & ~(1 << square)):
+                continue
+
+            if kind == PAWN_KIND and target >> 3 in (0, 7):
+                moved = new_squares.index(target)
+                for promotion in PROMOTIONS:
+                    yield new_codes[:moved] + (promotion + 6 * turn,) + new_codes[moved + 1:], new_squares
+            else:
+                yield new_codes, new_squares
+
+
+def _unmoves(codes, squares: list[int], turn: int) -> Iterator[list[int]]:
+    """ Squares before every non-capturing, non-promoting move the side not to move could have just made"""
+    mover = turn ^ 1
+    occupied = 0
+    for square in squares:
+        occupied |= 1 << square
+
+    for position, (code, square) in enumerate(zip(codes, squares)):
+        if (code >= 6) != mover:
+            continue
+        kind = code % 6
+        if kind == PAWN_KIND:
+            step = 8 if mover else -8  # back towards the pawn's own side
+            rank = square >> 3
+            origins = 0
+            if rank != (6 if mover else 1) and not occupied & (1 << (square + step)):
+                origins = 1 << (square + step)
+                if rank == (4 if mover else 3) and not occupied & (1 << (square + 2 * step)):
+                    origins |= 1 << (square + 2 * step)
+        else:
+            origins = piece_attacks(kind, mover, square, occupied) & ~occupied
+
+        while origins:
+            bit = origins & -origins
+            origins ^= bit
+            new_squares = list(squares)
+            new_squares[position] = bit.bit_length() - 1
+            yield new_squares
+
+
+def _init_worker(task: tuple[str, str, int]) -> tuple[int, bytes, bytes, list[int], list[tuple[int, int]]]:
+    """ Counts the moves of every position of one white king slot
+
+        (slot, values, move counts (INVALID for no position), checkmates, (ply, index) events for moves leaving the
+        table to a decided position)
+    """
+    name, directory, slot = task
+    signature = Signature(name)
+    codes = signature.codes
+    tablebase = Tablebase(directory)
+
+    first = slot * signature.slot_size
+    values = bytearray([INVALID]) * signature.slot_size
+    counts = bytearray([INVALID]) * signature.slot_size
+    mates, events = [], []
+    try:
+        for offset in range(signature.slot_size):
+            index = first + offset
+            squares, turn = signature.decode(index)
+            if not _is_valid(codes, squares, turn) or signature.index(squares, turn) != index:
+                continue
+
+            successors, count = set(), 0
+            for new_codes, new_squares in _moves(codes, squares, turn):
+                if new_codes is codes:
+                    successors.add(signature.index(new_squares, turn ^ 1))
+                    continue
+                count += 1
+                value = tablebase.value(new_codes, new_squares, turn ^ 1)
+                if value != DRAW:
+                    events.append((value - 1, index))  # acts when the plies of the other tables are reached
+
+            count += len(successors)
+            if count == 0:
+                if _in_check(codes, squares, turn, sum(1 << square for square in squares)):
+                    values[offset] = 1
+                    mates.append(index)
+                else:
+                    values[offset] = DRAW
+            counts[offset] = count
+    finally:
+        tablebase.close()
+    return slot, bytes(values), bytes(counts), mates, events
+
+
+def _unmove_worker(task: tuple[str, list[int]]) -> list[list[int]]:
+    """ Indexes of the positions one move before each of ``task``'s positions"""
+    name, indexes = task
+    signature = Signature(name)
+    predecessors = []
+    for index in indexes:
+        squares, turn = signature.decode(index)
+        predecessors.append(list({signature.index(previous, turn ^ 1)
+                                  for previous in _unmoves(signature.codes, squares, turn)}))
+    return predecessors
+
+
+def generate(name: str, directory: str, workers: Optional[int] = None, verbose: bool = False) -> Optional[str]:
+    """ Writes the table of ``name`` to ``directory`` (and first any missing table it depends on), returns its path
+
+        None for a signature nobody can win (DRAWN_SIGNATURES).
+    """
+    signature = Signature(name)
+    if signature.name in DRAWN_SIGNATURES:
+        return None
+    for child in sorted(signature.children()):
+        if child not in DRAWN_SIGNATURES and not os.path.exists(_path(directory, child)):
+            generate(child, directory, workers, verbose)
+
+    start = time.perf_counter()
+    values = bytearray(signature.size)
+    counts = bytearray(signature.size)
+    events = defaultdict(list)
+    frontier = []
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        tasks = [(signature.name, directory, slot) for slot in range(len(signature.slot_squares))]
+        for slot, slot_values, slot_counts, mates, slot_events in executor.map(_init_worker, tasks):
+            first = slot * signature.slot_size
+            values[first:first + signature.slot_size] = slot_values
+            counts[first:first + signature.slot_size] = slot_counts
+            frontier += mates
+            for plies, index in slot_events:
+                events[plies].append(index)
+
+        # plies: mate distance of the frontier, everything decided next is one ply further
+        plies = 0
+        chunk_size = 4096
+        while frontier or any(key >= plies for key in events):
+            tasks = [(signature.name, frontier[first:first + chunk_size])
+                     for first in range(0, len(frontier), chunk_size)]
+            predecessor_lists = [index for chunk in executor.map(_unmove_worker, tasks) for index in chunk]
+            predecessor_lists.append(events.pop(plies, []))
+
+            next_frontier = []
+            lost = plies % 2 == 0  # the frontier side to move is mated: every predecessor wins
+            for predecessors in predecessor_lists:
+                for index in predecessors:
+                    if counts[index] == INVALID or values[index] != INVALID:
+                        continue
+                    if not lost:
+                        counts[index] -= 1
+                        if counts[index]:
+                            continue
+                    if plies + 1 > MAX_PLIES:  # the value would collide with INVALID
+                        raise ValueError(f"{signature.name} has mates longer than {MAX_PLIES} plies")
+                    values[index] = plies + 2
+                    next_frontier.append(index)
+
+            if verbose and frontier:
+                print(f"{signature.name}: {len(frontier)} positions mate in {plies} plies")
+            frontier = next_frontier
+            plies += 1
+
+    # positions neither side can force a mate from
+    for index in range(signature.size):
+        if values[index] == INVALID and counts[index] != INVALID:
+            values[index] = DRAW
+
+    os.makedirs(directory, exist_ok=True)
+    path = _path(directory, signature.name)
+    with open(path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION, signature.size))
+        file.write(values)
+    if verbose:
+        print(f"{signature.name}: {signature.size} entries in {time.perf_counter() - start:.2f}s")
+    return path
+
+
+def _path(directory: str, name: str) -> str:
+    return os.path.join(directory, f"{name}.tb")
+
+
+@dataclass
+class TablebaseResult:
+    wdl: int  # 1 win, 0 draw, -1 loss for the side to move
+    plies: int  # to mate, 0 for a draw
+
+    @property
+    def moves(self) -> int:
+        """ Moves to mate (of the winning side)"""
+        return (self.plies + 1) // 2
+
+
+class Tablebase:
+    """ Tables of a directory, memory-mapped on first use; use it as a context manager or ``close`` it"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._tables: dict[str, tuple[Signature, mmap.mmap]] = {}
+
+    def __enter__(self) -> Tablebase:
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def close(self) -> None:
+        for _, data in self._tables.values():
+            data.close()
+        self._tables.clear()
+
+    def _table(self, name: str) -> tuple[Signature, mmap.mmap]:
+        if name not in self._tables:
+            signature = Signature(name)
+            with open(_path(self.directory, name), "rb") as file:
+                data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, size = HEADER.unpack_from(data)
+            if magic != MAGIC or version != VERSION or size != signature.size or len(data) != HEADER_SIZE + size:
+                data.close()
+                raise ValueError(f"{_path(self.directory, name)} is not a version {VERSION} {name} table")
+            self._tables[name] = signature, data
+        return self._tables[name]
+
+    def value(self, codes, squares: list[int], turn: int) -> int:
+        """ Table byte of a position given as piece codes, squares (a1 = 0) and side to move (0 = white)"""
+        name, squares, turn = _normalize(codes, squares, turn)
+        if name in DRAWN_SIGNATURES:
+            return DRAW
+        signature, data = self._table(name)
+        return data[HEADER_SIZE + signature.index(squares, turn)]
+
+    def _probe_value(self, game: Game) -> Optional[int]:
+        """ Table byte of ``game``'s position, None if there is no table for it (or castling rights / en passant)"""
+        if game.castling_rights:
+            return None
+
+        board = game.board
+        turn = 0 if game.turn == WHITE else 1
+        codes, squares = [], []
+        for code in range(12):
+            for index in bits_to_squares(board.bitboards[code]):
+                codes.append(code)
+                squares.append(TO_64[index])
+        if game.en_passant_target is not None:
+            pawns = board.bitboards[PAWN_KIND + 6 * turn]
+            if PAWN_ATTACKS[turn ^ 1][TO_64[game.en_passant_target]] & pawns:
+                return None
+
+        try:
+            return self.value(codes, squares, turn)
+        except FileNotFoundError:
+            return None
+
+    def probe(self, game: Game) -> Optional[TablebaseResult]:
+        """ Result of ``game``'s position, None if there is no table for it (or it has castling rights / en passant)
+            or the position is illegal (INVALID, the side not to move is in check)
+        """
+        value = self._probe_value(game)
+        if value is None or value == INVALID:
+            return None
+        if value == DRAW:
+            return TablebaseResult(0, 0)
+        plies = value - 1
+        return TablebaseResult(1 if plies % 2 else -1, plies)
+
+    def best_move(self, game: Game) -> Optional[int]:
+        """ Legal move keeping the best result: fastest mate when winning, slowest when losing; None without a table
+            or for an illegal position
+        """
+        if self.probe(game) is None:
+            return None
+
+        best_move, best_score = None, None
+        for move in game.legal_moves():
+            game.push(move)
+            value = self._probe_value(game)
+            game.pop()
+            if value is None:
+                return None
+            if value == INVALID:
+                continue
+            # the value is the opponent's: their loss is our win
+            plies = value - 1
+            score = 0 if value == DRAW else 1000 - plies if plies % 2 == 0 else -1000 + plies
+            if best_score is None or score > best_score:
+                best_move, best_score = move, score
+        return best_move
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Generate endgame tables or probe a position")
+    parser.add_argument("signatures", nargs="*", help="material to generate, e.g. KQvK KPvK")
+    parser.add_argument("--dir", default="tables", help="directory of the table files")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--probe", default=None, metavar="FEN")
+    args = parser.parse_args(argv)
+
+    for name in args.signatures:
+        generate(name, args.dir, args.workers, verbose=True)
+
+    if args.probe is not None:
+        from game import move_notation
+
+        game = Game.from_fen(args.probe)
+        with Tablebase(args.dir) as tablebase:
+            result = tablebase.probe(game)
+            if result is None:
+                print("not in the tables")
+                return 1
+            outcome = {1: "win", 0: "draw", -1: "loss"}[result.wdl]
+            print(f"{outcome}" + (f", mate in {result.moves} ({result.plies} plies)" if result.wdl else ""))
+            best_move = tablebase.best_move(game)
+            if best_move is not None:
+                print(f"bestmove {move_notation(best_move)}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
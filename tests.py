@@ -1,10 +1,28 @@
+import asyncio
 import logging
 import os
+import random
 import sys
+import tempfile
 import traceback
-from typing import Iterator, Union, Literal
-from game import BoardCoordinates, Game, Piece, InvalidPosition, Player, BLACK, WHITE
+from typing import Callable, Iterator, Union, Literal
+from board_layout import square_index
+from book import ENTRY, OpeningBook, polyglot_key
+from captures import static_exchange
+from default_positions import starting_fen
+from engine import MATE_SCORE, Engine, _score_from_tt, _score_to_tt
+from evaluation import compute_scores, evaluate
+from game import BoardCoordinates, Game, Piece, InvalidPosition, Player, BLACK, MOVEGEN_BACKENDS, WHITE, move_notation
 from main import Chess
+from movecache import MoveCache
+from perft import REFERENCE_POSITIONS, run_suite
+from pgn import PGNGame, game_spans, game_to_pgn, parse_headers, parse_pgn, read_games, validate_game
+from pieces import COLOUR_INDEX, KING_KIND, PAWN_KIND, QUEEN_KIND
+from positions import PositionFile, pack_position, unpack_position, write_positions
+from server import GameServer
+from tablebase import Tablebase, generate
+from transposition import EXACT, LOWER_BOUND, UPPER_BOUND, SharedTranspositionTable, TranspositionTable
+from zobrist import compute_key
 
 
 LAST: Literal[None] = None
@@ -26,6 +44,18 @@ class InvalidTestPiece(Exception):
         super().__init__(f"Invalid test piece selection: {piece_coords}")
 
 
+class PerftMismatch(Exception):
+    """Reference position perft count differs"""
+    def __init__(self, movegen: str):
+        super().__init__(f"perft mismatch with move generation backend: {movegen}")
+
+
+class CheckFailed(Exception):
+    """Module check gives a wrong result"""
+    def __init__(self, check: str):
+        super().__init__(f"check failed: {check}")
+
+
 class NextTest(Exception):
     """raised when current test finishes"""
     pass
@@ -133,6 +163,361 @@ class Test:
             raise InvalidTestCoords(test_coords)
 
 
+def check_pgn() -> None:
+    """ Games written by game_to_pgn read back with the same tags and moves, and a wrapped comment going on with a
+        line starting with [ stays in its game
+    """
+    rng = random.Random(0)
+    written = []
+    for number, (_, fen, _) in enumerate(REFERENCE_POSITIONS * 3):
+        game = Game.from_fen(fen)
+        for _ in range(rng.randrange(1, 80)):
+            moves = game.legal_moves()
+            if not moves:
+                break
+            game.push(rng.choice(moves))
+        headers = {"Event": f'round trip {number} "quoted" \\ backslash'}
+        written.append((game_to_pgn(game, headers), headers, [entry[0] for entry in game._undo_stack], game.to_fen()))
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "games.pgn")
+        with open(path, "w") as file:
+            file.write("\n".join(pgn for pgn, _, _, _ in written))
+        games = list(read_games(path))
+
+    if len(games) != len(written):
+        raise CheckFailed("PGN round trip game count")
+    for pgn_game, (_, headers, moves, fen) in zip(games, written):
+        game = pgn_game.replay()
+        if pgn_game.headers["Event"] != headers["Event"] or [entry[0] for entry in game._undo_stack] != moves or \
+                game.to_fen() != fen or not validate_game(pgn_game).valid:
+            raise CheckFailed(f"PGN round trip of {headers['Event']}")
+
+    pgn = '[Event "a"]\n\n1. e4 {\n[%clk 0:01:00] } e5 2. Nf3 *\n\n[Event "b"]\n\n1. d4 *\n'
+    data = pgn.encode()
+    games = [PGNGame(parse_headers(data[start:movetext_start]), data[movetext_start:end], start)
+             for start, movetext_start, end in game_spans(data)]
+    if [(game.headers["Event"], game.san_moves()) for game in games] != [("a", ["e4", "e5", "Nf3"]), ("b", ["d4"])]:
+        raise CheckFailed("PGN game boundaries")
+    if parse_pgn("1. e4 {\n[%clk 0:01:00] } e5 2. Nf3 *").san_moves() != ["e4", "e5", "Nf3"]:
+        raise CheckFailed("PGN comment starting a line with [")
+
+
+def _random_walk(check: Callable[[Game], bool], name: str, seed: int = 0) -> None:
+    """ Random push / pop walks from the reference positions, ``check`` has to hold after every push and pop
+
+        The walk has to have gone through castling, en passant and promotion on both sides of the check.
+    """
+    rng = random.Random(seed)
+    seen = set()
+    for fen in [fen for _, fen, _ in REFERENCE_POSITIONS] + ["n3k3/1P6/8/2pP4/8/8/6p1/4K2R w K c6 0 1",
+                                                           "4k3/8/8/8/3pP3/8/8/4K3 b - e3 0 1"]:
+        for _ in range(10):
+            game = Game.from_fen(fen)
+            for _ in range(40):
+                moves = game.legal_moves()
+                if not moves or rng.random() < 0.2 and game._undo_stack:
+                    if not game._undo_stack:
+                        break
+                    game.pop()
+                else:
+                    move = rng.choice(moves)
+                    piece = game.board.squares[move & 0x7F]
+                    if piece.kind == KING_KIND and abs((move >> 7 & 0x7F) - (move & 0x7F)) == 2:
+                        seen.add("castling")
+                    elif piece.kind == PAWN_KIND and move >> 7 & 0x7F == game.en_passant_target:
+                        seen.add("en passant")
+                    elif move >> 14:
+                        seen.add("promotion")
+                    game.push(move)
+                if not check(game):
+                    raise CheckFailed(f"{name} at {game.to_fen()}")
+    if seen != {"castling", "en passant", "promotion"}:
+        raise CheckFailed(f"{name} walk missed some move kinds, only saw {sorted(seen)}")
+
+
+def check_incremental_state() -> None:
+    """ The Zobrist key and evaluation sums kept by push / pop equal the ones computed from scratch"""
+    _random_walk(lambda game: game.zobrist_key == compute_key(game), "incremental Zobrist key")
+    _random_walk(lambda game: (game.board.mg_score, game.board.eg_score, game.board.phase)
+                 == compute_scores(game.board), "incremental evaluation sums")
+
+
+def _random_fens(count: int, seed: int = 0) -> list[str]:
+    """ FENs of the positions of random games played out of the reference positions"""
+    rng = random.Random(seed)
+    starts = [fen for _, fen, _ in REFERENCE_POSITIONS]
+    fens = []
+    while len(fens) < count:
+        game = Game.from_fen(starts[len(fens) % len(starts)])
+        for _ in range(60):
+            moves = game.legal_moves()
+            if not moves or len(fens) == count:
+                break
+            game.push(rng.choice(moves))
+            fens.append(game.to_fen())
+    return fens
+
+
+def check_batch() -> None:
+    """ Batch evaluation and legal move counts equal Game's for the same positions (skipped without NumPy)"""
+    try:
+        import batch
+    except ImportError:
+        return
+
+    games = [Game.from_fen(fen) for fen in _random_fens(500)]
+    bitboards, white_to_move, castling_rights, en_passant = batch.pack_games(games)
+    if batch.evaluate(bitboards, white_to_move).tolist() != [evaluate(game) for game in games]:
+        raise CheckFailed("batch evaluation")
+    counts = batch.legal_move_counts(bitboards, white_to_move, castling_rights, en_passant)
+    if counts.tolist() != [len(game.legal_moves()) for game in games]:
+        raise CheckFailed("batch legal move counts")
+
+
+def check_positions() -> None:
+    """ Positions written to a position file load back to the same FEN, castling rights without a rook dropped"""
+    fens = _random_fens(500, seed=1)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "positions.bin")
+        write_positions(path, (Game.from_fen(fen) for fen in fens))
+        with PositionFile(path) as positions:
+            game = Game.from_fen(fens[0])
+            loaded = [positions.load(n, game).to_fen() for n in range(len(positions))]
+            if loaded != fens:
+                raise CheckFailed("position record round trip")
+
+    game = Game.from_fen("4k3/8/8/8/8/8/8/4K2R w K - 0 1")
+    record = pack_position(game)
+    game.board.set("h1", None)
+    unpack_position(pack_position(game)[:24] + record[24:], game)
+    if game.castling_rights:
+        raise CheckFailed("position record castling rights without a rook")
+
+
+# moves from the start position -> key, the reference keys of the Polyglot format description
+POLYGLOT_KEYS = [
+    ([], 0x463B96181691FC9C),
+    (["e2e4"], 0x823C9B50FD114196),
+    (["e2e4", "d7d5"], 0x0756B94461C50FB0),
+    (["e2e4", "d7d5", "e4e5"], 0x662FAFB965DB29D4),
+    (["e2e4", "d7d5", "e4e5", "f7f5"], 0x22A48B5A8E47FF78),
+    (["e2e4", "d7d5", "e4e5", "f7f5", "e1e2"], 0x652A607CA3F242C1),
+    (["e2e4", "d7d5", "e4e5", "f7f5", "e1e2", "e8f7"], 0x00FDD303C946BDD9),
+    (["a2a4", "b7b5", "h2h4", "b5b4", "c2c4"], 0x3C8123EA7B067637),
+    (["a2a4", "b7b5", "h2h4", "b5b4", "c2c4", "b4c3", "a1a3"], 0x5C3F9B829B279560),
+]
+
+
+def check_book() -> None:
+    """ Polyglot keys match the reference keys, book moves (castling included) decode to the legal moves"""
+    for moves, key in POLYGLOT_KEYS:
+        game = Game.from_fen(starting_fen)
+        for move in moves:
+            game.push(square_index(move[:2]) | square_index(move[2:]) << 7)
+        if polyglot_key(game) != key:
+            raise CheckFailed(f"Polyglot key after {' '.join(moves) or 'no moves'}")
+
+    start = Game.from_fen(starting_fen)
+    castling = Game.from_fen("r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1")
+    # Polyglot moves: to file, to rank, from file, from rank 3 bits each; e1h1 is white castling king side
+    entries = sorted([(polyglot_key(start), 796, 2, 0), (polyglot_key(start), 731, 1, 0),  # e2e4, d2d4
+                      (polyglot_key(castling), 263, 1, 0)])  # e1h1
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "book.bin")
+        with open(path, "wb") as file:
+            file.write(b"".join(ENTRY.pack(*entry) for entry in entries))
+        with OpeningBook(path) as opening_book:
+            found = ([move_notation(book_move.move) for book_move in opening_book.moves(start)],
+                     [move_notation(book_move.move) for book_move in opening_book.moves(castling)])
+    if found != (["e2e4", "d2d4"], ["e1g1"]):
+        raise CheckFailed(f"Polyglot book moves {found}")
+
+
+def check_move_cache() -> None:
+    """ Games sharing a move cache get the moves of their own position, castling rights and en passant included"""
+    cache = MoveCache(1000)
+    pairs = [("r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1", "r3k2r/8/8/8/8/8/8/R3K2R w - - 0 1"),
+             ("4k3/8/8/8/3pP3/8/8/4K3 b - e3 0 1", "4k3/8/8/8/3pP3/8/8/4K3 b - - 0 1")]
+    for first_fen, same_pieces_fen in pairs:
+        for fen in (first_fen, same_pieces_fen, first_fen):
+            game = Game.from_fen(fen, move_cache=cache)
+            if sorted(game.legal_moves()) != sorted(game._generate_legal_moves()):
+                raise CheckFailed(f"cached legal moves of {fen}")
+            king = game.board.squares[game.board.king_squares[COLOUR_INDEX[game.turn]]]
+            if game.get_legal_moves(king) != game._get_piece_legal_moves(king):
+                raise CheckFailed(f"cached king moves of {fen}")
+
+    # a cache small enough to evict, positions seen again the other way round
+    cache = MoveCache(200)
+    fens = _random_fens(400, seed=2)
+    for fen in fens + fens[::-1]:
+        game = Game.from_fen(fen, move_cache=cache)
+        if sorted(game.legal_moves()) != sorted(game._generate_legal_moves()):
+            raise CheckFailed(f"cached legal moves of {fen}")
+    if not cache.hits or not cache.evictions:
+        raise CheckFailed(f"move cache never hit or evicted: {cache.stats()}")
+
+
+def _placement(pieces: dict[int, str]) -> str:
+    """ FEN piece placement of {square (a1 = 0): FEN letter}"""
+    ranks = []
+    for rank in range(7, -1, -1):
+        row, empty = "", 0
+        for file in range(8):
+            letter = pieces.get(rank * 8 + file)
+            if letter is None:
+                empty += 1
+            else:
+                row, empty = row + (str(empty) if empty else "") + letter, 0
+        ranks.append(row + (str(empty) if empty else ""))
+    return "/".join(ranks)
+
+
+def check_tablebase() -> None:
+    """ Every KQvK probe is the minimax of its children's probes, illegal positions probe as None"""
+    rng = random.Random(3)
+    with tempfile.TemporaryDirectory() as directory:
+        generate("KQvK", directory, workers=1)
+        with Tablebase(directory) as tablebase:
+            if tablebase.probe(Game.from_fen("k7/8/1K6/8/8/8/8/7Q w - - 0 1")) is not None:
+                raise CheckFailed("tablebase probe of a position with the side not to move in check")
+
+            checked = 0
+            while checked < 200:
+                pieces = dict(zip(rng.sample(range(64), 3), "KkQ" if rng.random() < 0.5 else "Kkq"))
+                game = Game.from_fen(f"{_placement(pieces)} {rng.choice('wb')} - - 0 1")
+                result = tablebase.probe(game)
+                if result is None:  # the side not to move is in check (or the kings touch)
+                    continue
+
+                children = []
+                for move in game.legal_moves():
+                    game.push(move)
+                    children.append(tablebase.probe(game))
+                    game.pop()
+                if not children:
+                    expected = (-1, 0) if game.check_if_in_check() else (0, 0)
+                elif any(child.wdl < 0 for child in children):
+                    expected = (1, 1 + min(child.plies for child in children if child.wdl < 0))
+                elif any(child.wdl == 0 for child in children):
+                    expected = (0, 0)
+                else:
+                    expected = (-1, 1 + max(child.plies for child in children))
+                if (result.wdl, result.plies) != expected:
+                    raise CheckFailed(f"tablebase probe of {game.to_fen()}")
+                checked += 1
+
+
+def check_server() -> None:
+    """ Requests and bad lines get a response each, errors as {"ok": False, "error": ...}, ids echoed"""
+    async def run() -> list[dict]:
+        server = GameServer(workers=1)
+        try:
+            lines = [b"5", b'"x"', b"[]", b"not json", b'{"cmd": "nope", "id": 7}',
+                     b'{"cmd": "new", "fen": "4k3/8/8/8/8/8/8/4K3 w K - 0 1", "id": "a"}',
+                     b'{"cmd": "move", "game": 1, "move": "e1g1"}', b'{"cmd": "move", "game": 1, "move": "e1e2"}',
+                     b'{"cmd": "engine", "game": 1, "depth": 0}', b'{"cmd": "moves", "game": 2}']
+            return [await server.handle_line(line) for line in lines]
+        finally:
+            server.shutdown()
+
+    responses = asyncio.run(run())
+    if any(response.get("ok") is not False or "error" not in response for response in responses[:5]):
+        raise CheckFailed(f"server error responses {responses[:5]}")
+    if responses[4].get("id") != 7 or responses[5].get("id") != "a" or not responses[5]["ok"]:
+        raise CheckFailed(f"server request ids {responses[4:6]}")
+    if responses[6].get("status") != "INVALID_MOVE" or responses[7].get("status") != "VALID_MOVE":
+        raise CheckFailed(f"server moves {responses[6:8]}")
+    if not responses[8].get("ok") or responses[8].get("depth") != 1 or responses[9].get("ok") is not False:
+        raise CheckFailed(f"server engine / unknown game {responses[8:]}")
+
+
+# FEN, plies to mate (negative: the side to move gets mated, 0: it is checkmated)
+MATES = [
+    ("6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1", 1),
+    ("r1bqkbnr/pppp1ppp/2n5/4p3/2B1P3/5Q2/PPPP1PPP/RNB1K1NR w KQkq - 0 1", 1),
+    ("7k/8/5K2/8/8/8/8/1R6 w - - 0 1", 3),
+    ("7k/5K2/8/8/8/8/8/1R6 b - - 0 1", -2),
+    ("R5k1/5ppp/8/8/8/8/8/6K1 b - - 0 1", 0),
+]
+
+
+def check_engine() -> None:
+    """ The search finds forced mates at their exact distance, and plays a mate in one"""
+    for fen, plies in MATES:
+        game = Game.from_fen(fen)
+        result = Engine(game).search(4)
+        expected = MATE_SCORE - plies if plies > 0 else -MATE_SCORE - plies
+        if result.score != expected:
+            raise CheckFailed(f"search score {result.score} of {fen}, expected {expected}")
+        if plies == 1:
+            game.push(result.move)
+            if game.legal_moves() or not game.check_if_in_check():
+                raise CheckFailed(f"search move {move_notation(result.move)} of {fen} doesn't mate")
+
+    result = Engine(Game.from_fen("6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1")).search(0)
+    if result.move is None or result.depth != 1:
+        raise CheckFailed("search to depth 0")
+
+
+def check_transposition_table() -> None:
+    """ Store / probe and replacement of both tables, mate scores survive the node-relative round trip"""
+    shared = SharedTranspositionTable(0.001)
+    try:
+        for table in (TranspositionTable(0.001), shared):
+            key, other_key = 0x1234_5678_9ABC_DEF0, 0x1234_5678_9ABC_DEF0 + table.size  # same slot
+            table.new_search()
+            if table.probe(key) is not None or not table.store(key, 0x1234, 6, -MATE_SCORE + 7, UPPER_BOUND):
+                raise CheckFailed(f"{type(table).__name__} empty slot")
+            if table.probe(key) != (0x1234, 6, -MATE_SCORE + 7, UPPER_BOUND):
+                raise CheckFailed(f"{type(table).__name__} store / probe")
+            if table.store(other_key, None, 5, 10, EXACT) or table.probe(other_key) is not None:
+                raise CheckFailed(f"{type(table).__name__} kept a shallower entry over a deeper one")
+            if not table.store(key, None, 2, 30, LOWER_BOUND) or table.probe(key) != (0, 2, 30, LOWER_BOUND):
+                raise CheckFailed(f"{type(table).__name__} same position not overwritten")
+            table.store(key, None, 9, 30, EXACT)
+            table.new_search()  # the depth 9 entry is stale now
+            if not table.store(other_key, None, 1, 10, EXACT) or table.probe(key) is not None:
+                raise CheckFailed(f"{type(table).__name__} stale entry not replaced")
+    finally:
+        shared.close()
+        shared.unlink()
+
+    # a mate stored at one ply and read back two plies deeper is two plies further from the root
+    for score, deeper in ((MATE_SCORE - 5, MATE_SCORE - 7), (-MATE_SCORE + 4, -MATE_SCORE + 6), (250, 250),
+                          (-250, -250)):
+        for ply in (0, 3, 11):
+            stored = _score_to_tt(score, ply)
+            if _score_from_tt(stored, ply) != score or _score_from_tt(stored, ply + 2) != deeper:
+                raise CheckFailed(f"score {score} at ply {ply} through the transposition table")
+
+
+# FEN, from, to, promotion kind, material the side to move wins
+SEE_POSITIONS = [
+    ("1k1r4/1pp4p/p7/4p3/8/P5P1/1PP4P/2K1R3 w - - 0 1", "e1", "e5", 0, 100),
+    ("1k1r3q/1ppn3p/p4b2/4p3/8/P2N2P1/1PP1R1BP/2K1Q3 w - - 0 1", "d3", "e5", 0, -220),
+    ("4k3/8/8/3p4/4Q3/8/8/4K3 w - - 0 1", "e4", "d5", 0, 100),
+    ("4k3/2p5/3p4/4Q3/8/8/8/4K3 w - - 0 1", "e5", "d6", 0, -800),
+    ("4k3/8/8/3pP3/8/8/8/4K3 w - d6 0 1", "e5", "d6", 0, 100),  # en passant
+    ("3rk3/1P6/8/8/8/8/8/4K3 w - - 0 1", "b7", "b8", QUEEN_KIND, -100),
+]
+
+
+def check_see() -> None:
+    """ Static exchange evaluation of captures, en passant and promotions with known outcomes"""
+    for fen, start, end, promotion, expected in SEE_POSITIONS:
+        move = square_index(start) | square_index(end) << 7 | promotion << 14
+        value = static_exchange(Game.from_fen(fen).board, move)
+        if value != expected:
+            raise CheckFailed(f"static exchange {start}{end} of {fen} is {value}, expected {expected}")
+
+
+# deterministic checks of the modules around the game, run before the scenarios
+CHECKS = [check_pgn, check_incremental_state, check_batch, check_positions, check_book, check_move_cache,
+          check_tablebase, check_server, check_engine, check_transposition_table, check_see]
+
+
 def unknown_exception(exception_description):
     template = """
     File: {file_name} @ L{line_number}
@@ -156,22 +541,35 @@ def unknown_exception(exception_description):
 
 if __name__ == "__main__":
     try:
-        tests = Test()
-        _Chess = Chess
-        _Chess.start = tests.start
-        _Chess.get_player_input = tests.get_player_input
-        while True:
-            current_game = _Chess()
-
-            try:
-                current_game.start_game_loop()
-
-            except NextTest:
-                continue
-
-            except LastTest:
-                break
-
-        tests.finished_tests()
+        for check in CHECKS:
+            check()
+
+        # every scenario has to pass with every move generation backend, with and without attack maps
+        for movegen, attack_maps in [(movegen, attack_maps) for movegen in MOVEGEN_BACKENDS
+                                     for attack_maps in (False, True)]:
+            tests = Test()
+            _Chess = Chess
+            _Chess.movegen = movegen
+            _Chess.attack_maps = attack_maps
+            _Chess.start = tests.start
+            _Chess.get_player_input = tests.get_player_input
+            print(f"Move generation: {movegen}, attack maps: {attack_maps}")
+            while True:
+                current_game = _Chess()
+
+                try:
+                    current_game.start_game_loop()
+
+                except NextTest:
+                    continue
+
+                except LastTest:
+                    break
+
+            # the reference positions' perft counts are the move generation regression gate
+            if not run_suite(3, movegen, attack_maps, verbose=False):
+                raise PerftMismatch(movegen)
+
+            tests.finished_tests()
     except Exception as e:
         unknown_exception(e)
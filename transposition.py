@@ -0,0 +1,175 @@
+""" Transposition table
+
+    Fixed size hash table of search results keyed by the 64-bit Zobrist key (``Game.zobrist_key``). Entries live in
+    two flat ``array('Q')`` (key, packed data) instead of a dict of tuples, 16 bytes per entry, so a table of a few
+    hundred MB holds tens of millions of positions without per-entry Python objects.
+
+    Packed data, low bit first:
+        32 bits  score + 2 ** 31
+        17 bits  best move (encoded, see game.encode_move, 0 = none)
+         8 bits  depth
+         2 bits  bound (EXACT / LOWER_BOUND / UPPER_BOUND)
+         5 bits  generation (search number the entry was stored in)
+
+    A slot is empty when its data is 0. Replacement: an entry is only overwritten by a search at least as deep, unless
+    it is stale (stored by an older search) or for the same position.
+"""
+
+from __future__ import annotations
+
+from array import array
+from multiprocessing import shared_memory
+from typing import Optional
+
+EXACT, LOWER_BOUND, UPPER_BOUND = 1, 2, 3
+
+ENTRY_SIZE = 16  # bytes, key + data
+SCORE_OFFSET = 1 << 31
+MOVE_SHIFT, DEPTH_SHIFT, BOUND_SHIFT, GENERATION_SHIFT = 32, 49, 57, 59
+MOVE_MASK, DEPTH_MASK, BOUND_MASK, GENERATION_MASK = (1 << 17) - 1, 0xFF, 0x3, 0x1F
+
+
+class TranspositionTable:
+    def __init__(self, size_mb: float = 16):
+        # power of two number of slots so the index is a mask of the key
+        entries = max(1, int(size_mb * 1024 * 1024) // ENTRY_SIZE)
+        self.size = 1 << (entries.bit_length() - 1)
+        self._mask = self.size - 1
+        self._keys = array("Q", bytes(8 * self.size))
+        self._data = array("Q", bytes(8 * self.size))
+        self.generation = 0
+
+        self.hits = self.misses = self.collisions = self.overwrites = self.stores = 0
+
+    def new_search(self) -> None:
+        """ Entries stored before this call become stale (first to be replaced)"""
+        self.generation = (self.generation + 1) & GENERATION_MASK
+
+    def clear(self) -> None:
+        self._keys = array("Q", bytes(8 * self.size))
+        self._data = array("Q", bytes(8 * self.size))
+        self.generation = 0
+        self.hits = self.misses = self.collisions = self.overwrites = self.stores = 0
+
+    def probe(self, key: int) -> Optional[tuple[int, int, int, int]]:
+        """ (best move, depth, score, bound) stored for ``key``, None on a miss"""
+        index = key & self._mask
+        data = self._data[index]
+        if data == 0:
+            self.misses += 1
+            return None
+
+        if self._keys[index] != key:
+            self.misses += 1
+            self.collisions += 1
+            return None
+
+        self.hits += 1
+        return ((data >> MOVE_SHIFT) & MOVE_MASK, (data >> DEPTH_SHIFT) & DEPTH_MASK,
+                (data & 0xFFFF_FFFF) - SCORE_OFFSET, (data >> BOUND_SHIFT) & BOUND_MASK)
+
+    def store(self, key: int, move: Optional[int], depth: int, score: int, bound: int) -> bool:
+        """ Stores the result unless the slot holds a deeper result of the current search, True if stored"""
+        index = key & self._mask
+        data = self._data[index]
+
+        if data != 0 and self._keys[index] != key:
+            if (data >> GENERATION_SHIFT) == self.generation and (data >> DEPTH_SHIFT) & DEPTH_MASK > depth:
+                return False
+            self.overwrites += 1
+
+        self._keys[index] = key
+        self._data[index] = ((score + SCORE_OFFSET) | (move or 0) << MOVE_SHIFT | depth << DEPTH_SHIFT
+                             | bound << BOUND_SHIFT | self.generation << GENERATION_SHIFT)
+        self.stores += 1
+        return True
+
+    def hashfull(self) -> int:
+        """ Permille of the first 1000 slots used by the current search"""
+        sample = min(1000, self.size)
+        used = sum(1 for data in self._data[:sample] if data and data >> GENERATION_SHIFT == self.generation)
+        return used * 1000 // sample
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "collisions": self.collisions,
+                "overwrites": self.overwrites, "stores": self.stores}
+
+
+class SharedTranspositionTable(TranspositionTable):
+    """ Transposition table in ``multiprocessing.shared_memory`` for several search processes at once
+
+        Entries are two 64-bit words, (key ^ data, data), written without locks. A reader only accepts an entry when
+        the first word XOR the second gives back its key, so an entry torn by two processes writing the same slot at
+        the same time reads as a collision instead of a wrong result.
+
+        The creating process passes ``name`` (and the same ``size_mb``) to the others, which attach to the block. The
+        counters are per process. ``close`` detaches, the creator ``unlink``s the block when every search is done.
+    """
+
+    def __init__(self, size_mb: float = 16, name: Optional[str] = None, generation: int = 0):
+        entries = max(1, int(size_mb * 1024 * 1024) // ENTRY_SIZE)
+        self.size = 1 << (entries.bit_length() - 1)
+        self._mask = self.size - 1
+
+        if name is None:
+            self._shared_memory = shared_memory.SharedMemory(create=True, size=ENTRY_SIZE * self.size)
+        else:
+            self._shared_memory = shared_memory.SharedMemory(name=name)
+        self.name = self._shared_memory.name
+        self._entries = self._shared_memory.buf.cast("Q")
+        self.generation = generation
+
+        self.hits = self.misses = self.collisions = self.overwrites = self.stores = 0
+
+    def close(self) -> None:
+        self._entries.release()
+        self._shared_memory.close()
+
+    def unlink(self) -> None:
+        self._shared_memory.unlink()
+
+    def clear(self) -> None:
+        self._shared_memory.buf[:ENTRY_SIZE * self.size] = bytes(ENTRY_SIZE * self.size)
+        self.generation = 0
+        self.hits = self.misses = self.collisions = self.overwrites = self.stores = 0
+
+    def probe(self, key: int) -> Optional[tuple[int, int, int, int]]:
+        index = (key & self._mask) << 1
+        entries = self._entries
+        data = entries[index + 1]
+        if data == 0:
+            self.misses += 1
+            return None
+
+        if entries[index] ^ data != key:
+            self.misses += 1
+            self.collisions += 1
+            return None
+
+        self.hits += 1
+        return ((data >> MOVE_SHIFT) & MOVE_MASK, (data >> DEPTH_SHIFT) & DEPTH_MASK,
+                (data & 0xFFFF_FFFF) - SCORE_OFFSET, (data >> BOUND_SHIFT) & BOUND_MASK)
+
+    def store(self, key: int, move: Optional[int], depth: int, score: int, bound: int) -> bool:
+        index = (key & self._mask) << 1
+        entries = self._entries
+        data = entries[index + 1]
+
+        if data != 0 and entries[index] ^ data != key:
+            if (data >> GENERATION_SHIFT) == self.generation and (data >> DEPTH_SHIFT) & DEPTH_MASK > depth:
+                return False
+            self.overwrites += 1
+
+        data = ((score + SCORE_OFFSET) | (move or 0) << MOVE_SHIFT | depth << DEPTH_SHIFT | bound << BOUND_SHIFT
+                | self.generation << GENERATION_SHIFT)
+        entries[index] = key ^ data
+        entries[index + 1] = data
+        self.stores += 1
+        return True
+
+    def hashfull(self) -> int:
+        sample = min(1000, self.size)
+        entries = self._entries
+        used = sum(1 for index in range(sample)
+                   if entries[2 * index + 1] and entries[2 * index + 1] >> GENERATION_SHIFT == self.generation)
+        return used * 1000 // sample
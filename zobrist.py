@@ -0,0 +1,57 @@
+""" Zobrist hashing
+
+    A position key is the XOR of one random 64-bit number per (piece, square) on the board, one for black to move, one
+    per castling rights combination and one per en passant file. Moving a piece is then two XORs, which is how
+    Board._put / Board._remove and Game.push keep ``Game.zobrist_key`` up to date.
+
+    The numbers come from a fixed seed so keys are stable between runs and processes.
+"""
+
+from __future__ import annotations
+
+import random
+
+from board_layout import BOARD_SQUARES
+
+
+_random = random.Random(0x2F0B_C3A1)
+
+# piece code -> 0x88 index -> key
+PIECE_KEYS: list[list[int]] = [[0] * 128 for _ in range(12)]
+for _code in range(12):
+    for _index in BOARD_SQUARES:
+        PIECE_KEYS[_code][_index] = _random.getrandbits(64)
+
+SIDE_KEY = _random.getrandbits(64)  # XORed in when black is to move
+
+# castling rights bit flags -> key (one number per right, combined)
+_castling_right_keys = [_random.getrandbits(64) for _ in range(4)]
+CASTLING_KEYS = [0] * 16
+for _rights in range(16):
+    for _bit in range(4):
+        if _rights & (1 << _bit):
+            CASTLING_KEYS[_rights] ^= _castling_right_keys[_bit]
+
+EN_PASSANT_KEYS = [_random.getrandbits(64) for _ in range(8)]  # by file
+
+
+def state_key(black_to_move: bool, castling_rights: int, en_passant_target) -> int:
+    """ Everything but the pieces"""
+    key = CASTLING_KEYS[castling_rights]
+    if black_to_move:
+        key ^= SIDE_KEY
+    if en_passant_target is not None:
+        key ^= EN_PASSANT_KEYS[en_passant_target & 7]
+    return key
+
+
+def compute_key(game) -> int:
+    """ Key of ``game``'s position from scratch (what the incremental key must always equal)"""
+    key = 0
+    squares = game.board.squares
+    for index in BOARD_SQUARES:
+        piece = squares[index]
+        if piece is not None:
+            key ^= PIECE_KEYS[piece.code][index]
+
+    return key ^ state_key(game.turn == "BLACK", game.castling_rights, game.en_passant_target)